@@ -25,6 +25,8 @@ import time
 import base64
 import string
 import tempfile
+import threading
+import contextlib
 
 import boto
 import boto.ec2
@@ -36,9 +38,13 @@ from starcluster import image
 from starcluster import utils
 from starcluster import static
 from starcluster import spinner
+from starcluster import threadpool
 from starcluster import sshutils
 from starcluster import webtools
 from starcluster import exception
+from starcluster import ratelimit
+from starcluster import s3transfer
+from starcluster import spotstore
 from starcluster import progressbar
 from starcluster.utils import print_timing
 from starcluster.logger import log
@@ -125,10 +131,26 @@ class EasyEC2(EasyAWS):
         self._regions = None
         self._account_attrs = None
         self._account_attrs_region = None
+        self._pool = None
+        self._spot_store = None
+        self.governor = ratelimit.get_governor()
+        self._tag_cache = {}
+        self._tag_lock = threading.RLock()
+        self._tag_batch_depth = 0
+        self._pending_tags = {}
+        self._pending_tag_removals = {}
 
     def __repr__(self):
         return '<EasyEC2: %s (%s)>' % (self.region.name, self.region.endpoint)
 
+    @property
+    def conn(self):
+        """
+        The EC2 connection with all of its requests routed through this
+        object's rate governor
+        """
+        return self.governor.govern(super(EasyEC2, self).conn)
+
     def _fetch_account_attrs(self):
         acct_attrs = self._account_attrs
         if not acct_attrs or self._account_attrs_region != self.region.name:
@@ -164,6 +186,27 @@ class EasyEC2(EasyAWS):
         self.reload()
         return self
 
+    def for_region(self, region_name):
+        """
+        Returns a new EasyEC2 object with the same credentials and connection
+        settings connected to region_name. Unlike connect_to_region this
+        leaves the current object untouched so that several regions can be
+        used concurrently.
+        """
+        region = self.get_region(region_name)
+        ec2 = EasyEC2(self.aws_access_key_id, self.aws_secret_access_key)
+        ec2._kwargs = dict(self._kwargs, region=region)
+        ec2._regions = self._regions
+        ec2.s3 = self.s3
+        return ec2
+
+    @property
+    def pool(self):
+        if not self._pool:
+            self._pool = threadpool.get_thread_pool(size=20,
+                                                    disable_threads=False)
+        return self._pool
+
     @property
     def region(self):
         """
@@ -220,13 +263,14 @@ class EasyEC2(EasyAWS):
                 return img
 
     def _wait_for_group_deletion_propagation(self, group):
+        poll = ratelimit.PollInterval(5)
         if isinstance(group, boto.ec2.placementgroup.PlacementGroup):
             while self.get_placement_group_or_none(group.name):
-                time.sleep(5)
+                poll.sleep()
         else:
             assert isinstance(group, boto.ec2.securitygroup.SecurityGroup)
             while self.get_group_or_none(group.name):
-                time.sleep(5)
+                poll.sleep()
 
     def get_subnet(self, subnet_id):
         try:
@@ -256,12 +300,15 @@ class EasyEC2(EasyAWS):
         This method deletes a security or placement group using group.delete()
         but in the case that group.delete() throws a DependencyViolation error
         or InvalidPlacementGroup.InUse error it will keep retrying until it's
-        successful. Waits 5 seconds between each retry.
+        successful. Waits up to retry_delay seconds (backing off with jitter)
+        between each retry.
         """
         label = 'security'
         if hasattr(group, 'strategy') and group.strategy == 'cluster':
             label = 'placement'
         s = utils.get_spinner("Removing %s group: %s" % (label, group.name))
+        backoff = ratelimit.Backoff(base=1, max_delay=retry_delay,
+                                    full_jitter=False)
         try:
             for i in range(max_retries):
                 try:
@@ -272,13 +319,13 @@ class EasyEC2(EasyAWS):
                     if i == max_retries - 1:
                         raise
                     if e.error_code == 'DependencyViolation':
-                        log.debug('DependencyViolation error - retrying in 5s',
+                        log.debug('DependencyViolation error - retrying',
                                   exc_info=True)
-                        time.sleep(retry_delay)
+                        time.sleep(backoff.delay(i))
                     elif e.error_code == 'InvalidPlacementGroup.InUse':
-                        log.debug('Placement group in use - retrying in 5s',
+                        log.debug('Placement group in use - retrying',
                                   exc_info=True)
-                        time.sleep(retry_delay)
+                        time.sleep(backoff.delay(i))
                     else:
                         raise
         finally:
@@ -296,9 +343,10 @@ class EasyEC2(EasyAWS):
         sg = self.conn.create_security_group(name, description, vpc_id=vpc_id)
         if not self.get_group_or_none(name):
             s = utils.get_spinner("Waiting for security group %s..." % name)
+            poll = ratelimit.PollInterval(3)
             try:
                 while not self.get_group_or_none(name):
-                    time.sleep(3)
+                    poll.sleep()
             finally:
                 s.stop()
         if auth_ssh:
@@ -366,7 +414,8 @@ class EasyEC2(EasyAWS):
         """
         Returns all security groups on this EC2 account
         """
-        return self.conn.get_all_security_groups(filters=filters)
+        sgs = self.conn.get_all_security_groups(filters=filters)
+        return self._cache_tags(sgs)
 
     def get_permission_or_none(self, group, ip_protocol, from_port, to_port,
                                cidr_ip=None):
@@ -420,9 +469,10 @@ class EasyEC2(EasyAWS):
             raise exception.AWSError(
                 "failed to create placement group '%s'" % name)
         pg = self.get_placement_group_or_none(name)
+        poll = ratelimit.PollInterval(3)
         while not pg:
             log.info("Waiting for placement group %s..." % name)
-            time.sleep(3)
+            poll.sleep()
             pg = self.get_placement_group_or_none(name)
         return pg
 
@@ -550,34 +600,38 @@ class EasyEC2(EasyAWS):
         num_reqs = 0
         reqs_ids = []
         max_retries = max(1, max_retries)
-        interval = max(1, interval)
+        poll = ratelimit.PollInterval(max(1, interval))
         widgets = ['', progressbar.Fraction(), ' ',
                    progressbar.Bar(marker=progressbar.RotatingMarker()), ' ',
                    progressbar.Percentage(), ' ', ' ']
         log.info("Waiting for %s to propagate..." % obj_name)
         pbar = progressbar.ProgressBar(widgets=widgets,
                                        maxval=num_objs).start()
+        # the adaptive interval shortens as objects appear so bound the wait
+        # by the time max_retries fixed intervals would take, not by tries
+        timeout = max_retries * poll.interval
+        i = 0
         try:
-            for i in range(max_retries + 1):
+            while True:
                 reqs = fetch_func(filters=filters)
                 reqs_ids = [req.id for req in reqs]
                 num_reqs = len(reqs)
                 pbar.update(num_reqs)
-                if num_reqs != num_objs:
-                    log.debug("%d: only %d/%d %s have "
-                              "propagated - sleeping..." %
-                              (i, num_reqs, num_objs, obj_name))
-                    if i != max_retries:
-                        time.sleep(interval)
-                else:
+                if num_reqs == num_objs:
                     return
+                if poll.elapsed >= timeout:
+                    break
+                log.debug("%d: only %d/%d %s have propagated - sleeping..." %
+                          (i, num_reqs, num_objs, obj_name))
+                poll.sleep(num_reqs, num_objs)
+                i += 1
         finally:
             if not pbar.finished:
                 pbar.finish()
         missing = [oid for oid in obj_ids if oid not in reqs_ids]
         raise exception.PropagationException(
             "Failed to fetch %d/%d %s after %d seconds: %s" %
-            (num_reqs, num_objs, obj_name, max_retries * interval,
+            (num_reqs, num_objs, obj_name, poll.elapsed,
              ', '.join(missing)))
 
     def wait_for_propagation(self, instances=None, spot_requests=None,
@@ -724,6 +778,201 @@ class EasyEC2(EasyAWS):
                 raise exception.InstanceDoesNotExist(instance_id)
             raise e
 
+    def _cache_tags(self, resources):
+        """
+        Seeds the tag cache with the tags that came back with resources
+        (instances, security groups, volumes, etc) from a Describe* call
+        """
+        with self._tag_lock:
+            for res in resources:
+                tags = getattr(res, 'tags', None)
+                if tags is not None:
+                    self._tag_cache[res.id] = tags
+        return resources
+
+    def get_tags(self, resource, refresh=False):
+        """
+        Returns the tags dictionary for resource (an EC2 object or resource
+        id). Tags are served from the cache if possible otherwise fetched
+        with DescribeTags.
+        """
+        res_id = getattr(resource, 'id', resource)
+        if not refresh:
+            # tags that came with the object are always the freshest
+            self._cache_tags([resource])
+        return self.get_all_tags([res_id], refresh=refresh)[res_id]
+
+    def get_all_tags(self, resource_ids, refresh=False):
+        """
+        Returns a dictionary mapping each of resource_ids to its tags
+        dictionary. Resources missing from the tag cache (or all of them if
+        refresh=True) are fetched using as few DescribeTags requests as
+        possible.
+        """
+        with self._tag_lock:
+            missing = [r for r in resource_ids
+                       if refresh or r not in self._tag_cache]
+            for i in range(0, len(missing), static.MAX_FILTER_VALUES):
+                chunk = missing[i:i + static.MAX_FILTER_VALUES]
+                fetched = dict([(r, {}) for r in chunk])
+                resp = self.conn.get_all_tags(filters={'resource-id': chunk})
+                for tag in resp:
+                    fetched[tag.res_id][tag.name] = tag.value
+                for res_id, tags in fetched.items():
+                    self._tag_cache.setdefault(res_id, {})
+                    self._tag_cache[res_id].clear()
+                    self._tag_cache[res_id].update(tags)
+            return dict([(r, self._tag_cache[r]) for r in resource_ids])
+
+    def _get_cached_tags(self, resource):
+        tags = getattr(resource, 'tags', None)
+        res_id = getattr(resource, 'id', resource)
+        if tags is None:
+            tags = self._tag_cache.setdefault(res_id, {})
+        else:
+            self._tag_cache[res_id] = tags
+        return res_id, tags
+
+    def add_tags(self, resource, tags):
+        """
+        Adds the tags dictionary to resource (an EC2 object or resource id)
+
+        The resource's local tags are updated right away. The CreateTags
+        request is deferred until the outermost tag_batch() block exits so
+        that tags for many resources can be coalesced into few requests.
+        """
+        with self._tag_lock:
+            res_id, cached = self._get_cached_tags(resource)
+            cached.update(tags)
+            removals = self._pending_tag_removals.get(res_id, {})
+            for key in tags:
+                removals.pop(key, None)
+            self._pending_tags.setdefault(res_id, {}).update(tags)
+            flush = not self._tag_batch_depth
+        if flush:
+            self.flush_tags()
+
+    def remove_tags(self, resource, tags):
+        """
+        Removes tags from resource (an EC2 object or resource id). tags is
+        either a list of tag names or a dictionary mapping tag names to the
+        value to remove (None removes the tag regardless of its value).
+        Like add_tags() the DeleteTags request is deferred while inside a
+        tag_batch() block.
+        """
+        if not isinstance(tags, dict):
+            tags = dict.fromkeys(tags)
+        with self._tag_lock:
+            res_id, cached = self._get_cached_tags(resource)
+            pending = self._pending_tags.get(res_id, {})
+            for key in tags:
+                cached.pop(key, None)
+                pending.pop(key, None)
+            self._pending_tag_removals.setdefault(res_id, {}).update(tags)
+            flush = not self._tag_batch_depth
+        if flush:
+            self.flush_tags()
+
+    @contextlib.contextmanager
+    def tag_batch(self):
+        """
+        Context manager that buffers all add_tags/remove_tags calls made
+        within its block and flushes them as multi-resource requests when
+        the outermost block exits:
+
+            with ec2.tag_batch():
+                for node in nodes:
+                    ec2.add_tags(node.instance, {'Name': node.alias})
+        """
+        with self._tag_lock:
+            self._tag_batch_depth += 1
+        try:
+            yield self
+        finally:
+            with self._tag_lock:
+                self._tag_batch_depth -= 1
+                flush = not self._tag_batch_depth
+            if flush:
+                self.flush_tags()
+
+    def _group_tag_requests(self, pending):
+        """
+        Groups pending {resource_id: {key: value}} mutations into a list of
+        (resource_ids, tags) requests. Tags that apply to the exact same set
+        of resources share a request and each request respects EC2's limits
+        on resources/tags per request.
+        """
+        resources_by_tag = {}
+        for res_id, tags in pending.items():
+            for tag in tags.items():
+                resources_by_tag.setdefault(tag, set()).add(res_id)
+        tags_by_resources = {}
+        for tag, res_ids in resources_by_tag.items():
+            key = tuple(sorted(res_ids))
+            tags_by_resources.setdefault(key, []).append(tag)
+        requests = []
+        for res_ids, tags in sorted(tags_by_resources.items()):
+            tags.sort()
+            for i in range(0, len(res_ids), static.MAX_TAG_RESOURCES):
+                ids = list(res_ids[i:i + static.MAX_TAG_RESOURCES])
+                for j in range(0, len(tags), static.MAX_TAGS_PER_RESOURCE):
+                    chunk = tags[j:j + static.MAX_TAGS_PER_RESOURCE]
+                    requests.append((ids, dict(chunk)))
+        return requests
+
+    def _requeue_tags(self, requests):
+        """
+        Puts the mutations of (removal, res_ids, tags) requests that were not
+        sent back into the pending queues unless newer mutations of the same
+        tags were queued in the meantime
+        """
+        with self._tag_lock:
+            for removal, res_ids, tags in requests:
+                queue = self._pending_tags
+                if removal:
+                    queue = self._pending_tag_removals
+                for res_id in res_ids:
+                    newer = set(self._pending_tags.get(res_id, {}))
+                    newer |= set(self._pending_tag_removals.get(res_id, {}))
+                    queued = queue.setdefault(res_id, {})
+                    for key, value in tags.items():
+                        if key not in newer:
+                            queued[key] = value
+
+    def flush_tags(self):
+        """
+        Sends all buffered tag mutations to EC2 and returns the number of
+        CreateTags/DeleteTags requests made. If a request fails its
+        mutations and those of the requests not sent yet stay queued for the
+        next flush and the error is raised.
+        """
+        with self._tag_lock:
+            removals = dict([(r, tags)
+                             for r, tags in self._pending_tag_removals.items()
+                             if tags])
+            additions = dict([(r, tags)
+                              for r, tags in self._pending_tags.items()
+                              if tags])
+            self._pending_tags = {}
+            self._pending_tag_removals = {}
+        requests = [(True, r, t)
+                    for r, t in self._group_tag_requests(removals)]
+        requests += [(False, r, t)
+                     for r, t in self._group_tag_requests(additions)]
+        for i, (removal, res_ids, tags) in enumerate(requests):
+            try:
+                if removal:
+                    self.conn.delete_tags(res_ids, tags)
+                else:
+                    self.conn.create_tags(res_ids, tags)
+            except Exception:
+                self._requeue_tags(requests[i:])
+                raise
+        if requests:
+            log.debug("flushed tags for %d resources in %d request(s)" %
+                      (len(set(removals) | set(additions)), len(requests)))
+        return len(requests)
+
     def get_securityids_from_names(self, groupnames):
         name_id = dict([(sec.name, sec.id) for sec in
                         self.get_all_security_groups(groupnames)])
@@ -747,8 +996,11 @@ class EasyEC2(EasyAWS):
         instances = []
         for res in reservations:
             insts = res.instances
+            for inst in insts:
+                # boto's Instance doesn't keep a reference to its reservation
+                inst.reservation_id = res.id
             instances.extend(insts)
-        return instances
+        return self._cache_tags(instances)
 
     def get_instance(self, instance_id):
         try:
@@ -1129,9 +1381,11 @@ class EasyEC2(EasyAWS):
     @print_timing("Migrating image")
     def migrate_image(self, image_id, destbucket, migrate_manifest=False,
                       kernel_id=None, ramdisk_id=None, region=None, cert=None,
-                      private_key=None):
+                      private_key=None, workers=8):
         """
         Migrate image_id files to destbucket
+
+        workers - number of image files copied concurrently
         """
         if migrate_manifest:
             utils.check_required(['ec2-migrate-manifest'])
@@ -1153,22 +1407,10 @@ class EasyEC2(EasyAWS):
             log.info("No files found for image: %s" % image_id)
             return
         log.info("Migrating image: %s" % image_id)
-        widgets = [files[0].name, progressbar.Percentage(), ' ',
-                   progressbar.Bar(marker=progressbar.RotatingMarker()), ' ',
-                   progressbar.ETA(), ' ', ' ']
-        counter = 0
-        num_files = len(files)
-        pbar = progressbar.ProgressBar(widgets=widgets,
-                                       maxval=num_files).start()
-        for f in files:
-            widgets[0] = "%s: (%s/%s)" % (f.name, counter + 1, num_files)
-            # copy file to destination bucket with the same name
-            f.copy(destbucket, f.name)
-            pbar.update(counter)
-            counter += 1
-        pbar.finish()
+        dbucket = self.s3.get_bucket(destbucket)
+        stats = s3transfer.S3Transfer(workers=workers).copy(files, dbucket)
+        log.info("Migrated %s" % stats)
         if migrate_manifest:
-            dbucket = self.s3.get_bucket(destbucket)
             manifest_key = dbucket.get_key(self.get_image_manifest(image))
             f = tempfile.NamedTemporaryFile()
             manifest_key.get_contents_to_file(f.file)
@@ -1220,9 +1462,10 @@ class EasyEC2(EasyAWS):
                 log.warn("The root device snapshot id is not yet available")
         s = utils.get_spinner("Waiting for '%s' to become available" % ami.id)
         try:
+            poll = ratelimit.PollInterval(10)
             while ami.state != 'available':
                 ami.update()
-                time.sleep(10)
+                poll.sleep()
         finally:
             s.stop()
 
@@ -1230,30 +1473,42 @@ class EasyEC2(EasyAWS):
                                   name=None, description=None,
                                   client_token=None, add_region_to_desc=False,
                                   wait_for_copies=False):
-        current_region = self.region
-        self.connect_to_region(source_region)
-        src_img = self.get_image(source_image_id)
-        regions = self.regions.copy()
-        regions.pop(source_region)
+        """
+        Copies source_image_id from source_region to all other regions and
+        returns a dictionary mapping region name to the CopyImage response.
+
+        The copies are requested concurrently using a separate connection for
+        each region. If wait_for_copies is True, a single ImageCopyTracker
+        waits for all copies to become available and the time each region
+        took is logged once they are done.
+        """
+        src_img = self.for_region(source_region).get_image(source_image_id)
+        regions = [r for r in self.regions if r != source_region]
         log.info("Copying %s to regions:\n%s" %
-                 (src_img.id, ', '.join(regions.keys())))
+                 (src_img.id, ', '.join(regions)))
         name = name or src_img.name
-        resps = {}
-        for r in regions:
-            self.connect_to_region(r)
+        conns = dict([(r, self.for_region(r)) for r in regions])
+        started = {}
+
+        def _copy(region):
             desc = description or ''
             if add_region_to_desc:
-                desc += ' (%s)' % r.upper()
-            resp = self.copy_image(src_img.region.name, src_img.id, name=name,
-                                   description=desc,
-                                   client_token=client_token)
-            resps[r] = resp
+                desc += ' (%s)' % region.upper()
+            started[region] = time.time()
+            return conns[region].copy_image(source_region, src_img.id,
+                                            name=name, description=desc,
+                                            client_token=client_token)
+        resps = self.pool.map_jobs(_copy, regions)
         if wait_for_copies:
+            tracker = ImageCopyTracker()
             for r in resps:
-                self.connect_to_region(r)
-                img = self.get_image(resps[r].image_id)
-                self.wait_for_ami(img)
-        self.connect_to_region(current_region.name)
+                tracker.add(r, conns[r], resps[r].image_id, started[r])
+            failed = tracker.wait()
+            tracker.log_summary()
+            if failed:
+                raise exception.AWSError(
+                    "Copying %s failed in regions: %s" %
+                    (src_img.id, ', '.join(failed)))
         return resps
 
     def create_block_device_map(self, root_snapshot_id=None,
@@ -1290,28 +1545,22 @@ class EasyEC2(EasyAWS):
         return bmap
 
     @print_timing("Downloading image")
-    def download_image_files(self, image_id, destdir):
+    def download_image_files(self, image_id, destdir, workers=8):
         """
         Downloads the manifest.xml and all AMI parts for image_id to destdir
+
+        Files are fetched by up to workers concurrent requests. Files already
+        in destdir with matching size and checksum are skipped and partial
+        downloads from a previous run are resumed.
         """
         if not os.path.isdir(destdir):
             raise exception.BaseException(
                 "destination directory '%s' does not exist" % destdir)
-        widgets = ['file: ', progressbar.Percentage(), ' ',
-                   progressbar.Bar(marker=progressbar.RotatingMarker()), ' ',
-                   progressbar.ETA(), ' ', progressbar.FileTransferSpeed()]
         files = self.get_image_files(image_id)
-
-        def _dl_progress_cb(trans, total):
-            pbar.update(trans)
         log.info("Downloading image: %s" % image_id)
-        for file in files:
-            widgets[0] = "%s:" % file.name
-            pbar = progressbar.ProgressBar(widgets=widgets,
-                                           maxval=file.size).start()
-            file.get_contents_to_filename(os.path.join(destdir, file.name),
-                                          cb=_dl_progress_cb)
-            pbar.finish()
+        xfer = s3transfer.S3Transfer(workers=workers)
+        stats = xfer.download(files, destdir)
+        log.info("Downloaded %s" % stats)
 
     def list_image_files(self, image_id):
         """
@@ -1370,8 +1619,9 @@ class EasyEC2(EasyAWS):
                      extra=dict(__nonewline__=True))
             s = spinner.Spinner()
             s.start()
+            poll = ratelimit.PollInterval(refresh_interval)
             while volume.update() != status:
-                time.sleep(refresh_interval)
+                poll.sleep()
             s.stop()
         if state:
             log_func("Waiting for %s to transition to: %s... " %
@@ -1380,8 +1630,9 @@ class EasyEC2(EasyAWS):
                 volume.update()
             s = spinner.Spinner()
             s.start()
+            poll = ratelimit.PollInterval(refresh_interval)
             while volume.attachment_state() != state:
-                time.sleep(refresh_interval)
+                poll.sleep()
                 volume.update()
             s.stop()
 
@@ -1392,6 +1643,8 @@ class EasyEC2(EasyAWS):
                    progressbar.Bar(marker=progressbar.RotatingMarker()),
                    '', progressbar.Percentage(), ' ', progressbar.ETA()]
         pbar = progressbar.ProgressBar(widgets=widgets, maxval=100).start()
+        poll = ratelimit.PollInterval(refresh_interval, min_interval=5)
+        progress = 0
         while snap.status != 'completed':
             try:
                 progress = int(snap.update().replace('%', ''))
@@ -1401,7 +1654,8 @@ class EasyEC2(EasyAWS):
                 time.sleep(5)
                 continue
             if snap.status != 'completed':
-                time.sleep(refresh_interval)
+                # poll more often as the snapshot nears completion
+                poll.sleep(progress, 100)
         if not pbar.finished:
             pbar.finish()
 
@@ -1504,14 +1758,18 @@ class EasyEC2(EasyAWS):
                 print
         print 'Total: %s' % len(vols)
 
-    def get_spot_history(self, instance_type, start=None, end=None, zone=None,
-                         plot=False, plot_server_interface="localhost",
-                         plot_launch_browser=True, plot_web_browser=None,
-                         plot_shutdown_server=True, classic=False, vpc=False):
-        if start and not utils.is_iso_time(start):
-            raise exception.InvalidIsoDate(start)
-        if end and not utils.is_iso_time(end):
-            raise exception.InvalidIsoDate(end)
+    @property
+    def spot_store(self):
+        if not self._spot_store:
+            self._spot_store = spotstore.SpotHistoryStore()
+        return self._spot_store
+
+    def _get_spot_product(self, classic=False, vpc=False):
+        """
+        Returns the (product description, short name) used to look up spot
+        prices for EC2-Classic or VPC (defaults to VPC if the account has a
+        default VPC)
+        """
         if classic and vpc:
             raise exception.BaseException(
                 "classic and vpc kwargs are mutually exclusive")
@@ -1519,34 +1777,126 @@ class EasyEC2(EasyAWS):
             vpc = self.default_vpc is not None
             classic = not vpc
         if classic:
-            pdesc = "Linux/UNIX"
-            short_pdesc = "EC2-Classic"
-        else:
-            pdesc = "Linux/UNIX (Amazon VPC)"
-            short_pdesc = "VPC"
+            return "Linux/UNIX", "EC2-Classic"
+        return "Linux/UNIX (Amazon VPC)", "VPC"
+
+    def _get_spot_window(self, start=None, end=None):
+        """
+        Converts the iso start/end times to unix times. start defaults to
+        spotstore.DEFAULT_DAYS days before end and end defaults to now.
+        """
+        if start and not utils.is_iso_time(start):
+            raise exception.InvalidIsoDate(start)
+        if end and not utils.is_iso_time(end):
+            raise exception.InvalidIsoDate(end)
+        tend = utils.iso_to_unix_time(end) if end else time.time()
+        tstart = tend - spotstore.DEFAULT_DAYS * 86400
+        if start:
+            tstart = utils.iso_to_unix_time(start)
+        return tstart, tend
+
+    def update_spot_history(self, instance_types, product, force=False):
+        """
+        Brings the local spot price history store up to date for each of
+        instance_types, fetching only the points recorded since the previous
+        update. Instance types are fetched concurrently.
+        """
+        region = self.region.name
+
+        def _update(instance_type):
+            return self.spot_store.update(self.conn, region, product,
+                                          instance_type, force=force)
+        if len(instance_types) == 1:
+            return {instance_types[0]: _update(instance_types[0])}
+        return self.pool.map_jobs(_update, instance_types)
+
+    def get_spot_stats(self, instance_types, start=None, end=None, zone=None,
+                       bid=None, classic=False, vpc=False, refresh=False):
+        """
+        Returns a dictionary mapping (instance_type, zone) to a
+        spotstore.SpotPriceStats for the period between start and end
+        (defaults to the last spotstore.DEFAULT_DAYS days). Prices are read
+        from the local store which is updated first unless it was updated
+        recently (or refresh is True).
+        """
+        tstart, tend = self._get_spot_window(start, end)
+        pdesc, short_pdesc = self._get_spot_product(classic, vpc)
         log.info("Fetching spot history for %s (%s)" %
-                 (instance_type, short_pdesc))
-        hist = self.conn.get_spot_price_history(start_time=start, end_time=end,
-                                                availability_zone=zone,
-                                                instance_type=instance_type,
-                                                product_description=pdesc)
-        if not hist:
+                 (', '.join(instance_types), short_pdesc))
+        self.update_spot_history(instance_types, pdesc, force=refresh)
+        now = min(tend, time.time())
+        stats = {}
+        for instance_type in instance_types:
+            series = self.spot_store.load(self.region.name, pdesc,
+                                          instance_type, zone=zone,
+                                          start=tstart, end=tend)
+            for z, (ts, px) in series.items():
+                stats[(instance_type, z)] = spotstore.SpotPriceStats(
+                    ts, px, bid=bid, start=tstart, now=now)
+        if not stats:
             raise exception.SpotHistoryError(start, end)
-        dates = []
-        prices = []
+        return stats
+
+    def _log_spot_stats(self, ranked, bid=None):
+        raw = dict(__raw__=True)
+        header = "%-12s %-12s" + " %9s" * (7 + len(spotstore.PERCENTILES))
+        cols = ['current', 'average'] + ['p%d' % q for q in
+                                         spotstore.PERCENTILES]
+        cols += ['max', 'volatility', 'cost', 'risk', 'int/day']
+        log.info(header % tuple(['type', 'zone'] + cols), extra=raw)
+        for (instance_type, zone), s in ranked:
+            row = [instance_type, zone, '$%.4f' % s.current,
+                   '$%.4f' % s.average]
+            row += ['$%.4f' % s.percentiles[q] for q in spotstore.PERCENTILES]
+            row += ['$%.4f' % s.maximum, '%.1f%%' % (s.volatility * 100)]
+            if bid is None:
+                row += ['-', '-', '-']
+            else:
+                cost = '-'
+                if s.expected_cost is not None:
+                    cost = '$%.4f' % s.expected_cost
+                row += [cost, '%.1f%%' % (s.risk * 100),
+                        '%.2f' % s.interruptions_per_day]
+            log.info(header % tuple(row), extra=raw)
+
+    def compare_spot_prices(self, instance_types, bid, start=None, end=None,
+                            zone=None, classic=False, vpc=False,
+                            refresh=False):
+        """
+        Ranks every zone/instance type combination by the expected hourly
+        cost of running at bid (then by the fraction of time the price
+        exceeded bid) and returns the ranked list of
+        ((instance_type, zone), SpotPriceStats) tuples
+        """
+        stats = self.get_spot_stats(instance_types, start=start, end=end,
+                                    zone=zone, bid=bid, classic=classic,
+                                    vpc=vpc, refresh=refresh)
+        ranked = spotstore.rank_by_expected_cost(stats)
+        log.info("Expected cost at a bid of $%.4f:" % bid)
+        self._log_spot_stats(ranked, bid=bid)
+        return ranked
+
+    def get_spot_history(self, instance_type, start=None, end=None, zone=None,
+                         plot=False, plot_server_interface="localhost",
+                         plot_launch_browser=True, plot_web_browser=None,
+                         plot_shutdown_server=True, classic=False, vpc=False,
+                         bid=None, refresh=False):
+        stats = self.get_spot_stats([instance_type], start=start, end=end,
+                                    zone=zone, bid=bid, classic=classic,
+                                    vpc=vpc, refresh=refresh)
+        self._log_spot_stats(sorted(stats.items()), bid=bid)
+        pdesc, short_pdesc = self._get_spot_product(classic, vpc)
+        tstart, tend = self._get_spot_window(start, end)
+        series = self.spot_store.load(self.region.name, pdesc, instance_type,
+                                      zone=zone, start=tstart, end=tend)
         data = []
-        for item in hist:
-            timestamp = utils.iso_to_javascript_timestamp(item.timestamp)
-            price = item.price
-            dates.append(timestamp)
-            prices.append(price)
-            data.append([timestamp, price])
-        maximum = max(prices)
-        avg = sum(prices) / float(len(prices))
-        log.info("Current price: $%.4f" % prices[0])
-        log.info("Max price: $%.4f" % maximum)
-        log.info("Average price: $%.4f" % avg)
+        for ts, px in series.values():
+            data.extend([[int(t) * 1000, p] for t, p in zip(ts, px)])
+        data.sort(reverse=True)
+        dates = [d[0] for d in data]
+        prices = [d[1] for d in data]
         if plot:
+            maximum = max(prices)
             xaxisrange = dates[-1] - dates[0]
             xpanrange = [dates[0] - xaxisrange / 2.,
                          dates[-1] + xaxisrange / 2.]
@@ -1555,8 +1905,12 @@ class EasyEC2(EasyAWS):
             yaxisrange = maximum - minimum
             ypanrange = [minimum - yaxisrange / 2., maximum + yaxisrange / 2.]
             yzoomrange = [0.1, ypanrange[-1] - ypanrange[0]]
+            iso = '%Y-%m-%dT%H:%M:%S.000Z'
             context = dict(instance_type=instance_type,
-                           start=hist[-1].timestamp, end=hist[0].timestamp,
+                           start=time.strftime(iso,
+                                               time.gmtime(dates[-1] / 1000)),
+                           end=time.strftime(iso,
+                                             time.gmtime(dates[0] / 1000)),
                            time_series_data=str(data).replace('L', ''),
                            shutdown=plot_shutdown_server,
                            xpanrange=xpanrange, ypanrange=ypanrange,
@@ -1590,6 +1944,126 @@ class EasyEC2(EasyAWS):
             log.info("No console output available...")
 
 
+class ImageCopyTracker(object):
+    """
+    Waits for AMI copies in any number of regions using a single polling
+    loop. Each pass makes one DescribeImages request per pending region, plus
+    a DescribeSnapshots request for EBS images whose root snapshot is known
+    in order to report progress, and the polling interval tightens as the
+    copies near completion.
+    """
+    FAILED_STATES = ['invalid', 'deregistered', 'failed', 'error']
+
+    def __init__(self, interval=30, min_interval=5, clock=time.time,
+                 sleep=time.sleep):
+        self.copies = {}
+        self.poll = ratelimit.PollInterval(interval,
+                                           min_interval=min_interval,
+                                           sleep=sleep)
+        self._clock = clock
+
+    def add(self, region, ec2, image_id, started=None):
+        """
+        Track image_id in region. ec2 must be connected to region and started
+        is the time the copy was requested (defaults to now).
+        """
+        if started is None:
+            started = self._clock()
+        self.copies[region] = dict(ec2=ec2, image_id=image_id,
+                                   started=started, state='pending',
+                                   progress=0, elapsed=None)
+
+    @property
+    def pending(self):
+        return sorted([r for r, c in self.copies.items()
+                       if c['elapsed'] is None])
+
+    @property
+    def progress(self):
+        """
+        Average completion percentage of all copies
+        """
+        if not self.copies:
+            return 100
+        total = sum([c['progress'] for c in self.copies.values()])
+        return total / len(self.copies)
+
+    def _update_progress(self, copy, img):
+        if img.root_device_type != 'ebs':
+            return
+        root = img.block_device_mapping.get(img.root_device_name)
+        if not root or not root.snapshot_id:
+            return
+        snaps = copy['ec2'].get_snapshots(
+            filters={'snapshot-id': root.snapshot_id})
+        if snaps and snaps[0].progress:
+            try:
+                copy['progress'] = int(snaps[0].progress.replace('%', ''))
+            except ValueError:
+                pass
+
+    def check(self, region):
+        """
+        Refreshes the state of the copy in region
+        """
+        copy = self.copies[region]
+        # new AMIs are not always visible right after CopyImage returns
+        img = copy['ec2'].get_image_or_none(copy['image_id'])
+        if not img:
+            return
+        copy['state'] = img.state
+        if img.state == 'pending':
+            self._update_progress(copy, img)
+            return
+        if img.state == 'available':
+            copy['elapsed'] = self._clock() - copy['started']
+            copy['progress'] = 100
+            log.info("%s is available in %s (%.1f mins)" %
+                     (img.id, region, copy['elapsed'] / 60.0))
+        elif img.state in self.FAILED_STATES:
+            copy['elapsed'] = self._clock() - copy['started']
+            copy['progress'] = 100
+            reason = getattr(img, 'state_reason', None) or {}
+            log.error("Copying %s to %s failed: %s" %
+                      (img.id, region, reason.get('message', img.state)))
+
+    def wait(self):
+        """
+        Polls until every copy is either available or has failed and returns
+        a list of the regions whose copy failed
+        """
+        if self.copies:
+            widgets = ['Waiting for AMI copies: ', progressbar.Percentage(),
+                       ' ', progressbar.Bar(
+                           marker=progressbar.RotatingMarker()),
+                       ' ', progressbar.ETA()]
+            pbar = progressbar.ProgressBar(widgets=widgets,
+                                           maxval=100).start()
+            while True:
+                for region in self.pending:
+                    self.check(region)
+                pbar.update(self.progress)
+                if not self.pending:
+                    break
+                self.poll.sleep(self.progress, 100)
+            if not pbar.finished:
+                pbar.finish()
+        return sorted([r for r, c in self.copies.items()
+                       if c['state'] != 'available'])
+
+    def log_summary(self):
+        raw = dict(__raw__=True)
+        header = "%-16s %-14s %-10s %10s"
+        log.info(header % ('region', 'ami', 'state', 'elapsed'), extra=raw)
+        for region in sorted(self.copies):
+            copy = self.copies[region]
+            elapsed = '-'
+            if copy['elapsed'] is not None:
+                elapsed = '%.1f mins' % (copy['elapsed'] / 60.0)
+            log.info(header % (region, copy['image_id'], copy['state'],
+                               elapsed), extra=raw)
+
+
 class EasyS3(EasyAWS):
     DefaultHost = 's3.amazonaws.com'
     _calling_format = boto.s3.connection.OrdinaryCallingFormat()
@@ -17,20 +17,100 @@
 
 import os
 import re
+import json
 import time
+import bisect
+import calendar
 import datetime
-import xml.dom.minidom
+import StringIO
+import collections
+from xml.etree import cElementTree as ElementTree
 
 from starcluster import utils
 from starcluster import static
 from starcluster import exception
 from starcluster.balancers import LoadBalancer
+from starcluster.balancers.sge import policy as scaling
 from starcluster.logger import log
 
 
 SGE_STATS_DIR = os.path.join(static.STARCLUSTER_CFG_DIR, 'sge')
 DEFAULT_STATS_DIR = os.path.join(SGE_STATS_DIR, '%s')
 DEFAULT_STATS_FILE = os.path.join(DEFAULT_STATS_DIR, 'sge-stats.csv')
+DEFAULT_CURSOR_FILE = os.path.join(DEFAULT_STATS_DIR, 'qacct-cursor.json')
+SGE_ACCOUNTING_FILE = '/opt/sge6/default/common/accounting'
+
+
+def percentile(values, pct):
+    """
+    Returns the nearest-rank pct percentile of the already sorted values (0
+    if values is empty)
+    """
+    if not values:
+        return 0
+    rank = int(round(pct / 100.0 * len(values) + 0.5)) - 1
+    return values[min(max(rank, 0), len(values) - 1)]
+
+
+class JobStatsWindow(object):
+    """
+    Exact sliding window over the most recently finished jobs
+
+    Keeps the last `maxlen` (job_id, end, duration, wait) records in arrival
+    order along with sorted copies of the durations and wait times so that
+    means are O(1) and percentiles are exact without rescanning the window.
+    """
+    def __init__(self, maxlen=200):
+        self.maxlen = maxlen
+        self.records = collections.deque()
+        self._durations = []
+        self._waits = []
+        self._total_duration = 0
+        self._total_wait = 0
+
+    def __len__(self):
+        return len(self.records)
+
+    def add(self, job_id, end, duration, wait):
+        duration = max(int(duration), 0)
+        wait = max(int(wait), 0)
+        self.records.append((job_id, end, duration, wait))
+        bisect.insort(self._durations, duration)
+        bisect.insort(self._waits, wait)
+        self._total_duration += duration
+        self._total_wait += wait
+        while len(self.records) > self.maxlen:
+            self._evict()
+
+    def _evict(self):
+        job_id, end, duration, wait = self.records.popleft()
+        del self._durations[bisect.bisect_left(self._durations, duration)]
+        del self._waits[bisect.bisect_left(self._waits, wait)]
+        self._total_duration -= duration
+        self._total_wait -= wait
+
+    def mean_duration(self):
+        if not self.records:
+            return 0
+        return self._total_duration / len(self.records)
+
+    def mean_wait(self):
+        if not self.records:
+            return 0
+        return self._total_wait / len(self.records)
+
+    def percentile_duration(self, pct):
+        return percentile(self._durations, pct)
+
+    def percentile_wait(self, pct):
+        return percentile(self._waits, pct)
+
+    def dump(self):
+        return [list(r) for r in self.records]
+
+    def load(self, records):
+        for job_id, end, duration, wait in records:
+            self.add(job_id, end, duration, wait)
 
 
 class SGEStats(object):
@@ -42,7 +122,12 @@ class SGEStats(object):
         self.hosts = []
         self.jobs = []
         self.queues = {}
-        self.jobstats = self.jobstat_cachesize * [None]
+        self.queued_tasks = 0
+        self.queued_slots = 0
+        self.running_tasks = 0
+        self.running_slots = 0
+        self.running_slots_per_host = {}
+        self.jobstats = JobStatsWindow(maxlen=self.jobstat_cachesize)
         self.max_job_id = 0
         self.remote_tzinfo = remote_tzinfo or utils.get_utc_now().tzinfo
 
@@ -56,55 +141,96 @@ class SGEStats(object):
         if self.jobs:
             return int(self.jobs[-1]['JB_job_number'])
 
+    def _iterparse(self, xml_out, events=('end',)):
+        """
+        Returns an iterator of (event, element) pairs that incrementally
+        parses the SGE xml output string xml_out
+        """
+        if isinstance(xml_out, unicode):
+            xml_out = xml_out.encode('utf-8')
+        return ElementTree.iterparse(StringIO.StringIO(xml_out),
+                                     events=events)
+
     def parse_qhost(self, qhost_out):
         """
         this function parses qhost -xml output and makes a neat array
         takes in a string, so we can pipe in output from ssh.exec('qhost -xml')
         """
         self.hosts = []  # clear the old hosts
-        doc = xml.dom.minidom.parseString(qhost_out)
-        for h in doc.getElementsByTagName("host"):
-            name = h.getAttribute("name")
-            hash = {"name": name}
-            for stat in h.getElementsByTagName("hostvalue"):
-                for hvalue in stat.childNodes:
-                    attr = stat.attributes['name'].value
-                    val = ""
-                    if hvalue.nodeType == xml.dom.minidom.Node.TEXT_NODE:
-                        val = hvalue.data
-                    hash[attr] = val
-            if hash['name'] != u'global':
+        for event, elem in self._iterparse(qhost_out):
+            if elem.tag != 'host':
+                continue
+            name = elem.get('name')
+            if name != 'global':
+                hash = {"name": name}
+                for stat in elem.iter('hostvalue'):
+                    hash[stat.get('name')] = stat.text or ""
                 self.hosts.append(hash)
+            elem.clear()
         return self.hosts
 
     def parse_qstat(self, qstat_out):
         """
         This method parses qstat -xml output and makes a neat array
+
+        The output is parsed incrementally in a single pass that also
+        computes the number of queued/running tasks and slots. Each job
+        (including task array jobs) is stored as a single record whose
+        'num_tasks' field contains the job's number of tasks.
         """
         self.jobs = []  # clear the old jobs
         self.queues = {}  # clear the old queues
-        doc = xml.dom.minidom.parseString(qstat_out)
-        for q in doc.getElementsByTagName("Queue-List"):
-            name = q.getElementsByTagName("name")[0].childNodes[0].data
-            slots = q.getElementsByTagName("slots_total")[0].childNodes[0].data
-            self.queues[name] = dict(slots=int(slots))
-            for job in q.getElementsByTagName("job_list"):
-                self.jobs.extend(self._parse_job(job, queue_name=name))
-        for job in doc.getElementsByTagName("job_list"):
-            if job.parentNode.nodeName == 'job_info':
-                self.jobs.extend(self._parse_job(job))
+        self.queued_tasks = self.queued_slots = 0
+        self.running_tasks = self.running_slots = 0
+        self.running_slots_per_host = {}
+        in_queue = False
+        queue_name = None
+        for event, elem in self._iterparse(qstat_out,
+                                           events=('start', 'end')):
+            tag = elem.tag
+            if event == 'start':
+                if tag == 'Queue-List':
+                    in_queue = True
+                continue
+            if in_queue and tag == 'name' and queue_name is None:
+                queue_name = elem.text
+            elif in_queue and tag == 'slots_total':
+                self.queues[queue_name] = dict(slots=int(elem.text))
+            elif tag == 'Queue-List':
+                in_queue = False
+                queue_name = None
+                elem.clear()
+            elif tag == 'job_list':
+                self._add_job(self._parse_job(elem, queue_name=queue_name))
+                elem.clear()
         return self.jobs
 
+    def _add_job(self, jdict):
+        self.jobs.append(jdict)
+        num_tasks = jdict['num_tasks']
+        slots = int(jdict.get('slots', 1)) * num_tasks
+        if jdict['job_state'] == 'running':
+            self.running_tasks += num_tasks
+            self.running_slots += slots
+            qname = jdict.get('queue_name') or ''
+            host = qname.split('@', 1)[-1]
+            if host:
+                self.running_slots_per_host[host] = \
+                    self.running_slots_per_host.get(host, 0) + slots
+        elif jdict['job_state'] == 'pending' and jdict.get('state') == 'qw':
+            self.queued_tasks += num_tasks
+            self.queued_slots += slots
+
     def _parse_job(self, job, queue_name=None):
-        jstate = job.getAttribute("state")
+        jstate = job.get("state")
         jdict = dict(job_state=jstate, queue_name=queue_name)
-        for node in job.childNodes:
-            if node.nodeType == xml.dom.minidom.Node.ELEMENT_NODE:
-                for child in node.childNodes:
-                    jdict[node.nodeName] = child.data
+        for node in job:
+            if node.text is not None:
+                jdict[node.tag] = node.text
         num_tasks = self._count_tasks(jdict)
         log.debug("Job contains %d tasks" % num_tasks)
-        return [jdict] * num_tasks
+        jdict['num_tasks'] = num_tasks
+        return jdict
 
     def _count_tasks(self, jdict):
         """
@@ -137,55 +263,51 @@ class SGEStats(object):
         dt = datetime.datetime.strptime(qacct, "%a %b %d %H:%M:%S %Y")
         return dt.replace(tzinfo=self.remote_tzinfo)
 
-    def parse_qacct(self, string, dtnow):
+    def _to_timestamp(self, dt):
+        return calendar.timegm(dt.utctimetuple())
+
+    def _add_jobstat(self, job_id, queued, start, end):
+        if job_id > self.max_job_id:
+            self.max_job_id = job_id
+        self.jobstats.add(job_id, end, end - start, start - queued)
+
+    def parse_accounting(self, string, since=None):
         """
-        This method parses qacct -j output and makes a neat array and
-        calculates some statistics.
-        Takes the string to parse, and a datetime object of the remote
-        host's current time.
+        Parses raw lines from SGE's accounting file (one colon-separated
+        record per finished job/task) and adds each job that actually ran to
+        the jobstats window. Records that finished before the `since` epoch
+        timestamp are skipped. Returns the number of jobs added.
         """
-        job_id = None
-        qd = None
-        start = None
-        end = None
         counter = 0
-        lines = string.split('\n')
-        for l in lines:
-            l = l.strip()
-            if l.find('jobnumber') != -1:
-                job_id = int(l[13:len(l)])
-            if l.find('qsub_time') != -1:
-                qd = self.qacct_to_datetime_tuple(l[13:len(l)])
-            if l.find('start_time') != -1:
-                if l.find('-/-') > 0:
-                    start = dtnow
-                else:
-                    start = self.qacct_to_datetime_tuple(l[13:len(l)])
-            if l.find('end_time') != -1:
-                if l.find('-/-') > 0:
-                    end = dtnow
-                else:
-                    end = self.qacct_to_datetime_tuple(l[13:len(l)])
-            if l.find('==========') != -1:
-                if qd is not None:
-                    self.max_job_id = job_id
-                    hash = {'queued': qd, 'start': start, 'end': end}
-                    self.jobstats[job_id % self.jobstat_cachesize] = hash
-                qd = None
-                start = None
-                end = None
-                counter = counter + 1
-        log.debug("added %d new jobs" % counter)
-        log.debug("There are %d items in the jobstats cache" %
-                  len(self.jobstats))
-        return self.jobstats
+        for l in string.splitlines():
+            if not l or l.startswith('#'):
+                continue
+            fields = l.split(':')
+            if len(fields) < 11:
+                log.debug("skipping malformed accounting record: %s" % l)
+                continue
+            try:
+                job_id = int(fields[5])
+                queued, start, end = [int(f) for f in fields[8:11]]
+            except ValueError:
+                log.debug("skipping malformed accounting record: %s" % l)
+                continue
+            if start == 0 or end == 0:
+                # job was deleted or failed before it started running
+                continue
+            if since is not None and end < since:
+                continue
+            self._add_jobstat(job_id, queued, start, end)
+            counter += 1
+        log.debug("added %d new jobs from accounting file" % counter)
+        return counter
 
     def is_jobstats_empty(self):
         """
-        This function will return True if half of the queue is empty, False if
-        there are enough entries in it.
+        This function will return True if less than 30% of the jobstats window
+        is populated, False if there are enough entries in it.
         """
-        return self.max_job_id < (self.jobstat_cachesize * 0.3)
+        return len(self.jobstats) < (self.jobstat_cachesize * 0.3)
 
     def get_running_jobs(self):
         """
@@ -280,30 +402,16 @@ class SGEStats(object):
                 return int(j['slots'])
 
     def avg_job_duration(self):
-        count = 0
-        total_seconds = 0
-        for job in self.jobstats:
-            if job is not None:
-                delta = job['end'] - job['start']
-                total_seconds += delta.seconds
-                count += 1
-        if count == 0:
-            return count
-        else:
-            return total_seconds / count
+        return self.jobstats.mean_duration()
 
     def avg_wait_time(self):
-        count = 0
-        total_seconds = 0
-        for job in self.jobstats:
-            if job is not None:
-                delta = job['start'] - job['queued']
-                total_seconds += delta.seconds
-                count += 1
-        if count == 0:
-            return count
-        else:
-            return total_seconds / count
+        return self.jobstats.mean_wait()
+
+    def job_duration_percentile(self, pct):
+        return self.jobstats.percentile_duration(pct)
+
+    def wait_time_percentile(self, pct):
+        return self.jobstats.percentile_wait(pct)
 
     def get_loads(self):
         """
@@ -334,9 +442,9 @@ class SGEStats(object):
         # second field is the number of hosts
         bits.append(self.count_hosts())
         # third field is # of running jobs
-        bits.append(len(self.get_running_jobs()))
+        bits.append(self.running_tasks)
         # fourth field is # of queued jobs
-        bits.append(len(self.get_queued_jobs()))
+        bits.append(self.queued_tasks)
         # fifth field is total # slots
         bits.append(self.count_total_slots())
         # sixth field is average job duration
@@ -352,6 +460,10 @@ class SGEStats(object):
         else:
             avg_load = 0.0
         bits.append(avg_load)
+        # ninth and tenth fields are # of running and queued slots (parallel
+        # environment jobs use several slots per task)
+        bits.append(self.running_slots)
+        bits.append(self.queued_slots)
         return bits
 
     def write_stats_to_csv(self, filename):
@@ -410,20 +522,31 @@ class SGELoadBalancer(LoadBalancer):
     Visualizer off by default. Start it with "starcluster loadbalance -p tag"
     plot_stats = False
 
+    The scaling policy that decides how many nodes to add/remove. Either
+    'reactive' (default), 'predictive' or the module path to a custom
+    starcluster.balancers.sge.policy.ScalingPolicy subclass
+    policy = reactive
+
+    How far ahead (in mins) the predictive policy forecasts required slots
+    horizon = 10
+
     How many hours qacct should look back to gather past job data. lower
-    values minimize data transfer
+    values minimize data transfer. Only applies the first time the accounting
+    file is read - afterwards only records appended since the last poll are
+    fetched (the read position is saved in qacct_cursor_file)
     lookback_window = 3
     """
 
     def __init__(self, interval=60, max_nodes=None, wait_time=900,
                  add_pi=1, kill_after=45, stab=180, lookback_win=3,
                  min_nodes=None, kill_cluster=False, plot_stats=False,
-                 plot_output_dir=None, dump_stats=False, stats_file=None):
+                 plot_output_dir=None, dump_stats=False, stats_file=None,
+                 policy='reactive', horizon=10):
         self._cluster = None
         self._keep_polling = True
         self._visualizer = None
         self._stat = None
-        self.__last_cluster_mod_time = utils.get_utc_now()
+        self.__last_cluster_mod_time = self._now()
         self.polling_interval = interval
         self.kill_after = kill_after
         self.longest_allowed_queue_time = wait_time
@@ -437,6 +560,11 @@ class SGELoadBalancer(LoadBalancer):
         self.stats_file = stats_file
         self.plot_stats = plot_stats
         self.plot_output_dir = plot_output_dir
+        self.qacct_cursor_file = None
+        self._qacct_cursor = None
+        self._poll_time = None
+        self.policy = scaling.get_policy(policy, wait_time=wait_time,
+                                         horizon=horizon * 60)
         if plot_stats:
             assert self.visualizer is not None
 
@@ -468,6 +596,12 @@ class SGELoadBalancer(LoadBalancer):
             self._visualizer.pngpath = self.plot_output_dir
         return self._visualizer
 
+    def _now(self):
+        return utils.get_utc_now()
+
+    def _sleep(self, seconds):
+        time.sleep(seconds)
+
     def _validate_dir(self, dirname, msg_prefix=""):
         if not os.path.isdir(dirname):
             msg = "'%s' is not a directory"
@@ -505,45 +639,146 @@ class SGELoadBalancer(LoadBalancer):
             self._stat.remote_tzinfo = d.tzinfo
         return d
 
-    def get_qatime(self, now):
+    def _load_qacct_cursor(self):
         """
-        This function takes the lookback window and creates a string
-        representation of the past few hours, to feed to qacct to
-        limit the dataset qacct returns.
+        Returns the saved accounting file read position (and the jobstats
+        window contents at that position) from qacct_cursor_file
         """
-        if self.stat.is_jobstats_empty():
-            log.info("Loading full job history")
-            temp_lookback_window = self.lookback_window * 60 * 60
-        else:
-            temp_lookback_window = self.polling_interval
-        log.debug("getting past %d seconds worth of job history" %
-                  temp_lookback_window)
-        now = now - datetime.timedelta(seconds=temp_lookback_window + 1)
-        return now.strftime("%Y%m%d%H%M")
+        cursor = dict(inode=None, offset=0, last_job_id=0, window=[])
+        if not self.qacct_cursor_file or \
+           not os.path.isfile(self.qacct_cursor_file):
+            return cursor
+        try:
+            f = open(self.qacct_cursor_file)
+            try:
+                cursor.update(json.load(f))
+            finally:
+                f.close()
+        except (IOError, ValueError), e:
+            log.warn("Ignoring unreadable qacct cursor file %s: %s" %
+                     (self.qacct_cursor_file, e))
+            return dict(inode=None, offset=0, last_job_id=0, window=[])
+        self.stat.jobstats.load(cursor.get('window', []))
+        self.stat.max_job_id = cursor.get('last_job_id', 0)
+        log.debug("Resuming accounting file at offset %d (last job id %d)" %
+                  (cursor['offset'], cursor['last_job_id']))
+        return cursor
+
+    def _save_qacct_cursor(self):
+        if not self.qacct_cursor_file:
+            return
+        cursor = dict(self._qacct_cursor)
+        cursor['last_job_id'] = self.stat.max_job_id
+        cursor['window'] = self.stat.jobstats.dump()
+        try:
+            tmp = self.qacct_cursor_file + '.tmp'
+            f = open(tmp, 'w')
+            try:
+                json.dump(cursor, f)
+            finally:
+                f.close()
+            os.rename(tmp, self.qacct_cursor_file)
+        except (IOError, OSError), e:
+            log.warn("Failed to save qacct cursor file %s: %s" %
+                     (self.qacct_cursor_file, e))
+
+    def _get_accounting_cmd(self, inode, offset, since):
+        """
+        Returns a shell command that prints '<inode> <new offset>' followed by
+        every complete record appended to the SGE accounting file since
+        `offset`. Starts over from the beginning if the file was rotated or
+        truncated, in which case only records of jobs that ended at or after
+        the `since` epoch timestamp are printed so that the file's full
+        history isn't transferred. Prints nothing if the file does not exist
+        yet.
+        """
+        return "\n".join([
+            "f=%s; off=%d" % (SGE_ACCOUNTING_FILE, offset),
+            "[ -f $f ] || exit 0",
+            "set -- $(stat -c '%i %s' $f)",
+            "if [ \"$1\" != \"%s\" ] || [ $2 -lt $off ]; then off=0; fi" %
+            inode,
+            "t=$(mktemp)",
+            "tail -c +$((off + 1)) $f | head -c $(($2 - off)) > $t",
+            # drop a trailing record that is still being written
+            "[ -n \"$(tail -c 1 $t)\" ] && sed -i '$d' $t",
+            "echo $1 $((off + $(wc -c < $t)))",
+            "if [ $off -eq 0 ]; then awk -F: '$11 >= %d' $t; else cat $t; fi"
+            % since,
+            "rm -f $t"])
+
+    def get_accounting(self, now):
+        """
+        Fetches the records appended to the SGE accounting file since the last
+        poll and adds them to the jobstats window. Only the new bytes are
+        transferred and parsed; the read position is kept across polls and,
+        via qacct_cursor_file, across load balancer restarts.
+        """
+        if self._qacct_cursor is None:
+            self._qacct_cursor = self._load_qacct_cursor()
+        cursor = self._qacct_cursor
+        master = self._cluster.master_node
+        lookback = self.lookback_window * 60 * 60
+        cmd = self._get_accounting_cmd(cursor['inode'], cursor['offset'],
+                                       self.stat._to_timestamp(now) - lookback)
+        output = master.ssh.execute(cmd, log_output=False)
+        if not output:
+            log.info("No jobs have completed yet!")
+            return 0
+        inode, offset = output[0].split()
+        offset = int(offset)
+        since = None
+        if inode != str(cursor['inode']) or offset < cursor['offset']:
+            # first read or the accounting file was rotated
+            since = self.stat._to_timestamp(now) - lookback
+            log.info("Loading past %d hours of job history" %
+                     self.lookback_window)
+        nbytes = offset - cursor['offset'] if since is None else offset
+        log.debug("Read %d new bytes from accounting file" % nbytes)
+        num_jobs = self.stat.parse_accounting('\n'.join(output[1:]),
+                                              since=since)
+        cursor['inode'] = inode
+        cursor['offset'] = offset
+        self._save_qacct_cursor()
+        return num_jobs
 
     def _get_stats(self):
         master = self._cluster.master_node
-        now = self.get_remote_time()
-        qatime = self.get_qatime(now)
-        qacct_cmd = 'qacct -j -b ' + qatime
+        now = self._poll_time = self.get_remote_time()
         qstat_cmd = 'qstat -u \* -xml -f -r'
         qhostxml = '\n'.join(master.ssh.execute('qhost -xml'))
         qstatxml = '\n'.join(master.ssh.execute(qstat_cmd))
-        try:
-            qacct = '\n'.join(master.ssh.execute(qacct_cmd))
-        except exception.RemoteCommandFailed:
-            if master.ssh.isfile('/opt/sge6/default/common/accounting'):
-                raise
-            else:
-                log.info("No jobs have completed yet!")
-                qacct = ''
         self.stat.parse_qhost(qhostxml)
         self.stat.parse_qstat(qstatxml)
-        self.stat.parse_qacct(qacct, now)
-        log.debug("sizes: qhost: %d, qstat: %d, qacct: %d" %
-                  (len(qhostxml), len(qstatxml), len(qacct)))
+        self.get_accounting(now)
+        log.debug("sizes: qhost: %d, qstat: %d" %
+                  (len(qhostxml), len(qstatxml)))
         return self.stat
 
+    def get_policy_state(self):
+        """
+        Returns a PolicyState snapshot of the most recently fetched stats for
+        the scaling policy
+        """
+        now = self._poll_time or self.get_remote_time()
+        oldest_age = 0
+        oldest = self.stat.oldest_queued_job_age()
+        if oldest:
+            age_delta = now - oldest
+            oldest_age = age_delta.days * 86400 + age_delta.seconds
+        try:
+            slots_per_host = self.stat.slots_per_host()
+        except exception.BaseException, e:
+            log.warn(str(e))
+            slots_per_host = 0
+        return scaling.PolicyState(
+            self.stat._to_timestamp(now), len(self._cluster.nodes),
+            self.stat.count_total_slots(), self.stat.running_slots,
+            self.stat.queued_slots, slots_per_host,
+            oldest_queued_age=oldest_age,
+            avg_job_duration=self.stat.avg_job_duration(),
+            avg_wait_time=self.stat.avg_wait_time())
+
     @utils.print_timing("Fetching SGE stats", debug=True)
     def get_stats(self):
         """
@@ -562,7 +797,7 @@ class SGELoadBalancer(LoadBalancer):
                 log.warn("Failed to retrieve stats (%d/%d):" %
                          (i + 1, retries), exc_info=True)
                 log.warn("Retrying in %ds" % self.polling_interval)
-                time.sleep(self.polling_interval)
+                self._sleep(self.polling_interval)
         raise exception.BaseException(
             "Failed to retrieve SGE stats after trying %d times, exiting..." %
             retries)
@@ -592,6 +827,9 @@ class SGELoadBalancer(LoadBalancer):
             self.stats_file = DEFAULT_STATS_FILE % cluster.cluster_tag
         if not self.plot_output_dir:
             self.plot_output_dir = DEFAULT_STATS_DIR % cluster.cluster_tag
+        if self.qacct_cursor_file is None:
+            self._mkdir(DEFAULT_STATS_DIR % cluster.cluster_tag, makedirs=True)
+            self.qacct_cursor_file = DEFAULT_CURSOR_FILE % cluster.cluster_tag
         if not cluster.is_cluster_up():
             raise exception.ClusterNotRunning(cluster.cluster_tag)
         if self.dump_stats:
@@ -613,8 +851,10 @@ class SGELoadBalancer(LoadBalancer):
                  extra=raw)
         log.info("Minimum cluster size: %d" % self.min_nodes,
                  extra=raw)
-        log.info("Cluster growth rate: %d nodes/iteration\n" %
+        log.info("Cluster growth rate: %d nodes/iteration" %
                  self.add_nodes_per_iteration, extra=raw)
+        log.info("Scaling policy: %s\n" % self.policy.__class__.__name__,
+                 extra=raw)
         if self.dump_stats:
             log.info("Writing stats to file: %s" % self.stats_file)
         if self.plot_stats:
@@ -622,12 +862,11 @@ class SGELoadBalancer(LoadBalancer):
         while(self._keep_polling):
             if not cluster.is_cluster_up():
                 log.info("Waiting for all nodes to come up...")
-                time.sleep(self.polling_interval)
+                self._sleep(self.polling_interval)
                 continue
             self.get_stats()
             log.info("Execution hosts: %d" % len(self.stat.hosts), extra=raw)
-            log.info("Queued jobs: %d" % len(self.stat.get_queued_jobs()),
-                     extra=raw)
+            log.info("Queued jobs: %d" % self.stat.queued_tasks, extra=raw)
             oldest_queued_job_age = self.stat.oldest_queued_job_age()
             if oldest_queued_job_age:
                 log.info("Oldest queued job: %s" % oldest_queued_job_age,
@@ -639,10 +878,12 @@ class SGELoadBalancer(LoadBalancer):
             log.info("Last cluster modification time: %s" %
                      self.__last_cluster_mod_time.strftime("%Y-%m-%d %X%z"),
                      extra=dict(__raw__=True))
+            state = self.get_policy_state()
+            self.policy.observe(state)
             # evaluate if nodes need to be added
-            self._eval_add_node()
+            self._eval_add_node(state)
             # evaluate if nodes need to be removed
-            self._eval_remove_node()
+            self._eval_remove_node(state)
             if self.dump_stats or self.plot_stats:
                 self.stat.write_stats_to_csv(self.stats_file)
             # call the visualizer
@@ -658,10 +899,10 @@ class SGELoadBalancer(LoadBalancer):
                     return self._cluster.terminate_cluster()
             log.info("Sleeping...(looping again in %d secs)\n" %
                      self.polling_interval)
-            time.sleep(self.polling_interval)
+            self._sleep(self.polling_interval)
 
     def has_cluster_stabilized(self):
-        now = utils.get_utc_now()
+        now = self._now()
         elapsed = (now - self.__last_cluster_mod_time).seconds
         is_stabilized = not (elapsed < self.stabilization_time)
         if not is_stabilized:
@@ -670,74 +911,52 @@ class SGELoadBalancer(LoadBalancer):
             log.info("Waiting for cluster to stabilize...")
         return is_stabilized
 
-    def _eval_add_node(self):
+    def _eval_add_node(self, state=None):
         """
         This function inspects the current state of the SGE queue and decides
-        whether or not to add nodes to the cluster. Returns the number of nodes
-        to add.
+        whether or not to add nodes to the cluster. The number of nodes to add
+        is decided by the scaling policy.
         """
         num_nodes = len(self._cluster.nodes)
         if num_nodes >= self.max_nodes:
             log.info("Not adding nodes: already at or above maximum (%d)" %
                      self.max_nodes)
             return
-        queued_jobs = self.stat.get_queued_jobs()
-        if not queued_jobs and num_nodes >= self.min_nodes:
+        if not self.stat.queued_tasks and num_nodes >= self.min_nodes:
             log.info("Not adding nodes: at or above minimum nodes "
                      "and no queued jobs...")
             return
         total_slots = self.stat.count_total_slots()
         if not self.has_cluster_stabilized() and total_slots > 0:
             return
-        running_jobs = self.stat.get_running_jobs()
-        used_slots = sum([int(j['slots']) for j in running_jobs])
-        qw_slots = sum([int(j['slots']) for j in queued_jobs])
-        slots_per_host = self.stat.slots_per_host()
-        avail_slots = total_slots - used_slots
-        need_to_add = 0
         if num_nodes < self.min_nodes:
             log.info("Adding node: below minimum (%d)" % self.min_nodes)
             need_to_add = self.min_nodes - num_nodes
-        elif total_slots == 0:
-            # no slots, add one now
-            need_to_add = 1
-        elif qw_slots > avail_slots:
-            log.info("Queued jobs need more slots (%d) than available (%d)" %
-                     (qw_slots, avail_slots))
-            oldest_job_dt = self.stat.oldest_queued_job_age()
-            now = self.get_remote_time()
-            age_delta = now - oldest_job_dt
-            if age_delta.seconds > self.longest_allowed_queue_time:
-                log.info("A job has been waiting for %d seconds "
-                         "longer than max: %d" %
-                         (age_delta.seconds, self.longest_allowed_queue_time))
-                if slots_per_host != 0:
-                    need_to_add = qw_slots / slots_per_host
-                else:
-                    need_to_add = 1
-            else:
-                log.info("No queued jobs older than %d seconds" %
-                         self.longest_allowed_queue_time)
+        else:
+            need_to_add = self.policy.nodes_to_add(
+                state or self.get_policy_state())
         max_add = self.max_nodes - len(self._cluster.running_nodes)
         need_to_add = min(self.add_nodes_per_iteration, need_to_add, max_add)
         if need_to_add > 0:
             log.warn("Adding %d nodes at %s" %
-                     (need_to_add, str(utils.get_utc_now())))
+                     (need_to_add, str(self._now())))
             try:
                 self._cluster.add_nodes(need_to_add)
-                self.__last_cluster_mod_time = utils.get_utc_now()
+                self.__last_cluster_mod_time = self._now()
                 log.info("Done adding nodes at %s" %
                          str(self.__last_cluster_mod_time))
             except Exception:
                 log.error("Failed to add new host", exc_info=True)
 
-    def _eval_remove_node(self):
+    def _eval_remove_node(self, state=None):
         """
         This function uses the sge stats to decide whether or not to
-        remove a node from the cluster.
+        remove a node from the cluster. The scaling policy decides how many
+        idle nodes may be removed.
         """
-        qlen = len(self.stat.get_queued_jobs())
-        if qlen != 0:
+        max_remove = self.policy.nodes_to_remove(
+            state or self.get_policy_state())
+        if max_remove <= 0:
             return
         if not self.has_cluster_stabilized():
             return
@@ -746,7 +965,7 @@ class SGELoadBalancer(LoadBalancer):
             log.info("Not removing nodes: already at or below minimum (%d)"
                      % self.min_nodes)
             return
-        max_remove = num_nodes - self.min_nodes
+        max_remove = min(max_remove, num_nodes - self.min_nodes)
         log.info("Looking for nodes to remove...")
         remove_nodes = self._find_nodes_for_removal(max_remove=max_remove)
         if not remove_nodes:
@@ -760,7 +979,7 @@ class SGELoadBalancer(LoadBalancer):
                      (node.alias, node.id, node.dns_name))
             try:
                 self._cluster.remove_node(node)
-                self.__last_cluster_mod_time = utils.get_utc_now()
+                self.__last_cluster_mod_time = self._now()
             except Exception:
                 log.error("Failed to remove node %s" % node.alias,
                           exc_info=True)
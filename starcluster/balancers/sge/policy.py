@@ -0,0 +1,353 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Scaling policies for the SGE load balancer
+
+A policy decides how many nodes the cluster needs to gain or lose given a
+PolicyState snapshot of the queue. The load balancer itself still enforces
+min/max nodes, the stabilization time and the per-iteration growth limit and
+picks which idle nodes to remove. Use replay() to compare policies offline
+against a stats CSV recorded with 'starcluster loadbalance -d'.
+"""
+import math
+import calendar
+import collections
+
+from starcluster import utils
+from starcluster import exception
+from starcluster.logger import log
+
+
+class PolicyState(object):
+    """
+    Snapshot of the cluster and SGE queue taken at a single load balancer
+    iteration. Times are in seconds and `now` is a UNIX timestamp.
+    """
+    def __init__(self, now, num_nodes, total_slots, running_slots,
+                 queued_slots, slots_per_host, oldest_queued_age=0,
+                 avg_job_duration=0, avg_wait_time=0):
+        self.now = now
+        self.num_nodes = num_nodes
+        self.total_slots = total_slots
+        self.running_slots = running_slots
+        self.queued_slots = queued_slots
+        self.slots_per_host = slots_per_host
+        self.oldest_queued_age = oldest_queued_age
+        self.avg_job_duration = avg_job_duration
+        self.avg_wait_time = avg_wait_time
+
+    @property
+    def avail_slots(self):
+        return max(self.total_slots - self.running_slots, 0)
+
+
+class ScalingPolicy(object):
+    """
+    Base class for load balancer scaling policies
+
+    wait_time - longest time (secs) a job should wait in the queue
+    horizon - how far ahead (secs) predictive policies should plan for
+    """
+    def __init__(self, wait_time=900, horizon=600):
+        self.longest_allowed_queue_time = wait_time
+        self.horizon = horizon
+
+    def observe(self, state):
+        """
+        Called once per load balancer iteration with the latest state before
+        any nodes_to_add/nodes_to_remove calls
+        """
+        pass
+
+    def nodes_to_add(self, state):
+        """
+        Returns the number of nodes the cluster should grow by
+        """
+        raise NotImplementedError()
+
+    def nodes_to_remove(self, state):
+        """
+        Returns the maximum number of idle nodes that may be removed
+        """
+        raise NotImplementedError()
+
+
+class ReactivePolicy(ScalingPolicy):
+    """
+    The original load balancer algorithm: add enough nodes to run all queued
+    slots once a job has waited longer than wait_time and the queue needs more
+    slots than are available. Idle nodes may only be removed when the queue
+    is empty.
+    """
+    def nodes_to_add(self, state):
+        if state.total_slots == 0:
+            # no slots, add one now
+            return 1
+        if state.queued_slots <= state.avail_slots:
+            return 0
+        log.info("Queued jobs need more slots (%d) than available (%d)" %
+                 (state.queued_slots, state.avail_slots))
+        if state.oldest_queued_age <= self.longest_allowed_queue_time:
+            log.info("No queued jobs older than %d seconds" %
+                     self.longest_allowed_queue_time)
+            return 0
+        log.info("A job has been waiting for %d seconds longer than max: %d" %
+                 (state.oldest_queued_age, self.longest_allowed_queue_time))
+        if state.slots_per_host != 0:
+            return state.queued_slots / state.slots_per_host
+        return 1
+
+    def nodes_to_remove(self, state):
+        if state.queued_slots:
+            return 0
+        return state.num_nodes
+
+
+class PredictivePolicy(ReactivePolicy):
+    """
+    Forecasts the slots required over the next `horizon` seconds from the
+    average job duration and the recent growth/drain rate of outstanding work
+    (running + queued slots) and sizes the cluster to match.
+
+    Nodes are added as soon as the forecast says the queue will not drain
+    within wait_time instead of waiting for a job to actually exceed it.
+    Falls back to ReactivePolicy until there is any job duration history.
+
+    history - number of past iterations used to estimate the demand rate
+    """
+    def __init__(self, wait_time=900, horizon=600, history=10):
+        super(PredictivePolicy, self).__init__(wait_time=wait_time,
+                                               horizon=horizon)
+        self.samples = collections.deque(maxlen=history)
+
+    def observe(self, state):
+        self.samples.append((state.now,
+                             state.running_slots + state.queued_slots))
+
+    def demand_rate(self):
+        """
+        Returns the least-squares slope of outstanding slots over the sample
+        history in slots/sec (negative when the queue is draining)
+        """
+        n = len(self.samples)
+        if n < 2:
+            return 0.0
+        mean_t = sum(s[0] for s in self.samples) / float(n)
+        mean_d = sum(s[1] for s in self.samples) / float(n)
+        var = sum((s[0] - mean_t) ** 2 for s in self.samples)
+        if var == 0:
+            return 0.0
+        cov = sum((s[0] - mean_t) * (s[1] - mean_d) for s in self.samples)
+        return cov / var
+
+    def expected_arrivals(self):
+        return max(self.demand_rate(), 0.0) * self.horizon
+
+    def forecast_slots(self, state):
+        """
+        Returns the number of slots needed to start every queued and expected
+        slot within the horizon. A slot can run horizon/avg_job_duration
+        jobs back to back during the horizon.
+        """
+        backlog = state.queued_slots + self.expected_arrivals()
+        factor = min(1.0, state.avg_job_duration / float(self.horizon))
+        return state.running_slots + int(math.ceil(backlog * factor))
+
+    def predicted_wait(self, state):
+        """
+        Returns the expected time (secs) until the last queued or expected
+        slot starts running with the current number of slots
+        """
+        if state.total_slots == 0:
+            return float('inf')
+        backlog = state.queued_slots + self.expected_arrivals()
+        return backlog * state.avg_job_duration / float(state.total_slots)
+
+    def nodes_to_add(self, state):
+        if not state.avg_job_duration:
+            return super(PredictivePolicy, self).nodes_to_add(state)
+        if state.total_slots == 0:
+            return 1
+        needed = self.forecast_slots(state)
+        wait = self.predicted_wait(state)
+        log.info("Forecast: %d slots needed over next %d secs (have %d), "
+                 "predicted queue wait %d secs" %
+                 (needed, self.horizon, state.total_slots, wait))
+        if needed <= state.total_slots:
+            return 0
+        if wait <= self.longest_allowed_queue_time and \
+           state.oldest_queued_age <= self.longest_allowed_queue_time:
+            log.info("Queue expected to drain within %d seconds" %
+                     self.longest_allowed_queue_time)
+            return 0
+        deficit = needed - state.total_slots
+        sph = state.slots_per_host or 1
+        return int(math.ceil(deficit / float(sph)))
+
+    def nodes_to_remove(self, state):
+        if state.queued_slots or not state.slots_per_host:
+            return 0
+        if not state.avg_job_duration:
+            return state.num_nodes
+        surplus = state.total_slots - self.forecast_slots(state)
+        return max(surplus / state.slots_per_host, 0)
+
+
+POLICIES = {
+    'reactive': ReactivePolicy,
+    'predictive': PredictivePolicy,
+}
+
+
+def get_policy(policy, **kwargs):
+    """
+    Returns a ScalingPolicy instance given either an instance, a name from
+    POLICIES or the full module path to a ScalingPolicy subclass (e.g.
+    mypolicies.MyPolicy). kwargs are passed to the policy's constructor.
+    """
+    if isinstance(policy, ScalingPolicy):
+        return policy
+    klass = POLICIES.get(policy)
+    if klass is None and policy and '.' in policy:
+        mod_name, class_name = policy.rsplit('.', 1)
+        try:
+            mod = __import__(mod_name, globals(), locals(), [class_name])
+        except ImportError, e:
+            raise exception.BaseException(
+                "Failed to import scaling policy %s: %s" % (policy, e))
+        klass = getattr(mod, class_name, None)
+    if klass is None:
+        raise exception.BaseException(
+            "Unknown scaling policy '%s' (choose from: %s or a "
+            "module.ClassName path)" % (policy, ', '.join(sorted(POLICIES))))
+    if not isinstance(klass, type) or not issubclass(klass, ScalingPolicy):
+        raise exception.BaseException(
+            "Scaling policy %s must be a subclass of %s.ScalingPolicy" %
+            (policy, __name__))
+    return klass(**kwargs)
+
+
+def read_stats_csv(stats_file):
+    """
+    Reads a stats CSV written by SGEStats.write_stats_to_csv and returns a
+    list of (timestamp, hosts, running, queued, slots, avg_duration,
+    avg_wait) tuples where running and queued count slots. Files written
+    before the slot columns were added fall back to the task counts.
+    """
+    rows = []
+    f = open(stats_file)
+    try:
+        for line in f:
+            parts = line.strip().split(',')
+            if len(parts) < 7:
+                continue
+            dt = utils.iso_to_datetime_tuple(parts[0])
+            ts = calendar.timegm(dt.utctimetuple())
+            row = [ts] + [int(p) for p in parts[1:7]]
+            if len(parts) >= 10:
+                row[2:4] = [int(p) for p in parts[8:10]]
+            rows.append(tuple(row))
+    finally:
+        f.close()
+    return rows
+
+
+def replay(stats_file, policies, min_nodes=1, max_nodes=None,
+           add_nodes_per_iteration=1, stabilization_time=180,
+           slots_per_host=None):
+    """
+    Replays a recorded stats CSV against each policy and returns a dict of
+    results per policy name
+
+    The recorded running + queued slots are treated as the workload. Each
+    policy starts from the recorded number of hosts and its add/remove
+    decisions resize a simulated cluster that takes effect at the next
+    sample, so the resulting queue backlog depends on the policy. Results
+    include node_hours (cost), backlog_slot_hours (queued work left waiting),
+    max_queue_age, adds and removes.
+    """
+    rows = read_stats_csv(stats_file)
+    if not rows:
+        raise exception.BaseException("No stats found in %s" % stats_file)
+    if not slots_per_host:
+        slots_per_host = 1
+        for row in rows:
+            if row[1] and row[4]:
+                slots_per_host = max(row[4] / row[1], 1)
+                break
+    if max_nodes is None:
+        max_nodes = max(max(row[1] for row in rows), min_nodes)
+    results = {}
+    for name in policies:
+        policy = policies[name]
+        nodes = max(rows[0][1], min_nodes)
+        last_mod = None
+        queued_since = None
+        res = dict(node_hours=0.0, backlog_slot_hours=0.0, max_queue_age=0,
+                   adds=0, removes=0, max_nodes=nodes)
+        prev_ts = None
+        for ts, hosts, running, queued, slots, avg_dur, avg_wait in rows:
+            hours = (ts - prev_ts) / 3600.0 if prev_ts is not None else 0
+            prev_ts = ts
+            demand = running + queued
+            total_slots = nodes * slots_per_host
+            sim_running = min(demand, total_slots)
+            sim_queued = demand - sim_running
+            res['node_hours'] += nodes * hours
+            res['backlog_slot_hours'] += sim_queued * hours
+            if sim_queued:
+                if queued_since is None:
+                    queued_since = ts
+            else:
+                queued_since = None
+            age = ts - queued_since if queued_since is not None else 0
+            res['max_queue_age'] = max(res['max_queue_age'], age)
+            state = PolicyState(ts, nodes, total_slots, sim_running,
+                                sim_queued, slots_per_host,
+                                oldest_queued_age=age,
+                                avg_job_duration=avg_dur,
+                                avg_wait_time=avg_wait)
+            policy.observe(state)
+            stable = last_mod is None or ts - last_mod >= stabilization_time
+            if nodes < min_nodes:
+                add = min_nodes - nodes
+            elif nodes >= max_nodes or (not sim_queued and
+                                        nodes >= min_nodes):
+                add = 0
+            elif not stable:
+                add = 0
+            else:
+                add = policy.nodes_to_add(state)
+            add = min(add, add_nodes_per_iteration, max_nodes - nodes)
+            if add > 0:
+                nodes += add
+                res['adds'] += add
+                last_mod = ts
+                res['max_nodes'] = max(res['max_nodes'], nodes)
+                continue
+            if not stable or nodes <= min_nodes:
+                continue
+            idle_nodes = (total_slots - sim_running) / slots_per_host
+            remove = min(policy.nodes_to_remove(state), nodes - min_nodes,
+                         idle_nodes)
+            if remove > 0:
+                nodes -= remove
+                res['removes'] += remove
+                last_mod = ts
+        results[name] = res
+    return results
@@ -0,0 +1,405 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Offline simulator for the SGE load balancer
+
+Runs the real SGELoadBalancer.run() loop against a SimulatedCluster whose
+master node answers 'date', 'qhost', 'qstat' and accounting file requests from
+an in-memory SGE scheduler driven by a job trace. Time is virtual: polling
+sleeps and node boot times advance a clock instead of blocking, so thousands
+of iterations complete in seconds.
+"""
+import re
+import time
+import heapq
+import bisect
+import random
+import datetime
+
+from starcluster import utils
+from starcluster import exception
+from starcluster.balancers import sge
+
+# 2014-01-01 00:00:00 UTC
+DEFAULT_START = 1388534400
+
+
+class SimulatedJob(object):
+    def __init__(self, job_id, submit, duration, slots=1):
+        self.job_id = job_id
+        self.submit = submit
+        self.duration = duration
+        self.slots = slots
+        self.start = None
+        self.host = None
+
+    @property
+    def end(self):
+        return self.start + self.duration
+
+
+def synthetic_trace(num_jobs=1000, jobs_per_hour=120, mean_duration=1200,
+                    slots=1, seed=0, start=DEFAULT_START):
+    """
+    Returns a list of SimulatedJobs with Poisson arrivals and exponentially
+    distributed durations
+    """
+    rand = random.Random(seed)
+    jobs = []
+    t = start
+    for i in range(num_jobs):
+        t += rand.expovariate(jobs_per_hour / 3600.0)
+        duration = max(int(rand.expovariate(1.0 / mean_duration)), 1)
+        jobs.append(SimulatedJob(i + 1, int(t), duration, slots))
+    return jobs
+
+
+def load_trace(accounting_file):
+    """
+    Returns a list of SimulatedJobs from an SGE accounting file (e.g. a copy
+    of /opt/sge6/default/common/accounting). Jobs that never ran are skipped.
+    """
+    jobs = []
+    f = open(accounting_file)
+    try:
+        for line in f:
+            if not line.strip() or line.startswith('#'):
+                continue
+            fields = line.split(':')
+            try:
+                job_id = int(fields[5])
+                submit, start, end = [int(x) for x in fields[8:11]]
+                slots = int(fields[34]) if len(fields) > 34 else 1
+            except (ValueError, IndexError):
+                continue
+            if start == 0 or end == 0:
+                continue
+            jobs.append(SimulatedJob(job_id, submit, end - start, slots))
+    finally:
+        f.close()
+    if not jobs:
+        raise exception.BaseException("No jobs found in trace file %s" %
+                                      accounting_file)
+    jobs.sort(key=lambda j: j.submit)
+    return jobs
+
+
+class SimulatedNode(object):
+    def __init__(self, alias, launch_time, slots):
+        self.alias = alias
+        self.id = 'i-sim%s' % alias
+        self.dns_name = '%s.simulated' % alias
+        self.launch_time = utils.datetime_tuple_to_iso(launch_time)
+        self.slots = slots
+        self.used = 0
+
+    def is_master(self):
+        return self.alias == 'master'
+
+    def update(self):
+        return 'running'
+
+
+class SimulatedSSH(object):
+    """
+    Answers the remote commands issued by SGELoadBalancer from the simulated
+    cluster's state
+    """
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+    def execute(self, command, **kwargs):
+        cluster = self.cluster
+        if command.startswith('date'):
+            return [cluster.now_dt().isoformat()]
+        if command.startswith('qhost'):
+            return cluster.qhost_xml().splitlines()
+        if command.startswith('qstat'):
+            return cluster.qstat_xml().splitlines()
+        if sge.SGE_ACCOUNTING_FILE in command:
+            offset = int(re.search(r'off=(\d+)', command).group(1))
+            return cluster.accounting_since(offset)
+        raise exception.RemoteCommandFailed(
+            "simulator does not support command: %s" % command, command, 127,
+            '')
+
+
+class SimulatedMaster(SimulatedNode):
+    def __init__(self, cluster, launch_time, slots):
+        SimulatedNode.__init__(self, 'master', launch_time, slots)
+        self.ssh = SimulatedSSH(cluster)
+
+
+class SimulatedCluster(object):
+    """
+    Stand-in for starcluster.cluster.Cluster that runs a FIFO first-fit SGE
+    scheduler over a job trace on a virtual clock
+
+    boot_time - virtual seconds add_nodes() blocks for, like a real bring-up
+    """
+    def __init__(self, jobs, cluster_size=1, slots_per_host=8,
+                 boot_time=300, start=None, cluster_tag='simulated'):
+        self.cluster_tag = cluster_tag
+        self.cluster_size = cluster_size
+        self.slots_per_host = slots_per_host
+        self.boot_time = boot_time
+        self.now = start if start is not None else \
+            (jobs[0].submit if jobs else DEFAULT_START)
+        self.arrivals = sorted(jobs, key=lambda j: j.submit)
+        self.pending = []
+        self.running = []
+        self.completed = []
+        self.accounting = []
+        self.accounting_offsets = []
+        self.accounting_size = 0
+        self.node_seconds = 0.0
+        self.max_nodes = cluster_size
+        self.adds = 0
+        self.removes = 0
+        self._next_alias = 1
+        self.master_node = SimulatedMaster(self, self.now_dt(),
+                                           slots_per_host)
+        self.nodes = [self.master_node]
+        for i in range(cluster_size - 1):
+            self.nodes.append(self._new_node())
+
+    def now_dt(self):
+        return datetime.datetime.utcfromtimestamp(self.now).replace(
+            tzinfo=utils.get_utc_now().tzinfo)
+
+    def _new_node(self):
+        alias = 'node%.3d' % self._next_alias
+        self._next_alias += 1
+        return SimulatedNode(alias, self.now_dt(), self.slots_per_host)
+
+    @property
+    def running_nodes(self):
+        return list(self.nodes)
+
+    def is_cluster_up(self):
+        return True
+
+    @property
+    def done(self):
+        return not (self.arrivals or self.pending or self.running)
+
+    def advance(self, until):
+        """
+        Advances the virtual clock to `until` starting and finishing jobs as
+        slots become available along the way
+        """
+        while True:
+            next_end = self.running[0][0] if self.running else None
+            next_arrival = self.arrivals[0].submit if self.arrivals else None
+            events = [t for t in (next_end, next_arrival) if t is not None]
+            if not events or min(events) > until:
+                break
+            self._tick(min(events))
+            while self.running and self.running[0][0] <= self.now:
+                self._finish(heapq.heappop(self.running)[1])
+            while self.arrivals and self.arrivals[0].submit <= self.now:
+                self.pending.append(self.arrivals.pop(0))
+            self._schedule()
+        self._tick(until)
+
+    def _tick(self, t):
+        if t > self.now:
+            self.node_seconds += len(self.nodes) * (t - self.now)
+            self.now = t
+
+    def _finish(self, job):
+        job.host.used -= job.slots
+        self.completed.append(job)
+        rec = "all.q:%s:sim:sim:job%d:%d:sge:0:%d:%d:%d:0:0:%d\n" % (
+            job.host.alias, job.job_id, job.job_id, job.submit, job.start,
+            job.end, job.duration)
+        self.accounting.append(rec.rstrip('\n'))
+        self.accounting_offsets.append(self.accounting_size)
+        self.accounting_size += len(rec)
+
+    def _schedule(self):
+        free = sum(n.slots - n.used for n in self.nodes)
+        still_pending = []
+        for job in self.pending:
+            host = None
+            if free >= job.slots:
+                for node in self.nodes:
+                    if node.slots - node.used >= job.slots:
+                        host = node
+                        break
+            if host is None:
+                still_pending.append(job)
+                continue
+            host.used += job.slots
+            free -= job.slots
+            job.host = host
+            job.start = self.now
+            heapq.heappush(self.running, (job.end, job))
+        self.pending = still_pending
+
+    def accounting_since(self, offset):
+        if not self.accounting:
+            return []
+        idx = bisect.bisect_left(self.accounting_offsets, offset)
+        return ['1 %d' % self.accounting_size] + self.accounting[idx:]
+
+    def add_nodes(self, num_nodes, *args, **kwargs):
+        new_nodes = [self._new_node() for i in range(num_nodes)]
+        # instances are billed while they boot but can't run jobs yet
+        self.node_seconds += len(new_nodes) * self.boot_time
+        self.advance(self.now + self.boot_time)
+        for node in new_nodes:
+            node.launch_time = utils.datetime_tuple_to_iso(
+                self.now_dt() - datetime.timedelta(seconds=self.boot_time))
+        self.nodes.extend(new_nodes)
+        self.adds += num_nodes
+        self.max_nodes = max(self.max_nodes, len(self.nodes))
+        self._schedule()
+
+    def remove_node(self, node, *args, **kwargs):
+        if node.is_master():
+            raise exception.BaseException("cannot remove the master node")
+        for end, job in list(self.running):
+            if job.host is node:
+                # requeue jobs on the removed node like SGE does
+                self.running.remove((end, job))
+                job.start = job.host = None
+                self.pending.insert(0, job)
+        heapq.heapify(self.running)
+        self.nodes.remove(node)
+        self.removes += 1
+
+    def terminate_cluster(self, *args, **kwargs):
+        self.nodes = []
+
+    def qhost_xml(self):
+        hosts = ["<host name='global'></host>"]
+        for node in self.nodes:
+            load = float(node.used) / node.slots
+            hosts.append("<host name='%s.simulated'>"
+                         "<hostvalue name='num_proc'>%d</hostvalue>"
+                         "<hostvalue name='load_avg'>%.2f</hostvalue>"
+                         "</host>" % (node.alias, node.slots, load))
+        return "<?xml version='1.0'?>\n<qhost>\n%s\n</qhost>" % \
+            '\n'.join(hosts)
+
+    def _iso(self, t):
+        return datetime.datetime.utcfromtimestamp(t).strftime(
+            '%Y-%m-%dT%H:%M:%S')
+
+    def qstat_xml(self):
+        jobs_by_host = {}
+        for end, job in self.running:
+            jobs_by_host.setdefault(job.host.alias, []).append(job)
+        out = ["<?xml version='1.0'?>", "<job_info>", "<queue_info>"]
+        for node in self.nodes:
+            qname = 'all.q@%s' % node.alias
+            out.append("<Queue-List><name>%s</name>"
+                       "<slots_used>%d</slots_used>"
+                       "<slots_total>%d</slots_total>" %
+                       (qname, node.used, node.slots))
+            for job in jobs_by_host.get(node.alias, []):
+                out.append("<job_list state=\"running\">"
+                           "<JB_job_number>%d</JB_job_number>"
+                           "<state>r</state>"
+                           "<JAT_start_time>%s</JAT_start_time>"
+                           "<queue_name>%s</queue_name>"
+                           "<slots>%d</slots></job_list>" %
+                           (job.job_id, self._iso(job.start), qname,
+                            job.slots))
+            out.append("</Queue-List>")
+        out.append("</queue_info>")
+        out.append("<job_info>")
+        for job in self.pending:
+            out.append("<job_list state=\"pending\">"
+                       "<JB_job_number>%d</JB_job_number>"
+                       "<state>qw</state>"
+                       "<JB_submission_time>%s</JB_submission_time>"
+                       "<queue_name></queue_name>"
+                       "<slots>%d</slots></job_list>" %
+                       (job.job_id, self._iso(job.submit), job.slots))
+        out.append("</job_info>")
+        out.append("</job_info>")
+        return '\n'.join(out)
+
+
+class SimulatedLoadBalancer(sge.SGELoadBalancer):
+    """
+    SGELoadBalancer whose clock and sleeps are driven by a SimulatedCluster.
+    Stops after max_iterations or once the trace has been fully processed.
+    """
+    def __init__(self, cluster, max_iterations=10000, **kwargs):
+        self._sim = cluster
+        self.max_iterations = max_iterations
+        self.iterations = 0
+        self.decision_times = []
+        self._iter_start = None
+        super(SimulatedLoadBalancer, self).__init__(**kwargs)
+        # never read/write a real cursor file or stats dir
+        self.qacct_cursor_file = ''
+
+    def _now(self):
+        return self._sim.now_dt()
+
+    def _sleep(self, seconds):
+        if self._iter_start is not None:
+            self.decision_times.append(time.time() - self._iter_start)
+        self.iterations += 1
+        self._sim.advance(self._sim.now + seconds)
+        if self.iterations >= self.max_iterations or self._sim.done:
+            self._keep_polling = False
+        self._iter_start = time.time()
+
+
+def simulate(jobs, cluster_size=1, slots_per_host=8, boot_time=300,
+             max_iterations=10000, **lb_kwargs):
+    """
+    Runs SGELoadBalancer over `jobs` on a simulated cluster and returns a
+    dict of results: iterations, virtual hours, node_hours, jobs completed,
+    mean/p95/max job wait time (secs), mean/max decision latency (secs of
+    real time per balancer iteration), adds/removes and peak cluster size.
+    kwargs are passed to SGELoadBalancer (interval, stab, add_pi, ...)
+    """
+    cluster = SimulatedCluster(jobs, cluster_size=cluster_size,
+                               slots_per_host=slots_per_host,
+                               boot_time=boot_time)
+    lb_kwargs.setdefault('max_nodes', max(cluster_size, 1) * 10)
+    lb = SimulatedLoadBalancer(cluster, max_iterations=max_iterations,
+                               **lb_kwargs)
+    start = cluster.now
+    wall = time.time()
+    lb.run(cluster)
+    waits = [j.start - j.submit for j in cluster.completed]
+    latencies = lb.decision_times
+    return dict(
+        iterations=lb.iterations,
+        wall_time=time.time() - wall,
+        virtual_hours=(cluster.now - start) / 3600.0,
+        node_hours=cluster.node_seconds / 3600.0,
+        jobs_completed=len(cluster.completed),
+        jobs_remaining=len(cluster.arrivals) + len(cluster.pending) +
+        len(cluster.running),
+        mean_wait=sum(waits) / float(len(waits)) if waits else 0,
+        p95_wait=sge.percentile(sorted(waits), 95),
+        max_wait=max(waits) if waits else 0,
+        mean_decision_time=(sum(latencies) / len(latencies)
+                            if latencies else 0),
+        max_decision_time=max(latencies) if latencies else 0,
+        adds=cluster.adds,
+        removes=cluster.removes,
+        max_nodes=cluster.max_nodes)
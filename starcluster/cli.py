@@ -22,18 +22,98 @@ starcluster [global-opts] action [action-opts] [<action-args> ...]
 """
 import os
 import sys
+import time
 import shlex
 import socket
 import optparse
 import platform
+import __builtin__
 
-from boto.exception import BotoServerError, EC2ResponseError, S3ResponseError
+
+class ImportProfiler(object):
+    """
+    Records the time spent importing each module by wrapping __import__.
+    Cumulative times include the module's own imports, self times do not.
+    """
+    def __init__(self):
+        self.cumulative = {}
+        self.self_times = {}
+        self._stack = []
+        self._orig_import = None
+        self._start = None
+
+    def start(self):
+        self._start = time.time()
+        self._orig_import = __builtin__.__import__
+        __builtin__.__import__ = self._import
+
+    def stop(self):
+        if self._orig_import:
+            __builtin__.__import__ = self._orig_import
+            self._orig_import = None
+        return time.time() - self._start
+
+    def _import(self, name, globals=None, locals=None, fromlist=None,
+                *args, **kwargs):
+        nmods = len(sys.modules)
+        before = set(sys.modules)
+        self._stack.append(0)
+        start = time.time()
+        try:
+            return self._orig_import(name, globals, locals, fromlist, *args,
+                                     **kwargs)
+        finally:
+            elapsed = time.time() - start
+            child_time = self._stack.pop()
+            if self._stack:
+                self._stack[-1] += elapsed
+            if len(sys.modules) != nmods:
+                # attribute the time to the module that was asked for which
+                # may have been resolved relative to the importing package
+                modname = name
+                globals = globals or {}
+                pkg = globals.get('__name__', '')
+                if '__path__' not in globals:
+                    pkg = pkg.rpartition('.')[0]
+                relname = '%s.%s' % (pkg, name)
+                if pkg and sys.modules.get(relname) is not None and \
+                        relname not in before:
+                    modname = relname
+                # from package import submodule
+                subs = ['%s.%s' % (modname, f) for f in fromlist or []]
+                subs = [m for m in subs if m in sys.modules and
+                        m not in before]
+                if len(subs) == 1:
+                    modname = subs[0]
+                self.cumulative[modname] = elapsed
+                self.self_times[modname] = elapsed - child_time
+
+    def report(self, limit=25):
+        total = self.stop()
+        lines = ['Startup took %.3fs (%d modules imported)' %
+                 (total, len(self.cumulative)),
+                 '%10s %10s  %s' % ('cumulative', 'self', 'module')]
+        mods = sorted(self.cumulative, key=self.cumulative.get, reverse=True)
+        for mod in mods[:limit]:
+            lines.append('%9.1fms %9.1fms  %s' %
+                         (self.cumulative[mod] * 1000,
+                          self.self_times[mod] * 1000, mod))
+        print >> sys.stderr, '\n'.join(lines)
+
+
+# started before the rest of StarCluster is imported below so that the
+# report covers (nearly) all of startup
+_startup_profiler = None
+if '--profile-startup' in sys.argv:
+    _startup_profiler = ImportProfiler()
+    _startup_profiler.start()
 
 from starcluster import config
 from starcluster import static
 from starcluster import logger
 from starcluster import commands
 from starcluster import exception
+from starcluster import ratelimit
 from starcluster import completion
 from starcluster.logger import log, console
 from starcluster import __version__
@@ -126,13 +206,12 @@ class StarClusterCLI(object):
             gparser.usage += '%s\n' % ('-' * len(cmds_header))
             gparser.usage += "NOTE: Pass --help to any command for a list of "
             gparser.usage += 'its options and detailed usage information\n\n'
-            subcmds = subcmds or commands.all_cmds
-            for sc in subcmds:
-                helptxt = sc.__doc__.splitlines()[3].strip()
-                gparser.usage += '- %s: %s\n' % (', '.join(sc.names), helptxt)
-                for n in sc.names:
-                    assert n not in self.subcmds_map
-                    self.subcmds_map[n] = sc
+            subcmds = subcmds or commands.all_specs
+            for spec in subcmds:
+                gparser.usage += '- %s: %s\n' % (', '.join(spec.names),
+                                                 spec.help)
+            # command modules are only imported when looked up in the map
+            self.subcmds_map = commands.CommandMap(subcmds)
         gparser.add_option("-d", "--debug", dest="DEBUG",
                            action="store_true", default=False,
                            help="print debug messages (useful for "
@@ -143,6 +222,10 @@ class StarClusterCLI(object):
                            static.STARCLUSTER_CFG_FILE)
         gparser.add_option("-r", "--region", dest="REGION", action="store",
                            help="specify a region to use (default: us-east-1)")
+        gparser.add_option("--profile-startup", dest="PROFILE_STARTUP",
+                           action="store_true", default=False,
+                           help="report the time spent importing each module "
+                           "before running the command")
         gparser.disable_interspersed_args()
         return gparser
 
@@ -244,11 +327,9 @@ class StarClusterCLI(object):
                 except exception.ConfigError:
                     cfg = None
                 gopts.CONFIG = cfg
-            scmap = {}
-            for sc in commands.all_cmds:
-                sc.gopts = gopts
-                for n in sc.names:
-                    scmap[n] = sc
+            # only the command being completed (if any) gets imported
+            scmap = commands.CommandMap(
+                on_load=lambda sc: setattr(sc, 'gopts', gopts))
             listcter = completion.ListCompleter(scmap.keys())
             subcter = completion.NoneCompleter()
             completion.autocomplete(gparser, listcter, None, subcter,
@@ -259,6 +340,7 @@ class StarClusterCLI(object):
         """
         StarCluster main
         """
+        profiler = _startup_profiler
         # Handle Bash/ZSH completion if necessary
         self.handle_completion()
         # Show StarCluster header
@@ -269,6 +351,10 @@ class StarClusterCLI(object):
             # make 'help' subcommand act like --help option
             sc.parser.print_help()
             sys.exit(0)
+        from boto.exception import BotoServerError, EC2ResponseError
+        from boto.exception import S3ResponseError
+        if profiler:
+            profiler.report()
         # run the subcommand and handle exceptions
         try:
             sc.execute(args)
@@ -306,6 +392,8 @@ class StarClusterCLI(object):
         except Exception:
             log.error("Unhandled exception occured", exc_info=True)
             self.bug_found()
+        finally:
+            ratelimit.get_governor().log_metrics()
 
 
 def warn_debug_file_moved():
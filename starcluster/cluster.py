@@ -17,9 +17,13 @@
 
 import os
 import re
+import json
+import math
 import time
 import string
 import pprint
+import hashlib
+import threading
 import warnings
 import datetime
 
@@ -32,11 +36,13 @@ from starcluster import managers
 from starcluster import userdata
 from starcluster import deathrow
 from starcluster import exception
+from starcluster import ratelimit
 from starcluster import threadpool
 from starcluster import validators
 from starcluster import progressbar
 from starcluster import clustersetup
-from starcluster.node import Node
+from starcluster import completioncache
+from starcluster.node import Node, get_spot_batch_ids, get_spot_batch_tags
 from starcluster.plugins import sge
 from starcluster.utils import print_timing
 from starcluster.templates import user_msgs
@@ -47,13 +53,26 @@ class ClusterManager(managers.Manager):
     """
     Manager class for Cluster objects
     """
+    _pool = None
+
     def __repr__(self):
         return "<ClusterManager: %s>" % self.ec2.region.name
 
+    @property
+    def pool(self):
+        if not self._pool:
+            self._pool = threadpool.get_thread_pool(size=20,
+                                                    disable_threads=False)
+        return self._pool
+
     def get_cluster(self, cluster_name, group=None, load_receipt=True,
-                    load_plugins=True, load_volumes=True, require_keys=True):
+                    load_plugins=True, load_volumes=True, require_keys=True,
+                    instances=None):
         """
         Returns a Cluster object representing an active cluster
+
+        If instances is specified the cluster's node cache is primed with
+        these (already fetched) instances instead of querying EC2
         """
         try:
             clname = self._get_cluster_name(cluster_name)
@@ -62,6 +81,8 @@ class ClusterManager(managers.Manager):
                 group = self.ec2.get_security_group(clname)
             cl = Cluster(ec2_conn=self.ec2, cluster_tag=cltag,
                          cluster_group=group)
+            if instances is not None:
+                cl.prime_node_cache(instances)
             if load_receipt:
                 cl.load_receipt(load_plugins=load_plugins,
                                 load_volumes=load_volumes)
@@ -183,10 +204,12 @@ class ClusterManager(managers.Manager):
         Add one or more nodes to cluster
         """
         cl = self.get_cluster(cluster_name)
-        return cl.add_nodes(num_nodes, aliases=aliases, image_id=image_id,
-                            instance_type=instance_type, zone=zone,
-                            placement_group=placement_group, spot_bid=spot_bid,
-                            no_create=no_create)
+        nodes = cl.add_nodes(num_nodes, aliases=aliases, image_id=image_id,
+                             instance_type=instance_type, zone=zone,
+                             placement_group=placement_group,
+                             spot_bid=spot_bid, no_create=no_create)
+        self.update_completion_cache(cl)
+        return nodes
 
     def remove_node(self, cluster_name, alias=None, terminate=True,
                     force=False):
@@ -204,8 +227,10 @@ class ClusterManager(managers.Manager):
         """
         cl = self.get_cluster(cluster_name)
         nodes = cl.get_nodes(aliases) if aliases else None
-        return cl.remove_nodes(nodes=nodes, num_nodes=num_nodes,
-                               terminate=terminate, force=force)
+        removed = cl.remove_nodes(nodes=nodes, num_nodes=num_nodes,
+                                  terminate=terminate, force=force)
+        self.update_completion_cache(cl)
+        return removed
 
     def restart_cluster(self, cluster_name, reboot_only=False):
         """
@@ -230,6 +255,32 @@ class ClusterManager(managers.Manager):
         cl = self.get_cluster(cluster_name, load_receipt=not force,
                               require_keys=not force)
         cl.terminate_cluster(force=force)
+        try:
+            self.completion_cache.remove_cluster(cl.cluster_tag)
+        except Exception, e:
+            log.debug("unable to update completion cache: %s" % e)
+
+    @property
+    def completion_cache(self):
+        """
+        Returns the on-disk cache used for shell completion for this account
+        and region
+        """
+        key = completioncache.get_cache_key(self.cfg, self.ec2.region.name)
+        return completioncache.CompletionCache(key)
+
+    def update_completion_cache(self, cl):
+        """
+        Records cluster cl and its node aliases in the completion cache.
+        Errors are logged rather than raised since the cache is only used
+        for shell completion.
+        """
+        try:
+            aliases = [n.alias for n in cl.nodes]
+            self.completion_cache.update_cluster(cl.cluster_tag, aliases)
+        except Exception, e:
+            log.debug("unable to update completion cache: %s" % e,
+                      exc_info=True)
 
     def get_cluster_security_group(self, group_name):
         """
@@ -272,98 +323,214 @@ class ClusterManager(managers.Manager):
             raise ValueError("Invalid cluster group name: %s" % sg)
         return tag
 
-    def list_clusters(self, cluster_groups=None, show_ssh_status=False):
+    def _get_instances_by_group(self, cluster_groups, list_all=False):
+        """
+        Fetches the instances and active/open spot requests of all
+        cluster_groups with a single DescribeInstances and a single
+        DescribeSpotInstanceRequests call and returns two dictionaries
+        mapping each group's name to its instances and spot requests
+        """
+        names = [g.name for g in cluster_groups]
+        instances = dict([(name, []) for name in names])
+        spots = dict([(name, []) for name in names])
+        if not names:
+            return instances, spots
+        group_filter = names
+        if list_all:
+            group_filter = static.SECURITY_GROUP_TEMPLATE % '*'
+        filters = {'instance-state-name': ['pending', 'running', 'stopping',
+                                           'stopped'],
+                   'instance.group-name': group_filter}
+        for inst in self.ec2.get_all_instances(filters=filters):
+            for group in inst.groups:
+                if group.name in instances:
+                    instances[group.name].append(inst)
+        group_ids = dict([(g.id, g.name) for g in cluster_groups])
+        filters = {'state': ['active', 'open']}
+        for req in self.ec2.get_all_spot_requests(filters=filters):
+            spec = req.launch_specification
+            for group in getattr(spec, 'groups', None) or []:
+                name = group_ids.get(group.id, group.name)
+                if name in spots:
+                    spots[name].append(req)
+                    break
+        return instances, spots
+
+    def _get_cluster_summary(self, cl, spot_reqs, ssh_status=None):
+        """
+        Returns a dictionary summarizing cluster cl for list_clusters
+        """
+        scg = cl.cluster_group
+        nodes = cl.nodes
+        n = nodes[0] if nodes else None
+        state = getattr(n, 'state', None)
+        summary = dict(tag=cl.cluster_tag, security_group=scg.name,
+                       launch_time=None, uptime=None,
+                       vpc=scg.vpc_id, subnet=getattr(n, 'subnet_id', None),
+                       zone=getattr(n, 'placement', None),
+                       keypair=getattr(n, 'key_name', None),
+                       volumes=[], nodes=[],
+                       spot_requests=dict(active=0, open=0))
+        if state in ['pending', 'running']:
+            summary['launch_time'] = getattr(n, 'local_launch_time', None)
+            summary['uptime'] = getattr(n, 'uptime', None)
+        for node in nodes:
+            devices = node.attached_vols
+            for dev in sorted(devices or []):
+                d = devices.get(dev)
+                summary['volumes'].append(dict(id=d.volume_id,
+                                               node=node.alias or node.id,
+                                               device=dev, status=d.status))
+        for spot in spot_reqs:
+            if spot.state in summary['spot_requests']:
+                summary['spot_requests'][spot.state] += 1
+        for node in nodes:
+            ninfo = dict(alias=node.alias, state=node.state, id=node.id,
+                         addr=node.addr, spot_id=node.spot_id)
+            if ssh_status is not None:
+                ninfo['ssh'] = ssh_status.get(node.id, False)
+            summary['nodes'].append(ninfo)
+        return summary
+
+    def _print_cluster_summary(self, summary):
+        header = '%s (security group: %s)' % (summary['tag'],
+                                              summary['security_group'])
+        print '-' * len(header)
+        print header
+        print '-' * len(header)
+        print 'Launch time: %s' % (summary['launch_time'] or 'N/A')
+        print 'Uptime: %s' % (summary['uptime'] or 'N/A')
+        if summary['vpc']:
+            print 'VPC: %s' % summary['vpc']
+            print 'Subnet: %s' % (summary['subnet'] or 'N/A')
+        print 'Zone: %s' % (summary['zone'] or 'N/A')
+        print 'Keypair: %s' % (summary['keypair'] or 'N/A')
+        if summary['volumes']:
+            print 'EBS volumes:'
+            for vol in summary['volumes']:
+                print('    %(id)s on %(node)s:%(device)s '
+                      '(status: %(status)s)' % vol)
+        else:
+            print 'EBS volumes: N/A'
+        spots = summary['spot_requests']
+        if spots['active'] or spots['open']:
+            msg = []
+            if spots['active']:
+                msg.append('%d active' % spots['active'])
+            if spots['open']:
+                msg.append('%d open' % spots['open'])
+            print 'Spot requests: %s' % ', '.join(msg)
+        if summary['nodes']:
+            print 'Cluster nodes:'
+            for node in summary['nodes']:
+                nodeline = "    %7s %s %s %s" % (node['alias'], node['state'],
+                                                 node['id'],
+                                                 node['addr'] or '')
+                if node['spot_id']:
+                    nodeline += ' (spot %s)' % node['spot_id']
+                if 'ssh' in node:
+                    ssh_status = {True: 'Up', False: 'Down'}
+                    nodeline += ' (SSH: %s)' % ssh_status[node['ssh']]
+                print nodeline
+            print 'Total nodes: %d' % len(summary['nodes'])
+        else:
+            print 'Cluster nodes: N/A'
+        print
+
+    def _get_ssh_status(self, nodes):
         """
-        Prints a summary for each active cluster on EC2
+        Probes SSH on all running nodes concurrently and returns a
+        dictionary mapping node id to True/False
         """
-        if not cluster_groups:
+        running = [n for n in nodes if n.state == 'running']
+        status = self.pool.map_jobs(lambda n: n.is_ssh_up(), running,
+                                    jobid_fn=lambda n: n.id)
+        for node in nodes:
+            status.setdefault(node.id, False)
+        return status
+
+    def get_cluster_summaries(self, cluster_groups=None,
+                              show_ssh_status=False):
+        """
+        Returns a list of dictionaries summarizing each active cluster (or
+        only those in cluster_groups). Instances and spot requests for all
+        clusters are fetched in bulk and SSH is probed concurrently.
+        """
+        list_all = not cluster_groups
+        if list_all:
             cluster_groups = self.get_cluster_security_groups()
-            if not cluster_groups:
-                log.info("No clusters found...")
         else:
             try:
                 cluster_groups = [self.get_cluster_security_group(g) for g
                                   in cluster_groups]
             except exception.SecurityGroupDoesNotExist:
                 raise exception.ClusterDoesNotExist(g)
+        instances, spots = self._get_instances_by_group(cluster_groups,
+                                                        list_all=list_all)
+        clusters = []
+        summaries = []
         for scg in cluster_groups:
             tag = self.get_tag_from_sg(scg.name)
             try:
                 cl = self.get_cluster(tag, group=scg, load_plugins=False,
-                                      load_volumes=False, require_keys=False)
+                                      load_volumes=False, require_keys=False,
+                                      instances=instances[scg.name])
+                clusters.append(cl)
+                summaries.append(None)
             except exception.IncompatibleCluster as e:
+                summaries.append(dict(tag=tag, security_group=scg.name,
+                                      error=e.msg))
+        ssh_status = None
+        if show_ssh_status:
+            ssh_status = self._get_ssh_status(
+                [n for cl in clusters for n in cl.nodes])
+        for i, summary in enumerate(summaries):
+            if summary is None:
+                cl = clusters.pop(0)
+                summaries[i] = self._get_cluster_summary(
+                    cl, spots[cl.cluster_group.name], ssh_status=ssh_status)
+        self._cache_cluster_list(
+            dict([(s['tag'], [n['alias'] for n in s.get('nodes', [])])
+                  for s in summaries]), list_all)
+        return summaries
+
+    def list_clusters(self, cluster_groups=None, show_ssh_status=False,
+                      output_json=False):
+        """
+        Prints a summary for each active cluster on EC2 (as JSON if
+        output_json is True)
+        """
+        summaries = self.get_cluster_summaries(cluster_groups,
+                                               show_ssh_status)
+        if output_json:
+            print json.dumps(summaries, indent=2, sort_keys=True,
+                             default=str)
+            return
+        if not summaries:
+            log.info("No clusters found...")
+        for summary in summaries:
+            if 'error' in summary:
                 sep = '*' * 60
-                log.error('\n'.join([sep, e.msg, sep]),
+                log.error('\n'.join([sep, summary['error'], sep]),
                           extra=dict(__textwrap__=True))
                 print
                 continue
-            header = '%s (security group: %s)' % (tag, scg.name)
-            print '-' * len(header)
-            print header
-            print '-' * len(header)
-            nodes = cl.nodes
-            try:
-                n = nodes[0]
-            except IndexError:
-                n = None
-            state = getattr(n, 'state', None)
-            ltime = 'N/A'
-            uptime = 'N/A'
-            if state in ['pending', 'running']:
-                ltime = getattr(n, 'local_launch_time', 'N/A')
-                uptime = getattr(n, 'uptime', 'N/A')
-            print 'Launch time: %s' % ltime
-            print 'Uptime: %s' % uptime
-            if scg.vpc_id:
-                print 'VPC: %s' % scg.vpc_id
-                print 'Subnet: %s' % getattr(n, 'subnet_id', 'N/A')
-            print 'Zone: %s' % getattr(n, 'placement', 'N/A')
-            print 'Keypair: %s' % getattr(n, 'key_name', 'N/A')
-            ebs_vols = []
-            for node in nodes:
-                devices = node.attached_vols
-                if not devices:
-                    continue
-                node_id = node.alias or node.id
-                for dev in devices:
-                    d = devices.get(dev)
-                    vol_id = d.volume_id
-                    status = d.status
-                    ebs_vols.append((vol_id, node_id, dev, status))
-            if ebs_vols:
-                print 'EBS volumes:'
-                for vid, nid, dev, status in ebs_vols:
-                    print('    %s on %s:%s (status: %s)' %
-                          (vid, nid, dev, status))
-            else:
-                print 'EBS volumes: N/A'
-            spot_reqs = cl.spot_requests
-            if spot_reqs:
-                active = len([s for s in spot_reqs if s.state == 'active'])
-                opn = len([s for s in spot_reqs if s.state == 'open'])
-                msg = ''
-                if active != 0:
-                    msg += '%d active' % active
-                if opn != 0:
-                    if msg:
-                        msg += ', '
-                    msg += '%d open' % opn
-                print 'Spot requests: %s' % msg
-            if nodes:
-                print 'Cluster nodes:'
-                for node in nodes:
-                    nodeline = "    %7s %s %s %s" % (node.alias, node.state,
-                                                     node.id, node.addr or '')
-                    if node.spot_id:
-                        nodeline += ' (spot %s)' % node.spot_id
-                    if show_ssh_status:
-                        ssh_status = {True: 'Up', False: 'Down'}
-                        nodeline += ' (SSH: %s)' % ssh_status[node.is_up()]
-                    print nodeline
-                print 'Total nodes: %d' % len(nodes)
+            self._print_cluster_summary(summary)
+
+    def _cache_cluster_list(self, nodes, list_all):
+        """
+        Stores the clusters and node aliases displayed by list_clusters in
+        the completion cache
+        """
+        try:
+            cache = self.completion_cache
+            if list_all:
+                cache.set('clusters', sorted(nodes), nodes=nodes)
             else:
-                print 'Cluster nodes: N/A'
-            print
+                for tag in nodes:
+                    cache.update_cluster(tag, nodes[tag])
+        except Exception, e:
+            log.debug("unable to update completion cache: %s" % e)
 
     def run_plugin(self, plugin_name, cluster_tag):
         """
@@ -412,6 +579,10 @@ class Cluster(object):
                  disable_cloudinit=False,
                  subnet_id=None,
                  public_ips=None,
+                 pipelined_start=False,
+                 min_nodes=None,
+                 min_start_fraction=None,
+                 node_cache_ttl=30,
                  **kwargs):
         # update class vars with given vars
         _vars = locals().copy()
@@ -438,8 +609,15 @@ class Cluster(object):
         self._zone = None
         self._master = None
         self._nodes = []
+        self._nodes_updated = None
+        # guards the node cache which a backfill thread may be refreshing
+        self._nodes_lock = threading.RLock()
+        self._node_cache_stats = dict(full_refreshes=0, delta_refreshes=0,
+                                      api_calls_saved=0)
         self._pool = None
         self._progress_bar = None
+        self._backfill_thread = None
+        self._userdata_bundle = (None, None)
         self.__default_plugin = None
         self.__sge_plugin = None
 
@@ -681,14 +859,13 @@ class Cluster(object):
                           static.WORLD_CIDRIP)
 
     def _add_chunked_tags(self, sg, chunks, base_tag_name):
+        sg_tags = self.ec2.get_tags(sg)
         for i, chunk in enumerate(chunks):
             tag = "%s-%s" % (base_tag_name, i) if i != 0 else base_tag_name
-            if tag not in sg.tags:
-                sg.add_tag(tag, chunk)
+            if tag not in sg_tags:
+                self.ec2.add_tags(sg, {tag: chunk})
 
     def _add_tags_to_sg(self, sg):
-        if static.VERSION_TAG not in sg.tags:
-            sg.add_tag(static.VERSION_TAG, str(static.VERSION))
         core_settings = dict(cluster_size=self.cluster_size,
                              master_image_id=self.master_image_id,
                              master_instance_type=self.master_instance_type,
@@ -705,23 +882,30 @@ class Cluster(object):
                              keyname=self.keyname, spot_bid=self.spot_bid)
         core = utils.dump_compress_encode(core_settings, use_json=True,
                                           chunk_size=static.MAX_TAG_LEN)
-        self._add_chunked_tags(sg, core, static.CORE_TAG)
         user = utils.dump_compress_encode(user_settings, use_json=True,
                                           chunk_size=static.MAX_TAG_LEN)
-        self._add_chunked_tags(sg, user, static.USER_TAG)
+        # all settings tags go out in a single CreateTags request
+        with self.ec2.tag_batch():
+            if static.VERSION_TAG not in self.ec2.get_tags(sg):
+                self.ec2.add_tags(sg, {static.VERSION_TAG:
+                                       str(static.VERSION)})
+            self._add_chunked_tags(sg, core, static.CORE_TAG)
+            self._add_chunked_tags(sg, user, static.USER_TAG)
 
     def _load_chunked_tags(self, sg, base_tag_name):
-        tags = [i for i in sg.tags if i.startswith(base_tag_name)]
+        sg_tags = self.ec2.get_tags(sg)
+        tags = [i for i in sg_tags if i.startswith(base_tag_name)]
         tags.sort()
-        chunks = [sg.tags[i] for i in tags if i.startswith(base_tag_name)]
+        chunks = [sg_tags[i] for i in tags if i.startswith(base_tag_name)]
         return utils.decode_uncompress_load(chunks, use_json=True)
 
     def _get_settings_from_tags(self, sg=None):
         sg = sg or self.cluster_group
+        sg_tags = self.ec2.get_tags(sg)
         cluster = {}
-        if static.CORE_TAG in sg.tags:
+        if static.CORE_TAG in sg_tags:
             cluster.update(self._load_chunked_tags(sg, static.CORE_TAG))
-        if static.USER_TAG in sg.tags:
+        if static.USER_TAG in sg_tags:
             cluster.update(self._load_chunked_tags(sg, static.USER_TAG))
         return cluster
 
@@ -734,46 +918,170 @@ class Cluster(object):
 
     @property
     def master_node(self):
-        if not self._master:
-            for node in self.nodes:
-                if node.is_master():
-                    self._master = node
+        with self._nodes_lock:
             if not self._master:
-                raise exception.MasterDoesNotExist()
-        self._master.key_location = self.key_location
-        return self._master
+                for node in self.nodes:
+                    if node.is_master():
+                        self._master = node
+                if not self._master:
+                    raise exception.MasterDoesNotExist()
+            self._master.key_location = self.key_location
+            return self._master
 
     @property
     def nodes(self):
+        """
+        Returns this cluster's nodes (sorted by alias) from a cache that is
+        fully refreshed from EC2 at most every node_cache_ttl seconds. In
+        between full refreshes only nodes in a transitional state (e.g.
+        pending) are re-described. Call invalidate_nodes() to force a full
+        refresh on next access. A copy of the cache is returned as other
+        threads may refresh it at any time.
+        """
+        with self._nodes_lock:
+            updated = self._nodes_updated
+            if updated is None or time.time() - updated >= self.node_cache_ttl:
+                return self._refresh_nodes()
+            transitional = [n.id for n in self._nodes
+                            if n.state in static.TRANSITIONAL_INSTANCE_STATES]
+            if transitional:
+                self._delta_refresh_nodes(transitional)
+            else:
+                self._node_cache_stats['api_calls_saved'] += 1
+            for node in self._nodes:
+                node.key_location = self.key_location
+            return self._nodes[:]
+
+    def invalidate_nodes(self):
+        """
+        Forces the next access to self.nodes to fully refresh from EC2
+        """
+        self._nodes_updated = None
+
+    @property
+    def node_cache_stats(self):
+        """
+        Returns counters of full/delta node refreshes and the number of
+        DescribeInstances calls saved by the node cache
+        """
+        return self._node_cache_stats.copy()
+
+    def _delta_refresh_nodes(self, instance_ids):
+        log.debug('refreshing transitional nodes: %s' % instance_ids)
+        self._node_cache_stats['delta_refreshes'] += 1
+        states = ['pending', 'running', 'stopping', 'stopped']
+        filters = {'instance-id': instance_ids}
+        instances = self.ec2.get_all_instances(filters=filters)
+        instances = dict([(i.id, i) for i in instances])
+        with self._nodes_lock:
+            for node in self._nodes[:]:
+                if node.id not in instance_ids:
+                    continue
+                instance = instances.get(node.id)
+                if instance is None or instance.state not in states:
+                    self._nodes.remove(node)
+                else:
+                    node.instance = instance
+
+    def _refresh_nodes(self):
+        self._node_cache_stats['full_refreshes'] += 1
         states = ['pending', 'running', 'stopping', 'stopped']
         filters = {'instance-state-name': states,
                    'instance.group-name': self._security_group}
-        nodes = self.ec2.get_all_instances(filters=filters)
-        # remove any cached nodes not in the current node list from EC2
-        current_ids = [n.id for n in nodes]
-        remove_nodes = [n for n in self._nodes if n.id not in current_ids]
-        for node in remove_nodes:
-            self._nodes.remove(node)
-        # update node cache with latest instance data from EC2
-        existing_nodes = dict([(n.id, n) for n in self._nodes])
-        log.debug('existing nodes: %s' % existing_nodes)
-        for node in nodes:
-            if node.id in existing_nodes:
-                log.debug('updating existing node %s in self._nodes' % node.id)
-                enode = existing_nodes.get(node.id)
-                enode.key_location = self.key_location
-                enode.instance = node
-            else:
-                log.debug('adding node %s to self._nodes list' % node.id)
-                n = Node(node, self.key_location)
+        return self.prime_node_cache(self.ec2.get_all_instances(
+            filters=filters))
+
+    def prime_node_cache(self, nodes):
+        """
+        Replaces the node cache with the given list of this cluster's
+        (pending, running, stopping or stopped) instances, e.g. when they
+        were fetched in bulk for several clusters at once
+        """
+        with self._nodes_lock:
+            self._nodes_updated = time.time()
+            # remove any cached nodes not in the current node list from EC2
+            current_ids = [n.id for n in nodes]
+            remove_nodes = [n for n in self._nodes if n.id not in current_ids]
+            for node in remove_nodes:
+                self._nodes.remove(node)
+            # update node cache with latest instance data from EC2
+            existing_nodes = dict([(n.id, n) for n in self._nodes])
+            log.debug('existing nodes: %s' % existing_nodes)
+            new_nodes = []
+            for node in nodes:
+                if node.id in existing_nodes:
+                    log.debug('updating existing node %s in self._nodes' %
+                              node.id)
+                    enode = existing_nodes.get(node.id)
+                    enode.key_location = self.key_location
+                    enode.instance = node
+                else:
+                    new_nodes.append(Node(node, self.key_location))
+            self._resolve_aliases(new_nodes)
+            for n in new_nodes:
+                log.debug('adding node %s to self._nodes list' % n.id)
                 if n.is_master():
                     self._master = n
                     self._nodes.insert(0, n)
                 else:
                     self._nodes.append(n)
-        self._nodes.sort(key=lambda n: n.alias)
-        log.debug('returning self._nodes = %s' % self._nodes)
-        return self._nodes
+            self._nodes.sort(key=lambda n: n.alias)
+            log.debug('returning self._nodes = %s' % self._nodes)
+            return self._nodes[:]
+
+    def _resolve_aliases(self, nodes):
+        """
+        Resolves the alias of every node that isn't tagged with one yet.
+
+        All instances launched by the same request share one user data
+        payload so its aliases file is fetched and decoded once per
+        reservation (or batch of spot requests) rather than once per node.
+        The missing alias/Name tags are then buffered and flushed together as
+        a few multi-resource CreateTags requests.
+        """
+        untagged = [n for n in nodes
+                    if not (n._alias or n.tags.get('alias'))]
+        if not untagged:
+            return nodes
+        spot_ids = [n.spot_id for n in untagged if n.is_spot()]
+        spot_tags = self.ec2.get_all_tags(spot_ids)
+        groups = {}
+        for node in untagged:
+            batch = get_spot_batch_ids(spot_tags.get(node.spot_id, {}))
+            if batch:
+                # batched spot instances share user data but not reservations
+                key = (static.SPOT_BATCH_TAG, tuple(batch))
+            else:
+                key = getattr(node.instance, 'reservation_id', None) or node.id
+            groups.setdefault(key, []).append(node)
+        with self.ec2.tag_batch():
+            for key, rnodes in groups.items():
+                user_data = rnodes[0].user_data
+                aliasestxt = user_data.get(static.UD_ALIASES_FNAME, '')
+                aliases = aliasestxt.splitlines()[2:]
+                for node in rnodes:
+                    node._user_data = user_data
+                    if isinstance(key, tuple):
+                        index = list(key[1]).index(node.spot_id)
+                    elif node.is_spot() and len(aliases) > 1:
+                        # every instance of an untagged spot batch has
+                        # ami_launch_index 0 (see Node.alias)
+                        log.debug("spot request %s has no batch tags" %
+                                  node.spot_id)
+                        continue
+                    else:
+                        index = node.ami_launch_index
+                    try:
+                        alias = aliases[index]
+                    except IndexError:
+                        log.debug("invalid aliases file in user_data:\n%s" %
+                                  aliasestxt)
+                        continue
+                    tags = {'alias': alias}
+                    if not node.tags.get('Name'):
+                        tags['Name'] = alias
+                    self.ec2.add_tags(node.instance, tags)
+        return nodes
 
     def get_nodes_or_raise(self):
         nodes = self.nodes
@@ -893,21 +1201,49 @@ class Cluster(object):
                                  placement_group=placement_group,
                                  spot_bid=spot_bid, force_flat=force_flat)[0]
 
-    def _get_cluster_userdata(self, aliases):
-        alias_file = utils.string_to_file('\n'.join(['#ignored'] + aliases),
-                                          static.UD_ALIASES_FNAME)
+    def _get_userdata_bundle(self):
+        """
+        Returns a userdata.UserDataBundle holding the plugins, volumes and
+        userdata scripts shared by all nodes. The bundle is cached by a hash
+        of its contents so the shared payload is only encoded and compressed
+        again when it changes.
+        """
         plugins = utils.dump_compress_encode(self._plugins)
-        plugins_file = utils.string_to_file('\n'.join(['#ignored', plugins]),
-                                            static.UD_PLUGINS_FNAME)
         volumes = utils.dump_compress_encode(self.volumes)
-        volumes_file = utils.string_to_file('\n'.join(['#ignored', volumes]),
-                                            static.UD_VOLUMES_FNAME)
-        udfiles = [alias_file, plugins_file, volumes_file]
-        user_scripts = self.userdata_scripts or []
-        udfiles += [open(f) for f in user_scripts]
+        scripts = []
+        for path in self.userdata_scripts or []:
+            f = open(path)
+            try:
+                scripts.append((path, f.read()))
+            finally:
+                f.close()
         use_cloudinit = not self.disable_cloudinit
-        udata = userdata.bundle_userdata_files(udfiles,
-                                               use_cloudinit=use_cloudinit)
+        key = hashlib.sha1(repr((plugins, volumes, scripts,
+                                 use_cloudinit))).hexdigest()
+        cached_key, bundle = self._userdata_bundle
+        if key != cached_key:
+            udfiles = [
+                utils.string_to_file('\n'.join(['#ignored', plugins]),
+                                     static.UD_PLUGINS_FNAME),
+                utils.string_to_file('\n'.join(['#ignored', volumes]),
+                                     static.UD_VOLUMES_FNAME)]
+            udfiles += [utils.string_to_file(data, path)
+                        for path, data in scripts]
+            bundle = userdata.UserDataBundle(udfiles,
+                                             use_cloudinit=use_cloudinit)
+            self._userdata_bundle = (key, bundle)
+        return bundle
+
+    def _get_cluster_userdata(self, aliases, bundle=None):
+        """
+        Returns the user data for nodes with the given aliases. Pass a bundle
+        from _get_userdata_bundle() when building user data for many sets of
+        aliases.
+        """
+        bundle = bundle or self._get_userdata_bundle()
+        alias_file = utils.string_to_file('\n'.join(['#ignored'] + aliases),
+                                          static.UD_ALIASES_FNAME)
+        udata = bundle.build([alias_file])
         log.debug('Userdata size in KB: %.2f' % utils.size_in_kb(udata))
         return udata
 
@@ -956,18 +1292,49 @@ class Cluster(object):
             kwargs.update(security_groups=[cluster_sg])
         resvs = []
         if spot_bid:
-            security_group_id = self.cluster_group.id
-            for alias in aliases:
-                if not self.subnet_id:
-                    kwargs['security_group_ids'] = [security_group_id]
-                kwargs['user_data'] = self._get_cluster_userdata([alias])
-                resvs.extend(self.ec2.request_instances(image_id, **kwargs))
+            if not self.subnet_id:
+                kwargs['security_group_ids'] = [self.cluster_group.id]
+            bundle = self._get_userdata_bundle()
+            batches = []
+            try:
+                for i in range(0, len(aliases),
+                               static.MAX_SPOT_REQUEST_COUNT):
+                    chunk = aliases[i:i + static.MAX_SPOT_REQUEST_COUNT]
+                    kwargs['count'] = len(chunk)
+                    kwargs['user_data'] = self._get_cluster_userdata(
+                        chunk, bundle=bundle)
+                    reqs = self.ec2.request_instances(image_id, **kwargs)
+                    if len(reqs) > 1:
+                        batches.append(reqs)
+                    resvs.extend(reqs)
+            finally:
+                # batches that were requested before a failure (or Ctrl-C)
+                # are live and must still be matched to their aliases
+                self._tag_spot_batches(batches)
         else:
             resvs.append(self.ec2.request_instances(image_id, **kwargs))
         for resv in resvs:
             log.info(str(resv), extra=dict(__raw__=True))
+        self.invalidate_nodes()
         return resvs
 
+    def _tag_spot_batches(self, batches):
+        """
+        Tags every spot request in each batch (list of spot requests made by
+        a single RequestSpotInstances call) with the batch's ordered request
+        ids so that their instances can be matched to the batch's aliases
+        once fulfilled (see node.get_spot_batch_tags)
+        """
+        if not batches:
+            return
+        self.ec2.wait_for_propagation(
+            spot_requests=[r for reqs in batches for r in reqs])
+        with self.ec2.tag_batch():
+            for reqs in batches:
+                tags = get_spot_batch_tags([r.id for r in reqs])
+                for req in reqs:
+                    self.ec2.add_tags(req, tags)
+
     def _get_next_node_num(self):
         nodes = self._nodes_in_states(['pending', 'running'])
         nodes = filter(lambda x: not x.is_master(), nodes)
@@ -1037,9 +1404,8 @@ class Cluster(object):
                 self.ec2.wait_for_propagation(instances=resp[0].instances)
         self.wait_for_cluster(msg="Waiting for node(s) to come up...")
         log.debug("Adding node(s): %s" % aliases)
-        for alias in aliases:
-            node = self.get_node(alias)
-            self.run_plugins(method_name="on_add_node", node=node)
+        self.run_plugins(method_name="on_add_nodes",
+                         node=self.get_nodes(aliases))
 
     def remove_node(self, node=None, terminate=True, force=False):
         """
@@ -1070,16 +1436,16 @@ class Cluster(object):
                 if node.is_master():
                     raise exception.InvalidOperation(
                         "cannot remove master node")
-        for node in nodes:
-            try:
-                self.run_plugins(method_name="on_remove_node", node=node,
-                                 reverse=True)
-            except:
-                if not force:
-                    raise
-            if not terminate:
-                continue
-            node.terminate()
+        try:
+            self.run_plugins(method_name="on_remove_nodes", node=nodes,
+                             reverse=True)
+        except:
+            if not force:
+                raise
+        if terminate:
+            for node in nodes:
+                node.terminate()
+        self.invalidate_nodes()
 
     def _get_launch_map(self, reverse=False):
         """
@@ -1201,10 +1567,11 @@ class Cluster(object):
 
     def _create_spot_cluster(self):
         """
-        Launches cluster using spot instances for all worker nodes. This method
-        makes a single spot request for each node in the cluster since spot
-        instances *always* have an ami_launch_index of 0. This is needed in
-        order to correctly assign aliases to nodes.
+        Launches cluster using spot instances for all worker nodes. Worker
+        nodes with the same instance type and image id are requested together
+        in batches of up to static.MAX_SPOT_REQUEST_COUNT instances. Since
+        spot instances *always* have an ami_launch_index of 0 their aliases
+        are assigned from the batch's spot requests once fulfilled.
         """
         master_alias = self._make_alias(master=True)
         (mtype, mimage) = self._get_type_and_image_id(master_alias)
@@ -1226,14 +1593,16 @@ class Cluster(object):
             # Make sure nodes are in same zone as master
             zone = master_response.instances[0].placement
             insts.extend(master_response.instances)
-        for id in range(1, self.cluster_size):
-            alias = self._make_alias(id)
-            (ntype, nimage) = self._get_type_and_image_id(alias)
+        lmap = self._get_launch_map()
+        for (ntype, nimage) in sorted(lmap):
+            aliases = [a for a in lmap[(ntype, nimage)] if a != master_alias]
+            if not aliases:
+                continue
             log.info("Launching %s (ami: %s, type: %s)" %
-                     (alias, nimage, ntype))
-            spot_req = self.create_node(alias, image_id=nimage,
-                                        instance_type=ntype, zone=zone)
-            spot_reqs.append(spot_req)
+                     (', '.join(aliases), nimage, ntype))
+            spot_reqs.extend(self.create_nodes(aliases, image_id=nimage,
+                                               instance_type=ntype,
+                                               zone=zone))
         self.ec2.wait_for_propagation(instances=insts, spot_requests=spot_reqs)
 
     def is_spot_cluster(self):
@@ -1379,15 +1748,18 @@ class Cluster(object):
             log.info('Waiting for open spot requests to become active...')
             pbar.maxval = len(spots)
             pbar.update(0)
+            poll = ratelimit.PollInterval(self.refresh_interval)
             while not pbar.finished:
                 active_spots = [s for s in spots if s.state == "active" and
                                 s.instance_id]
                 pbar.maxval = len(spots)
                 pbar.update(len(active_spots))
                 if not pbar.finished:
-                    time.sleep(self.refresh_interval)
+                    poll.sleep(len(active_spots), len(spots))
                     spots = self.get_spot_requests_or_raise()
             pbar.reset()
+            # fulfilled spot requests add new instances to the cluster
+            self.invalidate_nodes()
         self.ec2.wait_for_propagation(
             instances=[s.instance_id for s in spots])
 
@@ -1403,6 +1775,7 @@ class Cluster(object):
         pbar.update(0)
         now = datetime.datetime.utcnow()
         timeout = now + datetime.timedelta(minutes=kill_pending_after_mins)
+        poll = ratelimit.PollInterval(self.refresh_interval)
         while not pbar.finished:
             running_nodes = [n for n in nodes if n.state == "running"]
             pbar.maxval = len(nodes)
@@ -1416,7 +1789,7 @@ class Cluster(object):
                     for node in pending:
                         node.terminate()
                 else:
-                    time.sleep(self.refresh_interval)
+                    poll.sleep(len(running_nodes), len(nodes))
                 nodes = self.get_nodes_or_raise()
         pbar.reset()
 
@@ -1515,6 +1888,7 @@ class Cluster(object):
         log.info("Rebooting cluster...")
         for node in nodes:
             node.reboot()
+        self.invalidate_nodes()
         if reboot_only:
             return
         sleep = 20
@@ -1556,6 +1930,7 @@ class Cluster(object):
         self.detach_volumes()
         for node in nodes:
             node.shutdown()
+        self.invalidate_nodes()
 
     def terminate_cluster(self, force=False):
         """
@@ -1574,14 +1949,16 @@ class Cluster(object):
         nodes = self.nodes
         for node in nodes:
             node.terminate()
+        self.invalidate_nodes()
         for spot in self.spot_requests:
             if spot.state not in ['cancelled', 'closed']:
                 log.info("Canceling spot instance request: %s" % spot.id)
                 spot.cancel()
         s = utils.get_spinner("Waiting for cluster to terminate...")
+        poll = ratelimit.PollInterval(5)
         try:
             while not self.is_cluster_terminated():
-                time.sleep(5)
+                poll.sleep()
         finally:
             s.stop()
         region = self.ec2.region.name
@@ -1646,6 +2023,7 @@ class Cluster(object):
             for node in self.stopped_nodes:
                 log.info("Starting stopped node: %s" % node.alias)
                 node.start()
+            self.invalidate_nodes()
         if create_only:
             return
         self.setup_cluster()
@@ -1654,11 +2032,179 @@ class Cluster(object):
         """
         Waits for all nodes to come up and then runs the default
         StarCluster setup routines followed by any additional plugin setup
-        routines
+        routines. If pipelined_start, min_nodes or min_start_fraction are
+        set nodes are configured as they come up instead (see
+        _setup_cluster_pipelined).
         """
+        if self.pipelined_start or self.min_nodes or self.min_start_fraction:
+            return self._setup_cluster_pipelined()
         self.wait_for_cluster()
         self._setup_cluster()
 
+    def _iter_ready_nodes(self, num_nodes, kill_pending_after_mins=15):
+        """
+        Generator that polls the cluster's instances and yields
+        (new_nodes, num_nodes) tuples as soon as nodes' SSH daemons come up
+        until num_nodes nodes have been yielded. Nodes still pending
+        kill_pending_after_mins after their own launch time are terminated
+        and no longer waited on, in which case num_nodes is lowered and
+        yielded (possibly with an empty list of new nodes).
+        """
+        ready = set()
+        killed = set()
+        poll = ratelimit.PollInterval(self.refresh_interval, min_interval=2)
+        max_pending = datetime.timedelta(minutes=kill_pending_after_mins)
+        while len(ready) < num_nodes:
+            if len(self.nodes) < num_nodes:
+                # open spot requests have yet to launch all instances
+                self.invalidate_nodes()
+            nodes = [n for n in self.nodes
+                     if n.id not in ready and n.id not in killed]
+            running = [n for n in nodes if n.state == 'running']
+            up = self.pool.map(lambda n: n.is_ssh_up() and n, running,
+                               jobid_fn=lambda n: n.alias)
+            new_nodes = sorted([n for n in up if n], key=lambda n: n.alias)
+            now = utils.get_utc_now()
+            pending = [n for n in nodes if n.state == 'pending' and
+                       now - utils.iso_to_datetime_tuple(n.launch_time) >
+                       max_pending]
+            if pending:
+                log.warn("%d nodes have been pending for >= %d mins "
+                         "- terminating" % (len(pending),
+                                            kill_pending_after_mins))
+                for node in pending:
+                    node.terminate()
+                killed.update([n.id for n in pending])
+                num_nodes -= len(pending)
+            if new_nodes:
+                ready.update([n.id for n in new_nodes])
+                log.info("%d/%d nodes are up: %s" %
+                         (len(ready), num_nodes,
+                          ', '.join([n.alias for n in new_nodes])))
+            if new_nodes or pending:
+                yield new_nodes, num_nodes
+            if len(ready) < num_nodes:
+                poll.sleep(len(ready), num_nodes)
+
+    def _get_min_nodes(self, num_nodes):
+        """
+        Returns the number of nodes (out of num_nodes) that must be up before
+        the cluster is brought online according to the min_nodes and
+        min_start_fraction settings
+        """
+        min_nodes = 0
+        if self.min_start_fraction:
+            min_nodes = int(math.ceil(num_nodes * self.min_start_fraction))
+        if self.min_nodes:
+            min_nodes = max(min_nodes, self.min_nodes)
+        if not min_nodes:
+            return num_nodes
+        return max(1, min(min_nodes, num_nodes))
+
+    @print_timing("Configuring cluster")
+    def _setup_cluster_pipelined(self):
+        """
+        Configures the cluster while its nodes are still coming up. The
+        master is configured (volumes, default setup and SGE) as soon as its
+        SSH is up together with any workers that are up by then. Workers that
+        come up later are each added to the cluster via the built-in plugins'
+        on_add_nodes hooks as soon as they're up. Once all nodes are
+        configured the remaining plugins are run on the full cluster.
+
+        If min_nodes/min_start_fraction is set the plugins are run as soon as
+        that many nodes are configured and the remaining nodes are handed
+        off to a background thread that adds them to the cluster as they come
+        up (see wait_for_backfill).
+        """
+        spots = [s for s in self.spot_requests if s.state == 'open']
+        num_nodes = len(self.nodes) + len(spots)
+        min_nodes = self._get_min_nodes(num_nodes)
+        log.info("Configuring cluster as nodes come up... "
+                 "(updating every %ds)" % self.refresh_interval)
+        if min_nodes < num_nodes:
+            log.info("Cluster will be available once %d/%d nodes are up" %
+                     (min_nodes, num_nodes))
+        ready = []
+        master_ready = False
+        ready_nodes = self._iter_ready_nodes(num_nodes)
+        for new_nodes, num_nodes in ready_nodes:
+            ready.extend(new_nodes)
+            ready.sort(key=lambda n: n.alias)
+            if not master_ready:
+                if not [n for n in ready if n.is_master()]:
+                    continue
+                master_ready = True
+                log.info("The master node is %s" % self.master_node.dns_name)
+                if self.volumes:
+                    self.attach_volumes_to_master()
+                for plug in self._builtin_plugins:
+                    self.run_plugin(plug, nodes=ready)
+            elif new_nodes:
+                for plug in self._builtin_plugins:
+                    self.run_plugin(plug, method_name="on_add_nodes",
+                                    node=new_nodes, nodes=ready)
+            if master_ready and min_nodes <= len(ready) < num_nodes:
+                break
+        if not master_ready:
+            raise exception.BaseException(
+                "The master node never came up - the cluster was not "
+                "configured (%d/%d nodes are up)" % (len(ready), num_nodes))
+        for plug in self.plugins:
+            self.run_plugin(plug, nodes=ready)
+        if len(ready) < num_nodes:
+            log.info("Cluster is online with %d/%d nodes - adding the "
+                     "remaining nodes as they come up" %
+                     (len(ready), num_nodes))
+            self._backfill_thread = threading.Thread(
+                target=self._backfill_nodes, args=(ready_nodes, ready[:]),
+                name='backfill-%s' % self.cluster_tag)
+            self._backfill_thread.daemon = True
+            self._backfill_thread.start()
+        log.debug("SSH connection pool stats: %s" %
+                  sshutils.get_connection_pool().stats)
+
+    def _backfill_nodes(self, ready_nodes, ready):
+        """
+        Adds the nodes yielded by the ready_nodes generator to the cluster by
+        running all plugins' on_add_nodes hooks as each batch comes up
+        """
+        try:
+            for new_nodes, total in ready_nodes:
+                if not new_nodes:
+                    continue
+                ready.extend(new_nodes)
+                ready.sort(key=lambda n: n.alias)
+                log.info("Adding node(s) to the cluster: %s" %
+                         ', '.join([n.alias for n in new_nodes]))
+                for plug in self._builtin_plugins + self.plugins:
+                    self.run_plugin(plug, method_name="on_add_nodes",
+                                    node=new_nodes, nodes=ready)
+        except Exception:
+            log.error("Failed to add remaining nodes to the cluster",
+                      exc_info=True)
+
+    @property
+    def is_backfilling(self):
+        """
+        Returns True while nodes are still being added to the cluster in the
+        background after a partial-capacity start (see min_nodes)
+        """
+        thread = self._backfill_thread
+        return thread is not None and thread.is_alive()
+
+    def wait_for_backfill(self):
+        """
+        Blocks until all nodes still coming up after a partial-capacity start
+        have been added to the cluster
+        """
+        thread = self._backfill_thread
+        if thread is None:
+            return
+        while thread.is_alive():
+            # join with a timeout so that Ctrl-C still works
+            thread.join(1)
+        self._backfill_thread = None
+
     @print_timing("Configuring cluster")
     def _setup_cluster(self):
         """
@@ -1670,6 +2216,15 @@ class Cluster(object):
         if self.volumes:
             self.attach_volumes_to_master()
         self.run_plugins()
+        log.debug("SSH connection pool stats: %s" %
+                  sshutils.get_connection_pool().stats)
+
+    @property
+    def _builtin_plugins(self):
+        plugs = [self._default_plugin]
+        if not self.disable_queue:
+            plugs.append(self._sge_plugin)
+        return plugs
 
     def run_plugins(self, plugins=None, method_name="run", node=None,
                     reverse=False):
@@ -1680,16 +2235,17 @@ class Cluster(object):
         plugins must be a tuple: the first element is the plugin's name, the
         second element is the plugin object (a subclass of ClusterSetup)
         """
-        plugs = [self._default_plugin]
-        if not self.disable_queue:
-            plugs.append(self._sge_plugin)
+        plugs = self._builtin_plugins
         plugs += (plugins or self.plugins)[:]
         if reverse:
             plugs.reverse()
         for plug in plugs:
             self.run_plugin(plug, method_name=method_name, node=node)
 
-    def run_plugin(self, plugin, name='', method_name='run', node=None):
+    _batch_plugin_hooks = ['on_add_nodes', 'on_remove_nodes']
+
+    def run_plugin(self, plugin, name='', method_name='run', node=None,
+                   nodes=None):
         """
         Run a StarCluster plugin.
 
@@ -1697,18 +2253,30 @@ class Cluster(object):
         name - a user-friendly label for the plugin
         method_name - the method to run within the plugin (default: "run")
         node - optional node to pass as first argument to plugin method (used
-        for on_add_node/on_remove_node)
+        for on_add_node/on_remove_node). Pass a list of nodes for
+        on_add_nodes/on_remove_nodes.
+        nodes - the cluster nodes passed to the plugin (defaults to all of
+        this cluster's nodes)
         """
         plugin_name = name or getattr(plugin, '__name__',
                                       utils.get_fq_class_name(plugin))
         try:
             func = getattr(plugin, method_name, None)
+            args = [nodes or self.nodes, self.master_node, self.cluster_user,
+                    self.cluster_shell, self.volumes]
+            if not func and method_name in self._batch_plugin_hooks and \
+               getattr(plugin, method_name[:-1], None):
+                # plugin predates the batched hooks - call the per-node hook
+                # for each node instead
+                hook = getattr(plugin, method_name[:-1])
+                log.info("Running plugin %s" % plugin_name)
+                for n in node:
+                    hook(n, *args)
+                return
             if not func:
                 log.warn("Plugin %s has no %s method...skipping" %
                          (plugin_name, method_name))
                 return
-            args = [self.nodes, self.master_node, self.cluster_user,
-                    self.cluster_shell, self.volumes]
             if node:
                 args.insert(0, node)
             log.info("Running plugin %s" % plugin_name)
@@ -1807,6 +2375,7 @@ class ClusterValidator(validators.Validator):
             self.validate_dns_prefix()
             self.validate_spot_bid()
             self.validate_cluster_size()
+            self.validate_min_nodes()
             self.validate_cluster_user()
             self.validate_shell_setting()
             self.validate_permission_settings()
@@ -1880,6 +2449,18 @@ class ClusterValidator(validators.Validator):
                 "must be <= cluster_size-1 (%s)" % (num_itypes, num_nodes))
         return True
 
+    def validate_min_nodes(self):
+        cluster = self.cluster
+        if cluster.min_nodes is not None:
+            if cluster.min_nodes < 1:
+                raise exception.ClusterValidationError(
+                    'min_nodes must be an integer >= 1')
+        fraction = cluster.min_start_fraction
+        if fraction is not None and not 0 < fraction <= 1:
+            raise exception.ClusterValidationError(
+                'min_start_fraction must be > 0 and <= 1')
+        return True
+
     def validate_cluster_user(self):
         if self.cluster.cluster_user == "root":
             raise exception.ClusterValidationError(
@@ -2205,20 +2786,23 @@ class ClusterValidator(validators.Validator):
             if not os.path.isfile(script):
                 raise exception.ClusterValidationError(
                     "Userdata script is not a file: %s" % script)
-        if self.cluster.spot_bid is None:
-            lmap = self.cluster._get_launch_map()
-            aliases = max(lmap.values(), key=lambda x: len(x))
-            ud = self.cluster._get_cluster_userdata(aliases)
-        else:
-            ud = self.cluster._get_cluster_userdata(
-                [self.cluster._make_alias(id=1)])
+        lmap = self.cluster._get_launch_map()
+        aliases = max(lmap.values(), key=lambda x: len(x))
+        if self.cluster.spot_bid is not None:
+            aliases = aliases[:static.MAX_SPOT_REQUEST_COUNT]
+        ud = self.cluster._get_cluster_userdata(aliases)
         ud_size_kb = utils.size_in_kb(ud)
-        if ud_size_kb > 16:
+        max_kb = static.MAX_USERDATA_SIZE / 1024
+        if len(ud) > static.MAX_USERDATA_SIZE:
             raise exception.ClusterValidationError(
                 "User data is too big! (%.2fKB)\n"
-                "User data scripts combined and compressed must be <= 16KB\n"
+                "User data scripts combined and compressed must be <= %dKB\n"
                 "NOTE: StarCluster uses anywhere from 0.5-2KB "
-                "to store internal metadata" % ud_size_kb)
+                "to store internal metadata" % (ud_size_kb, max_kb))
+        elif len(ud) > static.MAX_USERDATA_SIZE * 0.9:
+            log.warn("User data is %.2fKB which is close to the %dKB limit "
+                     "- adding more plugins, volumes or userdata scripts "
+                     "may exceed it" % (ud_size_kb, max_kb))
 
     def validate_vpc(self):
         if self.cluster.subnet_id:
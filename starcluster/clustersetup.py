@@ -18,6 +18,8 @@
 """
 clustersetup.py
 """
+import stat
+import hashlib
 import posixpath
 
 from starcluster import utils
@@ -50,6 +52,42 @@ class ClusterSetup(object):
         """
         raise NotImplementedError('on_remove_node method not implemented')
 
+    def on_add_nodes(self, new_nodes, nodes, master, user, user_shell,
+                     volumes):
+        """
+        This method gets executed after one or more nodes have been added to
+        the cluster. Override this to configure all new nodes at once. The
+        default implementation calls on_add_node for each new node.
+        """
+        for node in new_nodes:
+            self.on_add_node(node, nodes, master, user, user_shell, volumes)
+
+    def on_remove_nodes(self, old_nodes, nodes, master, user, user_shell,
+                        volumes):
+        """
+        This method gets executed before one or more nodes are about to be
+        removed from the cluster. Override this to clean up after all of the
+        nodes at once. The default implementation calls on_remove_node for
+        each node.
+        """
+        for node in old_nodes:
+            self.on_remove_node(node, nodes, master, user, user_shell,
+                                volumes)
+
+    def _uses_legacy_hook(self, base, hook):
+        """
+        Returns True if this plugin's class overrides base's per-node hook
+        (e.g. on_add_node) but not the batched version (on_add_nodes). Used
+        by plugins implementing the batched hooks so that subclasses which
+        only customize the per-node hook keep getting called once per node.
+        """
+        klass = self.__class__
+        batch_hook = hook + 's'
+        return (getattr(klass, hook).im_func is not
+                getattr(base, hook).im_func and
+                getattr(klass, batch_hook).im_func is
+                getattr(base, batch_hook).im_func)
+
     def on_restart(self, nodes, master, user, user_shell, volumes):
         """
         This method gets executed before restart the cluster
@@ -97,6 +135,7 @@ class DefaultClusterSetup(ClusterSetup):
         self._disable_threads = disable_threads
         self._num_threads = num_threads
         self._pool = None
+        self._pushed = {}
 
     @property
     def pool(self):
@@ -123,6 +162,16 @@ class DefaultClusterSetup(ClusterSetup):
             self.pool.simple_job(node.set_hostname, (), jobid=node.alias)
         self.pool.wait(numtasks=len(nodes))
 
+    def _load_identity_maps(self, nodes):
+        """
+        Fetch /etc/passwd and /etc/group from all nodes in parallel so that
+        subsequent uid/gid lookups are served from each node's cache
+        """
+        for node in nodes:
+            self.pool.simple_job(node.load_identity_maps, (),
+                                 jobid=node.alias)
+        self.pool.wait(numtasks=len(nodes))
+
     def _get_max_unused_user_id(self):
         first_uid = 1000
         uid, gid = first_uid, first_uid
@@ -181,6 +230,7 @@ class DefaultClusterSetup(ClusterSetup):
         chowning potentially terabytes of data.
         """
         user = user or self._user
+        self._load_identity_maps(self._nodes)
         uid, gid = self._get_new_user_id(user)
         if uid == 0 or gid == 0:
             raise exception.BaseException(
@@ -217,19 +267,18 @@ class DefaultClusterSetup(ClusterSetup):
         self.pool.wait(numtasks=len(nodes))
 
     def _setup_scratch_on_node(self, node, users=None):
-        nconn = node.ssh
+        batch = node.ssh.batch()
         users = users or [self._user]
+        scratch = '/scratch'
+        batch.mkdir(scratch)
         for user in users:
             user_scratch = '/mnt/%s' % user
-            if not nconn.path_exists(user_scratch):
-                nconn.mkdir(user_scratch)
-            nconn.execute('chown -R %(user)s:%(user)s /mnt/%(user)s' %
-                          {'user': user})
-            scratch = '/scratch'
-            if not nconn.path_exists(scratch):
-                nconn.mkdir(scratch)
-            if not nconn.path_exists(posixpath.join(scratch, user)):
-                nconn.execute('ln -s %s %s' % (user_scratch, scratch))
+            batch.mkdir(user_scratch)
+            batch.chown(user, user, user_scratch, recursive=True)
+            batch.execute('[ -e %s ] || ln -s %s %s' %
+                          (posixpath.join(scratch, user), user_scratch,
+                           scratch))
+        batch.run()
 
     def _setup_scratch(self, nodes=None, users=None):
         """ Configure scratch space on all StarCluster nodes """
@@ -242,14 +291,73 @@ class DefaultClusterSetup(ClusterSetup):
                                  jobid=node.alias)
         self.pool.wait(numtasks=len(nodes))
 
+    def _push_to_nodes(self, name, nodes, contents, push_fn):
+        """
+        Calls push_fn(node) concurrently for each node in nodes whose copy of
+        `name` was not already updated with the same contents by this plugin.
+        Returns the list of nodes that were pushed to.
+        """
+        digest = hashlib.md5(contents).hexdigest()
+        stale = [n for n in nodes if self._pushed.get((n.id, name)) != digest]
+        if len(stale) < len(nodes):
+            log.debug("%s already up to date on %d node(s)" %
+                      (name, len(nodes) - len(stale)))
+        self.pool.map_jobs(push_fn, stale, jobid_fn=lambda n: n.alias)
+        for node in stale:
+            self._pushed[(node.id, name)] = digest
+        return stale
+
+    def _forget_pushed(self, nodes, name=None):
+        for node in nodes:
+            for key in self._pushed.keys():
+                if key[0] == node.id and name in (None, key[1]):
+                    del self._pushed[key]
+
     def _setup_etc_hosts(self, nodes=None):
         """ Configure /etc/hosts on all StarCluster nodes"""
         log.info("Configuring /etc/hosts on each node")
         nodes = nodes or self._nodes
-        for node in nodes:
-            self.pool.simple_job(node.add_to_etc_hosts, (nodes, ),
-                                 jobid=node.alias)
-        self.pool.wait(numtasks=len(nodes))
+        entries = '\n'.join([n.get_hosts_entry() for n in nodes])
+        self._push_to_nodes('/etc/hosts', nodes, entries,
+                            lambda n: n.add_to_etc_hosts(nodes))
+
+    def _get_known_hosts_entries(self, nodes):
+        """
+        Fetches every node's host key concurrently and returns a dict mapping
+        node alias to the node's known_hosts lines
+        """
+        return self.pool.map_jobs(lambda n: n.get_known_hosts_entries(),
+                                  nodes, jobid_fn=lambda n: n.alias)
+
+    def _copy_ssh_files(self, username, nodes, files):
+        """
+        Copy files from username's ~/.ssh on the master to the same location
+        on each node in nodes concurrently, skipping nodes that already
+        received identical copies
+        """
+        user = self._master.getpwnam(username)
+        ssh_folder = posixpath.join(user.pw_dir, '.ssh')
+        copies = []
+        for fname in files:
+            path = posixpath.join(ssh_folder, fname)
+            rf = self._master.ssh.remote_file(path, 'r')
+            try:
+                copies.append((path, rf.read(), rf.stat()))
+            finally:
+                rf.close()
+
+        def _copy(node):
+            batch = node.ssh.batch()
+            batch.mkdir(ssh_folder, mode=0700)
+            batch.chown(user.pw_uid, user.pw_gid, ssh_folder)
+            for path, contents, sts in copies:
+                batch.write_file(path, contents,
+                                 mode=stat.S_IMODE(sts.st_mode),
+                                 uid=sts.st_uid, gid=sts.st_gid)
+            batch.run()
+        nodes = filter(lambda n: n.id != self._master.id, nodes)
+        contents = ''.join([c[1] for c in copies])
+        self._push_to_nodes(ssh_folder, nodes, contents, _copy)
 
     def _setup_passwordless_ssh(self, nodes=None):
         """
@@ -259,15 +367,21 @@ class DefaultClusterSetup(ClusterSetup):
         log.info("Configuring passwordless ssh for root")
         master = self._master
         nodes = nodes or self.nodes
+        # fetch every host key once, in parallel, for both users
+        host_keys = self._get_known_hosts_entries(
+            filter(lambda n: n.id != master.id, nodes) + [master])
         master.generate_key_for_user('root', auth_new_key=True,
                                      auth_conn_key=True)
-        master.enable_passwordless_ssh('root', nodes)
+        master.add_to_known_hosts('root', nodes, host_keys=host_keys)
+        self._copy_ssh_files('root', nodes, ['id_rsa', 'id_rsa.pub',
+                                             'authorized_keys',
+                                             'known_hosts'])
         # generate public/private keys, authorized_keys, and known_hosts files
         # for cluster_user once on master node...NFS takes care of the rest
         log.info("Configuring passwordless ssh for %s" % self._user)
         master.generate_key_for_user(self._user, auth_new_key=True,
                                      auth_conn_key=True)
-        master.add_to_known_hosts(self._user, nodes)
+        master.add_to_known_hosts(self._user, nodes, host_keys=host_keys)
 
     def _setup_ebs_volumes(self):
         """
@@ -374,6 +488,7 @@ class DefaultClusterSetup(ClusterSetup):
         self._user = user
         self._user_shell = user_shell
         self._volumes = volumes
+        self._pushed = {}
         self._setup_hostnames()
         self._setup_ebs_volumes()
         self._setup_cluster_user()
@@ -382,19 +497,42 @@ class DefaultClusterSetup(ClusterSetup):
         self._setup_nfs()
         self._setup_passwordless_ssh()
 
-    def _remove_from_etc_hosts(self, node):
-        nodes = filter(lambda x: x.id != node.id, self.running_nodes)
+    def _remaining_nodes(self, old_nodes):
+        old_ids = [n.id for n in old_nodes]
+        return filter(lambda x: x.id not in old_ids, self.running_nodes)
+
+    def _remove_from_etc_hosts(self, old_nodes):
+        nodes = self._remaining_nodes(old_nodes)
+        self._forget_pushed(old_nodes)
+        self._forget_pushed(nodes, name='/etc/hosts')
         for n in nodes:
-            n.remove_from_etc_hosts([node])
+            self.pool.simple_job(n.remove_from_etc_hosts, (old_nodes,),
+                                 jobid=n.alias)
+        self.pool.wait(numtasks=len(nodes))
+
+    def _remove_nfs_exports(self, old_nodes):
+        self._master.stop_exporting_fs_to_nodes(old_nodes)
 
-    def _remove_nfs_exports(self, node):
-        self._master.stop_exporting_fs_to_nodes([node])
+    def _remove_from_known_hosts_on_node(self, node, old_nodes):
+        node.remove_from_known_hosts('root', old_nodes)
+        node.remove_from_known_hosts(self._user, old_nodes)
 
-    def _remove_from_known_hosts(self, node):
-        nodes = filter(lambda x: x.id != node.id, self.running_nodes)
+    def _remove_from_known_hosts(self, old_nodes):
+        nodes = self._remaining_nodes(old_nodes)
         for n in nodes:
-            n.remove_from_known_hosts('root', [node])
-            n.remove_from_known_hosts(self._user, [node])
+            self.pool.simple_job(self._remove_from_known_hosts_on_node,
+                                 (n, old_nodes), jobid=n.alias)
+        self.pool.wait(numtasks=len(nodes))
+
+    def _remove_nodes(self, old_nodes):
+        aliases = ', '.join([n.alias for n in old_nodes])
+        log.info("Removing node(s) %s..." % aliases)
+        log.info("Removing %s from known_hosts files" % aliases)
+        self._remove_from_known_hosts(old_nodes)
+        log.info("Removing %s from /etc/hosts" % aliases)
+        self._remove_from_etc_hosts(old_nodes)
+        log.info("Removing %s from NFS" % aliases)
+        self._remove_nfs_exports(old_nodes)
 
     def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
         self._nodes = nodes
@@ -402,18 +540,38 @@ class DefaultClusterSetup(ClusterSetup):
         self._user = user
         self._user_shell = user_shell
         self._volumes = volumes
-        log.info("Removing node %s (%s)..." % (node.alias, node.id))
-        log.info("Removing %s from known_hosts files" % node.alias)
-        self._remove_from_known_hosts(node)
-        log.info("Removing %s from /etc/hosts" % node.alias)
-        self._remove_from_etc_hosts(node)
-        log.info("Removing %s from NFS" % node.alias)
-        self._remove_nfs_exports(node)
-
-    def _create_user(self, node):
+        self._remove_nodes([node])
+
+    def on_remove_nodes(self, old_nodes, nodes, master, user, user_shell,
+                        volumes):
+        if self._uses_legacy_hook(DefaultClusterSetup, 'on_remove_node'):
+            return super(DefaultClusterSetup, self).on_remove_nodes(
+                old_nodes, nodes, master, user, user_shell, volumes)
+        self._nodes = nodes
+        self._master = master
+        self._user = user
+        self._user_shell = user_shell
+        self._volumes = volumes
+        self._remove_nodes(old_nodes)
+
+    def _create_user(self, nodes):
+        self._load_identity_maps(
+            [self._master] + [n for n in nodes if n.id != self._master.id])
         user = self._master.getpwnam(self._user)
         uid, gid = user.pw_uid, user.pw_gid
-        self._add_user_to_nodes(uid, gid, nodes=[node])
+        self._add_user_to_nodes(uid, gid, nodes=nodes)
+
+    def _add_nodes(self, new_nodes):
+        """
+        Configure new_nodes and update /etc/hosts, NFS exports and
+        known_hosts once for the whole batch
+        """
+        self._setup_hostnames(nodes=new_nodes)
+        self._setup_etc_hosts(self._nodes)
+        self._setup_nfs(nodes=new_nodes, start_server=False)
+        self._create_user(new_nodes)
+        self._setup_scratch(nodes=new_nodes)
+        self._setup_passwordless_ssh(nodes=new_nodes)
 
     def on_add_node(self, node, nodes, master, user, user_shell, volumes):
         self._nodes = nodes
@@ -421,9 +579,16 @@ class DefaultClusterSetup(ClusterSetup):
         self._user = user
         self._user_shell = user_shell
         self._volumes = volumes
-        self._setup_hostnames(nodes=[node])
-        self._setup_etc_hosts(nodes)
-        self._setup_nfs(nodes=[node], start_server=False)
-        self._create_user(node)
-        self._setup_scratch(nodes=[node])
-        self._setup_passwordless_ssh(nodes=[node])
+        self._add_nodes([node])
+
+    def on_add_nodes(self, new_nodes, nodes, master, user, user_shell,
+                     volumes):
+        if self._uses_legacy_hook(DefaultClusterSetup, 'on_add_node'):
+            return super(DefaultClusterSetup, self).on_add_nodes(
+                new_nodes, nodes, master, user, user_shell, volumes)
+        self._nodes = nodes
+        self._master = master
+        self._user = user
+        self._user_shell = user_shell
+        self._volumes = volumes
+        self._add_nodes(new_nodes)
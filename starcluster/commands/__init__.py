@@ -15,82 +15,160 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
-from start import CmdStart
-from addnode import CmdAddNode
-from removenode import CmdRemoveNode
-from stop import CmdStop
-from terminate import CmdTerminate
-from restart import CmdRestart
-from sshmaster import CmdSshMaster
-from sshnode import CmdSshNode
-from sshinstance import CmdSshInstance
-from listclusters import CmdListClusters
-from s3image import CmdS3Image
-from ebsimage import CmdEbsImage
-from downloadimage import CmdDownloadImage
-from createvolume import CmdCreateVolume
-from resizevolume import CmdResizeVolume
-from listkeypairs import CmdListKeyPairs
-from listzones import CmdListZones
-from listregions import CmdListRegions
-from listimages import CmdListImages
-from listbuckets import CmdListBuckets
-from showimage import CmdShowImage
-from showbucket import CmdShowBucket
-from removevolume import CmdRemoveVolume
-from removeimage import CmdRemoveImage
-from listinstances import CmdListInstances
-from listspots import CmdListSpots
-from showconsole import CmdShowConsole
-from listvolumes import CmdListVolumes
-from listpublic import CmdListPublic
-from runplugin import CmdRunPlugin
-from spothistory import CmdSpotHistory
-from loadbalance import CmdLoadBalance
-from shell import CmdShell
-from createkey import CmdCreateKey
-from removekey import CmdRemoveKey
-from put import CmdPut
-from get import CmdGet
-from help import CmdHelp
+"""
+Registry of StarCluster's subcommands
 
-all_cmds = [
-    CmdStart(),
-    CmdStop(),
-    CmdTerminate(),
-    CmdRestart(),
-    CmdListClusters(),
-    CmdSshMaster(),
-    CmdSshNode(),
-    CmdPut(),
-    CmdGet(),
-    CmdAddNode(),
-    CmdRemoveNode(),
-    CmdLoadBalance(),
-    CmdSshInstance(),
-    CmdListInstances(),
-    CmdListSpots(),
-    CmdListImages(),
-    CmdListPublic(),
-    CmdListKeyPairs(),
-    CmdCreateKey(),
-    CmdRemoveKey(),
-    CmdS3Image(),
-    CmdEbsImage(),
-    CmdShowImage(),
-    CmdDownloadImage(),
-    CmdRemoveImage(),
-    CmdCreateVolume(),
-    CmdListVolumes(),
-    CmdResizeVolume(),
-    CmdRemoveVolume(),
-    CmdSpotHistory(),
-    CmdShowConsole(),
-    CmdListRegions(),
-    CmdListZones(),
-    CmdListBuckets(),
-    CmdShowBucket(),
-    CmdRunPlugin(),
-    CmdShell(),
-    CmdHelp(),
+Each subcommand's module is only imported the first time the command is
+looked up in a CommandMap so that running (or TAB-completing) one command
+doesn't pay for importing every other command and its dependencies.
+"""
+import importlib
+
+
+class CommandSpec(object):
+    """
+    Describes a subcommand without importing it. help must match the fourth
+    line of the command class' docstring which is what 'starcluster --help'
+    displays.
+    """
+    def __init__(self, module, class_name, names, help):
+        self.module = module
+        self.class_name = class_name
+        self.names = names
+        self.help = help
+        self._cmd = None
+
+    def load(self):
+        """
+        Import the command's module and return a (cached) command instance
+        """
+        if self._cmd is None:
+            mod = importlib.import_module('%s.%s' % (__name__, self.module))
+            self._cmd = getattr(mod, self.class_name)()
+        return self._cmd
+
+
+class CommandMap(dict):
+    """
+    Dictionary mapping every command name and alias to its command object.
+    Commands are imported on first lookup and passed to on_load (if given).
+    """
+    def __init__(self, specs=None, on_load=None):
+        dict.__init__(self)
+        self.specs = specs or all_specs
+        self.on_load = on_load
+        for spec in self.specs:
+            for name in spec.names:
+                assert name not in self, "duplicate command name: %s" % name
+                dict.__setitem__(self, name, spec)
+
+    def __getitem__(self, name):
+        spec = dict.__getitem__(self, name)
+        loaded = spec._cmd is not None
+        cmd = spec.load()
+        if not loaded and self.on_load:
+            self.on_load(cmd)
+        return cmd
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def values(self):
+        return [self[spec.names[0]] for spec in self.specs]
+
+    def items(self):
+        return [(name, self[name]) for name in self.keys()]
+
+
+all_specs = [
+    CommandSpec('start', 'CmdStart', ['start'], 'Start a new cluster'),
+    CommandSpec('stop', 'CmdStop', ['stop'],
+                'Stop a running EBS-backed cluster'),
+    CommandSpec('terminate', 'CmdTerminate', ['terminate'],
+                'Terminate a running or stopped cluster'),
+    CommandSpec('restart', 'CmdRestart', ['restart', 'reboot'],
+                'Restart an existing cluster'),
+    CommandSpec('listclusters', 'CmdListClusters', ['listclusters', 'lc'],
+                'List all active clusters'),
+    CommandSpec('sshmaster', 'CmdSshMaster', ['sshmaster', 'sm'],
+                "SSH to a cluster's master node"),
+    CommandSpec('sshnode', 'CmdSshNode', ['sshnode', 'sn'],
+                'SSH to a cluster node'),
+    CommandSpec('put', 'CmdPut', ['put'], 'Copy files to a running cluster'),
+    CommandSpec('get', 'CmdGet', ['get'],
+                'Copy one or more files from a running cluster to your local '
+                'machine'),
+    CommandSpec('addnode', 'CmdAddNode', ['addnode', 'an'],
+                'Add a node to a running cluster'),
+    CommandSpec('removenode', 'CmdRemoveNode', ['removenode', 'rn'],
+                'Terminate one or more nodes in the cluster'),
+    CommandSpec('loadbalance', 'CmdLoadBalance', ['loadbalance', 'bal'],
+                'Start the SGE Load Balancer.'),
+    CommandSpec('sshinstance', 'CmdSshInstance', ['sshinstance', 'si'],
+                'SSH to an EC2 instance'),
+    CommandSpec('listinstances', 'CmdListInstances', ['listinstances', 'lsi'],
+                'List all running EC2 instances'),
+    CommandSpec('listspots', 'CmdListSpots', ['listspots', 'ls'],
+                'List all EC2 spot instance requests'),
+    CommandSpec('listimages', 'CmdListImages', ['listimages', 'li'],
+                'List all registered EC2 images (AMIs)'),
+    CommandSpec('listpublic', 'CmdListPublic', ['listpublic', 'lp'],
+                'List all public StarCluster images on EC2'),
+    CommandSpec('listkeypairs', 'CmdListKeyPairs', ['listkeypairs', 'lk'],
+                'List all EC2 keypairs'),
+    CommandSpec('createkey', 'CmdCreateKey', ['createkey', 'ck'],
+                'Create a new Amazon EC2 keypair'),
+    CommandSpec('removekey', 'CmdRemoveKey', ['removekey', 'rk'],
+                'Remove a keypair from Amazon EC2'),
+    CommandSpec('s3image', 'CmdS3Image', ['s3image', 'simg', 'createimage'],
+                'Create a new instance-store (S3) AMI from a running EC2 '
+                'instance'),
+    CommandSpec('ebsimage', 'CmdEbsImage', ['ebsimage', 'eimg'],
+                'Create a new EBS image (AMI) from a running EC2 instance'),
+    CommandSpec('showimage', 'CmdShowImage', ['showimage', 'shimg'],
+                'Show all AMI parts and manifest files on S3 for an '
+                'instance-store AMI'),
+    CommandSpec('downloadimage', 'CmdDownloadImage', ['downloadimage', 'di'],
+                'Download the manifest.xml and all AMI parts for an '
+                'instance-store AMI'),
+    CommandSpec('removeimage', 'CmdRemoveImage', ['removeimage', 'ri'],
+                'Deregister an EC2 image (AMI)'),
+    CommandSpec('createvolume', 'CmdCreateVolume', ['createvolume', 'cv'],
+                'Create a new EBS volume for use with StarCluster'),
+    CommandSpec('listvolumes', 'CmdListVolumes', ['listvolumes', 'lv'],
+                'List all EBS volumes'),
+    CommandSpec('resizevolume', 'CmdResizeVolume', ['resizevolume', 'res'],
+                'Resize an existing EBS volume'),
+    CommandSpec('removevolume', 'CmdRemoveVolume', ['removevolume', 'rv'],
+                'Delete one or more EBS volumes'),
+    CommandSpec('spothistory', 'CmdSpotHistory', ['spothistory', 'shi'],
+                'Show spot instance pricing history stats (last 30 days by '
+                'default)'),
+    CommandSpec('showconsole', 'CmdShowConsole', ['showconsole', 'sc'],
+                'Show console output for an EC2 instance'),
+    CommandSpec('listregions', 'CmdListRegions', ['listregions', 'lr'],
+                'List all EC2 regions'),
+    CommandSpec('listzones', 'CmdListZones', ['listzones', 'lz'],
+                'List all EC2 availability zones in the current region '
+                '(default: us-east-1)'),
+    CommandSpec('listbuckets', 'CmdListBuckets', ['listbuckets', 'lb'],
+                'List all S3 buckets'),
+    CommandSpec('showbucket', 'CmdShowBucket', ['showbucket', 'sb'],
+                'Show all files in an S3 bucket'),
+    CommandSpec('runplugin', 'CmdRunPlugin', ['runplugin', 'rp'],
+                'Run a StarCluster plugin on a running cluster'),
+    CommandSpec('shell', 'CmdShell', ['shell', 'sh'],
+                'Load an interactive IPython shell configured for starcluster '
+                'development'),
+    CommandSpec('help', 'CmdHelp', ['help'], 'Show StarCluster usage'),
 ]
+
+
+def get_all_cmds():
+    """
+    Imports and returns every command object
+    """
+    return [spec.load() for spec in all_specs]
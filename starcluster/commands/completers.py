@@ -15,7 +15,9 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
+from starcluster import static
 from starcluster import completion
+from starcluster import completioncache
 from starcluster.logger import log
 
 from base import CmdBase
@@ -30,6 +32,49 @@ class Completer(CmdBase):
     def completer(self):
         return self._completer()
 
+    @property
+    def completion_cache(self):
+        key = completioncache.get_cache_key(self.cfg, self.gopts.REGION)
+        return completioncache.CompletionCache(key)
+
+    def _fetch_clusters(self):
+        cm = self.cm
+        return sorted([cm.get_tag_from_sg(sg.name) for sg in
+                       cm.get_cluster_security_groups()])
+
+    def _fetch_nodes(self):
+        glob = static.SECURITY_GROUP_TEMPLATE % '*'
+        instances = self.ec2.get_all_instances(
+            filters={'instance.group-name': glob})
+        nodes = {}
+        for i in instances:
+            for group in i.groups:
+                if group.name.startswith(static.SECURITY_GROUP_PREFIX):
+                    tag = self.cm.get_tag_from_sg(group.name)
+                    alias = i.tags.get('alias')
+                    aliases = nodes.setdefault(tag, [])
+                    if alias:
+                        aliases.append(alias)
+        return dict([(tag, sorted(a)) for tag, a in nodes.items()])
+
+    def _fetch_images(self):
+        return [[i.id, i.root_device_type] for i in
+                self.ec2.registered_images]
+
+    def _fetch_instances(self):
+        return [[i.id, i.dns_name] for i in self.ec2.get_all_instances()]
+
+    def _fetch_volumes(self):
+        return [v.id for v in self.ec2.get_volumes()]
+
+    def cached(self, name):
+        """
+        Returns the completion data for name ('clusters', 'nodes', 'images',
+        'instances' or 'volumes') from the on-disk completion cache
+        """
+        fetch_fn = getattr(self, '_fetch_%s' % name)
+        return self.completion_cache.fetch(name, fetch_fn)
+
 
 class ClusterCompleter(Completer):
     """
@@ -37,11 +82,7 @@ class ClusterCompleter(Completer):
     """
     def _completer(self):
         try:
-            cm = self.cm
-            clusters = cm.get_cluster_security_groups()
-            completion_list = [cm.get_tag_from_sg(sg.name)
-                               for sg in clusters]
-            return completion.ListCompleter(completion_list)
+            return completion.ListCompleter(self.cached('clusters'))
         except Exception, e:
             log.error('something went wrong fix me: %s' % e)
 
@@ -52,18 +93,18 @@ class NodeCompleter(Completer):
     """
     def _completer(self):
         try:
-            cm = self.cm
-            clusters = cm.get_cluster_security_groups()
-            compl_list = [cm.get_tag_from_sg(sg.name) for sg in clusters]
+            compl_list = list(self.cached('clusters'))
+            nodes = self.cached('nodes')
             max_num_nodes = 0
-            for scluster in clusters:
-                num_instances = len(scluster.instances())
-                if num_instances > max_num_nodes:
-                    max_num_nodes = num_instances
+            aliases = set()
+            for tag in nodes:
+                max_num_nodes = max(max_num_nodes, len(nodes[tag]))
+                aliases.update(nodes[tag])
             compl_list.extend(['master'])
-            compl_list.extend([str(i) for i in range(0, num_instances)])
+            compl_list.extend([str(i) for i in range(0, max_num_nodes)])
             compl_list.extend(["node%03d" % i
-                               for i in range(1, num_instances)])
+                               for i in range(1, max_num_nodes)])
+            compl_list.extend(sorted(aliases - set(compl_list)))
             return completion.ListCompleter(compl_list)
         except Exception, e:
             print e
@@ -74,41 +115,29 @@ class ImageCompleter(Completer):
     """
     Returns a list of all registered image ids as completion options
     """
+    root_device_type = None
+
     def _completer(self):
         try:
-            rimages = self.ec2.registered_images
-            completion_list = [i.id for i in rimages]
+            completion_list = [i[0] for i in self.cached('images') if
+                               self.root_device_type in (None, i[1])]
             return completion.ListCompleter(completion_list)
         except Exception, e:
             log.error('something went wrong fix me: %s' % e)
 
 
-class EBSImageCompleter(Completer):
+class EBSImageCompleter(ImageCompleter):
     """
     Returns a list of all registered EBS image ids as completion options
     """
-    def _completer(self):
-        try:
-            rimages = self.ec2.registered_images
-            completion_list = [i.id for i in rimages if
-                               i.root_device_type == "ebs"]
-            return completion.ListCompleter(completion_list)
-        except Exception, e:
-            log.error('something went wrong fix me: %s' % e)
+    root_device_type = "ebs"
 
 
-class S3ImageCompleter(Completer):
+class S3ImageCompleter(ImageCompleter):
     """
     Returns a list of all registered S3 image ids as completion options
     """
-    def _completer(self):
-        try:
-            rimages = self.ec2.registered_images
-            completion_list = [i.id for i in rimages if
-                               i.root_device_type == "instance-store"]
-            return completion.ListCompleter(completion_list)
-        except Exception, e:
-            log.error('something went wrong fix me: %s' % e)
+    root_device_type = "instance-store"
 
 
 class InstanceCompleter(Completer):
@@ -119,10 +148,10 @@ class InstanceCompleter(Completer):
 
     def _completer(self):
         try:
-            instances = self.ec2.get_all_instances()
-            completion_list = [i.id for i in instances]
+            instances = self.cached('instances')
+            completion_list = [i[0] for i in instances]
             if self.show_dns_names:
-                completion_list.extend([i.dns_name for i in instances])
+                completion_list.extend([i[1] for i in instances if i[1]])
             return completion.ListCompleter(completion_list)
         except Exception, e:
             log.error('something went wrong fix me: %s' % e)
@@ -134,7 +163,6 @@ class VolumeCompleter(Completer):
     """
     def _completer(self):
         try:
-            completion_list = [v.id for v in self.ec2.get_volumes()]
-            return completion.ListCompleter(completion_list)
+            return completion.ListCompleter(self.cached('volumes'))
         except Exception, e:
             log.error('something went wrong fix me: %s' % e)
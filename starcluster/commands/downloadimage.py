@@ -35,10 +35,17 @@ class CmdDownloadImage(S3ImageCompleter):
     bucket = None
     image_name = None
 
+    def addopts(self, parser):
+        parser.add_option("-w", "--workers", dest="workers", type="int",
+                          default=8, help="Number of files (or ranges of "
+                          "large files) to download concurrently "
+                          "(default: 8)")
+
     def execute(self, args):
         if len(args) != 2:
             self.parser.error(
                 'you must specify an <image_id> and <destination_directory>')
         image_id, destdir = args
-        self.ec2.download_image_files(image_id, destdir)
+        self.ec2.download_image_files(image_id, destdir,
+                                      workers=self.opts.workers)
         log.info("Finished downloading AMI: %s" % image_id)
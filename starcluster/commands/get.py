@@ -15,9 +15,7 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
-import glob
-
-from starcluster import exception
+from starcluster import transfer
 from completers import ClusterCompleter
 
 
@@ -41,6 +39,12 @@ class CmdGet(ClusterCompleter):
         # Copy a file or dir from a node (node001 in this example)
         $ starcluster get mycluster --node node001 /remote/path /local/path
 
+        # Copy a file or dir from every node (stored in /local/dir/<node>)
+        $ starcluster get mycluster --all /remote/path /local/dir
+
+    Files whose size and modification time already match the local copy are
+    skipped and interrupted transfers are resumed the next time the command
+    is run.
     """
     names = ['get']
 
@@ -49,6 +53,22 @@ class CmdGet(ClusterCompleter):
                           help="Transfer files as USER ")
         parser.add_option("-n", "--node", dest="node", default="master",
                           help="Transfer files from NODE (defaults to master)")
+        parser.add_option("-N", "--nodes", dest="nodes", default=None,
+                          help="Transfer files from each node in the comma "
+                          "separated list NODES concurrently")
+        parser.add_option("-a", "--all", dest="all_nodes",
+                          action="store_true", default=False,
+                          help="Transfer files from all nodes in the cluster")
+        parser.add_option("-z", "--compress", dest="compress",
+                          action="store_true", default=False,
+                          help="Compress files during transfer")
+        parser.add_option("-c", "--checksum", dest="checksum",
+                          action="store_true", default=False,
+                          help="Compare checksums rather than modification "
+                          "times to find unchanged files")
+        parser.add_option("-s", "--streams", dest="streams", type="int",
+                          default=4, help="Number of files to transfer "
+                          "concurrently from each node (default: 4)")
 
     def execute(self, args):
         if len(args) < 3:
@@ -58,11 +78,18 @@ class CmdGet(ClusterCompleter):
         lpath = args[-1]
         rpaths = args[1:-1]
         cl = self.cm.get_cluster(ctag, load_receipt=False)
-        node = cl.get_node(self.opts.node)
+        if self.opts.all_nodes:
+            nodes = cl.running_nodes
+        elif self.opts.nodes:
+            nodes = cl.get_nodes(self.opts.nodes.split(','))
+        else:
+            nodes = [cl.get_node(self.opts.node)]
         if self.opts.user:
-            node.ssh.switch_user(self.opts.user)
-        for rpath in rpaths:
-            if not glob.has_magic(rpath) and not node.ssh.path_exists(rpath):
-                raise exception.BaseException(
-                    "Remote file or directory does not exist: %s" % rpath)
-        node.ssh.get(rpaths, lpath)
+            for node in nodes:
+                node.ssh.switch_user(self.opts.user)
+        # missing remote paths are reported by the transfer's single listing
+        # command rather than stat'ing each path beforehand
+        transfer.get_from_nodes(nodes, rpaths, lpath, cl.pool,
+                                compress=self.opts.compress,
+                                checksum=self.opts.checksum,
+                                streams=self.opts.streams)
@@ -15,6 +15,9 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
+import logging
+
+from starcluster import logger
 from completers import ClusterCompleter
 
 
@@ -30,7 +33,18 @@ class CmdListClusters(ClusterCompleter):
         parser.add_option("-s", "--show-ssh-status", dest="show_ssh_status",
                           action="store_true", default=False,
                           help="output whether SSH is up on each node or not")
+        parser.add_option("-j", "--json", dest="output_json",
+                          action="store_true", default=False,
+                          help="output the cluster summaries as JSON")
 
     def execute(self, args):
-        self.cm.list_clusters(cluster_groups=args,
-                              show_ssh_status=self.opts.show_ssh_status)
+        console_level = logger.console.level
+        if self.opts.output_json:
+            # keep stdout machine-readable
+            logger.console.setLevel(logging.ERROR)
+        try:
+            self.cm.list_clusters(cluster_groups=args,
+                                  show_ssh_status=self.opts.show_ssh_status,
+                                  output_json=self.opts.output_json)
+        finally:
+            logger.console.setLevel(console_level)
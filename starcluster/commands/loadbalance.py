@@ -15,8 +15,15 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
+import os
+import logging
+
+from starcluster import logger
 from starcluster import exception
 from starcluster.balancers import sge
+from starcluster.balancers.sge import policy as scaling
+from starcluster.balancers.sge import simulator
+from starcluster.logger import log
 
 from completers import ClusterCompleter
 
@@ -45,6 +52,27 @@ class CmdLoadBalance(ClusterCompleter):
     See "starcluster loadbalance --help" for more details on the '-p' and '-d'
     options as well as other options for tuning the SGE load balancer
     algorithm.
+
+    The number of nodes to add or remove is decided by a scaling policy. The
+    default 'reactive' policy only adds nodes once a job has waited longer
+    than --job_wait_time. The 'predictive' policy uses the job duration
+    history and queue growth rate to forecast the slots needed over the next
+    --horizon minutes:
+
+        $ starcluster loadbalance --policy predictive mycluster
+
+    To compare policies offline against stats recorded with -d use --replay
+    (no cluster is modified):
+
+        $ starcluster loadbalance --replay sge-stats.csv mycluster
+
+    To benchmark the load balancer settings without a cluster use --simulate.
+    This runs the load balancer against a simulated SGE cluster on a virtual
+    clock, using either a synthetic workload or a copy of a real SGE
+    accounting file (--trace), and prints node-hours, job wait times and
+    decision latency:
+
+        $ starcluster loadbalance --simulate --trace accounting -a 5 -s 300
     """
 
     names = ['loadbalance', 'bal']
@@ -103,13 +131,118 @@ class CmdLoadBalance(ClusterCompleter):
         parser.add_option("-K", "--kill-cluster", dest="kill_cluster",
                           action="store_true", default=False,
                           help="Terminate the cluster when the queue is empty")
+        parser.add_option("--policy", dest="policy", action="store",
+                          default=None,
+                          help="Scaling policy: %s or module.ClassName "
+                          "(default: reactive)" %
+                          ', '.join(sorted(scaling.POLICIES)))
+        parser.add_option("--horizon", dest="horizon",
+                          action="callback", type="int", default=None,
+                          callback=self._positive_int,
+                          help="Minutes ahead the predictive policy plans "
+                          "for (default: 10)")
+        parser.add_option("--replay", dest="replay", action="store",
+                          default=None, metavar="STATS_FILE",
+                          help="Replay a stats file recorded with -d against "
+                          "each scaling policy and print a comparison")
+        parser.add_option("--simulate", dest="simulate", action="store_true",
+                          default=False,
+                          help="Run the load balancer against a simulated "
+                          "cluster with a virtual clock")
+        parser.add_option("--trace", dest="trace", action="store",
+                          default=None, metavar="ACCOUNTING_FILE",
+                          help="SGE accounting file to replay with "
+                          "--simulate (default: synthetic workload)")
+        parser.add_option("--iterations", dest="iterations",
+                          action="callback", type="int", default=None,
+                          callback=self._positive_int,
+                          help="Maximum load balancer iterations to simulate "
+                          "(default: 10000)")
 
     def execute(self, args):
         if not self.cfg.globals.enable_experimental:
             raise exception.ExperimentalFeature("The 'loadbalance' command")
+        opts = self.specified_options_dict
+        trace = opts.pop('trace', None)
+        iterations = opts.pop('iterations', None)
+        if opts.pop('simulate', False):
+            return self._simulate(opts, trace, iterations)
         if len(args) != 1:
             self.parser.error("please specify a <cluster_tag>")
         cluster_tag = args[0]
+        replay_file = opts.pop('replay', None)
+        if replay_file:
+            return self._replay(replay_file, opts)
         cluster = self.cm.get_cluster(cluster_tag)
-        lb = sge.SGELoadBalancer(**self.specified_options_dict)
+        lb = sge.SGELoadBalancer(**opts)
         lb.run(cluster)
+
+    def _replay(self, stats_file, opts):
+        if not os.path.isfile(stats_file):
+            raise exception.BaseException("stats file %s does not exist" %
+                                          stats_file)
+        wait_time = opts.get('wait_time') or 900
+        horizon = (opts.get('horizon') or 10) * 60
+        names = sorted(scaling.POLICIES)
+        if opts.get('policy') and opts['policy'] not in names:
+            names.append(opts['policy'])
+        policies = dict([(name, scaling.get_policy(name, wait_time=wait_time,
+                                                   horizon=horizon))
+                         for name in names])
+        results = scaling.replay(stats_file, policies,
+                                 min_nodes=opts.get('min_nodes') or 1,
+                                 max_nodes=opts.get('max_nodes'),
+                                 add_nodes_per_iteration=opts.get('add_pi')
+                                 or 1,
+                                 stabilization_time=opts.get('stab') or 180)
+        raw = dict(__raw__=True)
+        header = "%-20s %10s %12s %14s %6s %8s"
+        log.info(header % ('policy', 'node-hours', 'backlog-hrs',
+                           'max-queue-age', 'adds', 'removes'), extra=raw)
+        for name in names:
+            res = results[name]
+            log.info("%-20s %10.2f %12.2f %13ds %6d %8d" % (
+                name, res['node_hours'], res['backlog_slot_hours'],
+                res['max_queue_age'], res['adds'], res['removes']), extra=raw)
+
+    def _simulate(self, opts, trace=None, iterations=None):
+        for opt in ['plot_stats', 'dump_stats', 'stats_file',
+                    'plot_output_dir', 'replay']:
+            opts.pop(opt, None)
+        if trace:
+            if not os.path.isfile(trace):
+                raise exception.BaseException("trace file %s does not exist" %
+                                              trace)
+            jobs = simulator.load_trace(trace)
+        else:
+            jobs = simulator.synthetic_trace()
+        log.info("Simulating %d jobs..." % len(jobs))
+        console_level = logger.console.level
+        logger.console.setLevel(logging.ERROR)
+        try:
+            res = simulator.simulate(jobs, max_iterations=iterations or 10000,
+                                     **opts)
+        finally:
+            logger.console.setLevel(console_level)
+        raw = dict(__raw__=True)
+        for label, fmt, key in [
+                ("Iterations", "%d", 'iterations'),
+                ("Simulated time", "%.1f hours", 'virtual_hours'),
+                ("Real time", "%.2f secs", 'wall_time'),
+                ("Node hours", "%.2f", 'node_hours'),
+                ("Peak cluster size", "%d nodes", 'max_nodes'),
+                ("Nodes added/removed", None, None),
+                ("Jobs completed", "%d", 'jobs_completed'),
+                ("Jobs not completed", "%d", 'jobs_remaining'),
+                ("Mean job wait", "%d secs", 'mean_wait'),
+                ("95th percentile job wait", "%d secs", 'p95_wait'),
+                ("Max job wait", "%d secs", 'max_wait'),
+                ("Mean decision time", "%.2f ms", 'mean_decision_time'),
+                ("Max decision time", "%.2f ms", 'max_decision_time')]:
+            if key is None:
+                value = "%d/%d" % (res['adds'], res['removes'])
+            elif key.endswith('decision_time'):
+                value = fmt % (res[key] * 1000)
+            else:
+                value = fmt % res[key]
+            log.info("%s: %s" % (label, value), extra=raw)
@@ -17,6 +17,7 @@
 
 import os
 
+from starcluster import transfer
 from starcluster import exception
 from completers import ClusterCompleter
 
@@ -41,8 +42,17 @@ class CmdPut(ClusterCompleter):
         # Copy a file or dir to a node (node001 in this example)
         $ starcluster put mycluster --node node001 /local/path /remote/path
 
+        # Copy a file or dir to several nodes concurrently
+        $ starcluster put mycluster --nodes node001,node002 /local /remote
 
-    This will copy a file or directory to the remote server
+        # Copy a dataset to every node, uploading it only once to the master
+        # and relaying it from node to node within the cluster
+        $ starcluster put mycluster --all --relay /local/data /data
+
+
+    This will copy a file or directory to the remote server. Files whose size
+    and modification time already match the remote copy are skipped and
+    interrupted transfers are resumed the next time the command is run.
     """
     names = ['put']
 
@@ -51,6 +61,26 @@ class CmdPut(ClusterCompleter):
                           help="Transfer files as USER ")
         parser.add_option("-n", "--node", dest="node", default="master",
                           help="Transfer files to NODE (defaults to master)")
+        parser.add_option("-N", "--nodes", dest="nodes", default=None,
+                          help="Transfer files to each node in the comma "
+                          "separated list NODES concurrently")
+        parser.add_option("-a", "--all", dest="all_nodes",
+                          action="store_true", default=False,
+                          help="Transfer files to all nodes in the cluster")
+        parser.add_option("-r", "--relay", dest="relay", action="store_true",
+                          default=False,
+                          help="Upload files to the first node only and "
+                          "relay them to the remaining nodes with rsync")
+        parser.add_option("-z", "--compress", dest="compress",
+                          action="store_true", default=False,
+                          help="Compress files during transfer")
+        parser.add_option("-c", "--checksum", dest="checksum",
+                          action="store_true", default=False,
+                          help="Compare checksums rather than modification "
+                          "times to find unchanged files")
+        parser.add_option("-s", "--streams", dest="streams", type="int",
+                          default=4, help="Number of files to transfer "
+                          "concurrently to each node (default: 4)")
 
     def execute(self, args):
         if len(args) < 3:
@@ -64,10 +94,17 @@ class CmdPut(ClusterCompleter):
                 raise exception.BaseException(
                     "Local file or directory does not exist: %s" % lpath)
         cl = self.cm.get_cluster(ctag, load_receipt=False)
-        node = cl.get_node(self.opts.node)
+        if self.opts.all_nodes:
+            nodes = cl.running_nodes
+        elif self.opts.nodes:
+            nodes = cl.get_nodes(self.opts.nodes.split(','))
+        else:
+            nodes = [cl.get_node(self.opts.node)]
         if self.opts.user:
-            node.ssh.switch_user(self.opts.user)
-        if len(lpaths) > 1 and not node.ssh.isdir(rpath):
-            raise exception.BaseException("Remote path does not exist: %s" %
-                                          rpath)
-        node.ssh.put(lpaths, rpath)
+            for node in nodes:
+                node.ssh.switch_user(self.opts.user)
+        transfer.put_to_nodes(nodes, lpaths, rpath, cl.pool,
+                              relay=self.opts.relay,
+                              compress=self.opts.compress,
+                              checksum=self.opts.checksum,
+                              streams=self.opts.streams)
@@ -25,10 +25,13 @@ from base import CmdBase
 
 class CmdSpotHistory(CmdBase):
     """
-    spothistory [options] <instance_type>
+    spothistory [options] <instance_type> [<instance_type> ...]
 
     Show spot instance pricing history stats (last 30 days by default)
 
+    Price history is cached in ~/.starcluster/spothistory and only the
+    prices recorded since the last run are fetched from EC2.
+
     Examples:
 
     Show the current, max, and average spot price for m1.small instance type:
@@ -38,6 +41,11 @@ class CmdSpotHistory(CmdBase):
     Do the same but also plot the spot history over time in a web browser:
 
         $ starcluster spothistory -p m1.small
+
+    Rank the zones of several instance types by the expected hourly cost and
+    interruption risk of a $0.05 bid:
+
+        $ starcluster spothistory --compare -b 0.05 m1.small m3.medium
     """
     names = ['spothistory', 'shi']
 
@@ -67,20 +75,38 @@ class CmdSpotHistory(CmdBase):
         parser.add_option("-c", "--classic", dest="classic",
                           action="store_true", default=False,
                           help="show spot prices for EC2-Classic")
+        parser.add_option("-b", "--bid", dest="bid",
+                          action="store", type="float", default=None,
+                          help="estimate interruption risk and expected "
+                          "cost for a spot bid of BID")
+        parser.add_option("-C", "--compare", dest="compare",
+                          action="store_true", default=False,
+                          help="rank the zones of one or more instance types "
+                          "by expected cost for the bid given with -b")
+        parser.add_option("-r", "--refresh", dest="refresh",
+                          action="store_true", default=False,
+                          help="fetch new prices from EC2 even if the cached "
+                          "history was updated recently")
 
     def execute(self, args):
         instance_types = ', '.join(sorted(static.INSTANCE_TYPES.keys()))
-        if len(args) != 1:
+        if not args or (len(args) > 1 and not self.opts.compare):
             self.parser.error(
                 'please provide an instance type (options: %s)' %
                 instance_types)
         if self.opts.classic and self.opts.vpc:
             self.parser.error("options -c and -v cannot be specified at "
                               "the same time")
-        instance_type = args[0]
-        if instance_type not in static.INSTANCE_TYPES:
-            self.parser.error('invalid instance type. possible options: %s' %
-                              instance_types)
+        if self.opts.compare and self.opts.bid is None:
+            self.parser.error("option --compare requires a bid (-b)")
+        if self.opts.compare and self.opts.plot:
+            self.parser.error("options --compare and -p cannot be specified "
+                              "at the same time")
+        for instance_type in args:
+            if instance_type not in static.INSTANCE_TYPES:
+                self.parser.error('invalid instance type %s. possible '
+                                  'options: %s' % (instance_type,
+                                                   instance_types))
         start = self.opts.start_time
         end = self.opts.end_time
         if self.opts.days_ago:
@@ -93,9 +119,18 @@ class CmdSpotHistory(CmdBase):
                 end_tup = utils.get_utc_now()
             start = utils.datetime_tuple_to_iso(
                 end_tup - timedelta(days=self.opts.days_ago))
+        if self.opts.compare:
+            self.ec2.compare_spot_prices(args, self.opts.bid, start=start,
+                                         end=end, zone=self.opts.zone,
+                                         vpc=self.opts.vpc,
+                                         classic=self.opts.classic,
+                                         refresh=self.opts.refresh)
+            return
         browser_cmd = self.cfg.globals.get("web_browser")
-        self.ec2.get_spot_history(instance_type, start, end,
+        self.ec2.get_spot_history(args[0], start, end,
                                   zone=self.opts.zone, plot=self.opts.plot,
                                   plot_web_browser=browser_cmd,
                                   vpc=self.opts.vpc,
-                                  classic=self.opts.classic)
+                                  classic=self.opts.classic,
+                                  bid=self.opts.bid,
+                                  refresh=self.opts.refresh)
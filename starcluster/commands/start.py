@@ -180,6 +180,20 @@ class CmdStart(ClusterCompleter):
         parser.add_option("-N", "--subnet-id", dest="subnet_id",
                           action="store", type="string",
                           help=("Launch cluster into a VPC subnet"))
+        parser.add_option("--pipelined", dest="pipelined_start",
+                          action="store_true", default=None,
+                          help="configure each node as soon as it comes up "
+                          "instead of waiting for all nodes first")
+        parser.add_option("--min-nodes", dest="min_nodes", type="int",
+                          action="callback", default=None,
+                          callback=self._positive_int,
+                          help="bring the cluster online as soon as "
+                          "MIN_NODES nodes are up and add the remaining "
+                          "nodes in the background as they come up")
+        parser.add_option("--min-start-fraction", dest="min_start_fraction",
+                          type="float", action="store", default=None,
+                          help="same as --min-nodes but given as a fraction "
+                          "of the cluster size (e.g. 0.8)")
 
     def execute(self, args):
         if len(args) != 1:
@@ -249,9 +263,19 @@ class CmdStart(ClusterCompleter):
                 raise exception.CancelledStartRequest(tag)
         if validate_only:
             return
+        self.cm.update_completion_cache(scluster)
         if not create_only and not self.opts.login_master:
             log.info(user_msgs.cluster_started_msg %
                      dict(tag=scluster.cluster_tag),
                      extra=dict(__textwrap__=True, __raw__=True))
         if self.opts.login_master:
             scluster.ssh_to_master()
+        if scluster.is_backfilling:
+            log.info("Waiting for the remaining nodes to join the cluster "
+                     "(Ctrl-C to stop)...")
+            try:
+                scluster.wait_for_backfill()
+            except KeyboardInterrupt:
+                log.warn("Not all nodes were added to the cluster - use "
+                         "'starcluster addnode -x -a <alias> %s' to add "
+                         "them once they're up" % tag)
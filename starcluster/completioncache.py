@@ -0,0 +1,183 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+On-disk cache of the EC2 data used for shell completion
+
+Completing cluster tags, node aliases, instance/image/volume ids used to hit
+EC2 on every TAB press. Completers now read these lists from a JSON file in
+~/.starcluster, refreshing stale entries in a background process, and
+commands that already fetch the same data (start, listclusters, addnode,
+removenode, terminate) update the file as a side effect.
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+
+from starcluster import static
+from starcluster.logger import log
+
+# seconds after which cached entries are refreshed in the background
+DEFAULT_TTL = 300
+# seconds before another background refresh of the same entry may start
+REFRESH_TIMEOUT = 120
+DEFAULT_REGION = 'us-east-1'
+
+
+def get_cache_key(cfg, region=None):
+    """
+    Returns the key that separates cached data for different AWS accounts
+    and regions
+    """
+    aws = getattr(cfg, 'aws', None) or {}
+    region = region or aws.get('aws_region_name') or DEFAULT_REGION
+    account = hashlib.md5(aws.get('aws_access_key_id') or '').hexdigest()
+    return '%s:%s' % (account[:8], region)
+
+
+class CompletionCache(object):
+    """
+    Stores named completion lists per account/region in a JSON file. Each
+    entry records when it was last updated so that readers can tell whether
+    it is older than ttl seconds.
+    """
+    def __init__(self, key, cache_file=None, ttl=DEFAULT_TTL):
+        self.key = key
+        self.cache_file = cache_file or static.COMPLETION_CACHE_FILE
+        self.ttl = ttl
+
+    def _read_all(self):
+        try:
+            with open(self.cache_file) as f:
+                data = json.load(f)
+            if isinstance(data, dict):
+                return data
+        except (IOError, OSError, ValueError):
+            pass
+        return {}
+
+    def _write_all(self, data):
+        tmp = '%s.%d.tmp' % (self.cache_file, os.getpid())
+        try:
+            with open(tmp, 'w') as f:
+                json.dump(data, f)
+            os.rename(tmp, self.cache_file)
+        except (IOError, OSError), e:
+            log.debug("unable to write completion cache: %s" % e)
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+
+    def _entries(self, data=None):
+        data = self._read_all() if data is None else data
+        return data.setdefault(self.key, {})
+
+    def get(self, name):
+        """
+        Returns a (value, fresh) tuple for the cached entry name where value
+        is None if nothing has been cached yet
+        """
+        entry = self._entries().get(name)
+        if not entry:
+            return None, False
+        fresh = time.time() - entry.get('updated', 0) < self.ttl
+        return entry.get('value'), fresh
+
+    def set(self, name, value, **other_entries):
+        """
+        Replaces the cached value of name (and any other entries passed as
+        keyword arguments) and marks them fresh
+        """
+        data = self._read_all()
+        entries = self._entries(data)
+        other_entries[name] = value
+        now = time.time()
+        for name, value in other_entries.items():
+            entries[name] = dict(updated=now, value=value)
+        self._write_all(data)
+
+    def update_cluster(self, tag, aliases):
+        """
+        Records that cluster tag exists with nodes aliases without marking
+        the complete cluster/node lists fresh
+        """
+        data = self._read_all()
+        entries = self._entries(data)
+        clusters = entries.setdefault('clusters', dict(updated=0, value=[]))
+        if tag not in clusters['value']:
+            clusters['value'] = sorted(clusters['value'] + [tag])
+        nodes = entries.setdefault('nodes', dict(updated=0, value={}))
+        nodes['value'][tag] = sorted(aliases)
+        self._write_all(data)
+
+    def remove_cluster(self, tag):
+        data = self._read_all()
+        entries = self._entries(data)
+        clusters = entries.get('clusters')
+        if clusters and tag in clusters['value']:
+            clusters['value'].remove(tag)
+        nodes = entries.get('nodes')
+        if nodes:
+            nodes['value'].pop(tag, None)
+        self._write_all(data)
+
+    def _start_refresh(self, name):
+        """
+        Returns False if another process started refreshing name recently,
+        otherwise records that a refresh is in progress and returns True
+        """
+        data = self._read_all()
+        entry = self._entries(data).setdefault(name, dict(updated=0))
+        if time.time() - entry.get('refreshing', 0) < REFRESH_TIMEOUT:
+            return False
+        entry['refreshing'] = time.time()
+        self._write_all(data)
+        return True
+
+    def fetch(self, name, fetch_fn, background=True):
+        """
+        Returns the cached value of name. If nothing is cached yet the value
+        is fetched by calling fetch_fn() and cached. If the cached value is
+        stale it is returned as-is and refreshed in a background process
+        (unless background is False in which case it is refreshed first).
+        """
+        value, fresh = self.get(name)
+        if value is None or (not fresh and not background):
+            value = fetch_fn()
+            self.set(name, value)
+        elif not fresh and self._start_refresh(name):
+            self._refresh_in_background(name, fetch_fn)
+        return value
+
+    def _refresh_in_background(self, name, fetch_fn):
+        if not hasattr(os, 'fork'):
+            return
+        sys.stdout.flush()
+        sys.stderr.flush()
+        if os.fork() != 0:
+            return
+        # detach from the shell's completion pipes so that the shell doesn't
+        # wait for the refresh to finish
+        try:
+            os.setsid()
+            devnull = os.open(os.devnull, os.O_RDWR)
+            for fd in range(3):
+                os.dup2(devnull, fd)
+            self.set(name, fetch_fn())
+        finally:
+            os._exit(0)
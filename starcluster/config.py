@@ -22,15 +22,14 @@ import ConfigParser
 
 from starcluster import utils
 from starcluster import static
-from starcluster import cluster
-from starcluster import awsutils
-from starcluster import deathrow
 from starcluster import exception
-from starcluster.cluster import Cluster
 from starcluster.utils import AttributeDict
 
 from starcluster.logger import log
 
+# NOTE: cluster, awsutils and deathrow pull in boto, paramiko, jinja2, etc. so
+# they are imported by the methods that need them to keep CLI startup fast
+
 DEBUG_CONFIG = False
 
 
@@ -610,6 +609,8 @@ class StarClusterConfig(object):
 
         tag_name if not specified will be set to template_name
         """
+        from starcluster import deathrow
+        from starcluster.cluster import Cluster
         try:
             kwargs = {}
             tag_name = tag_name or template_name
@@ -664,6 +665,7 @@ class StarClusterConfig(object):
         the StarCluster config file. Returns an EasyS3 object if
         successful.
         """
+        from starcluster import awsutils
         try:
             s3 = awsutils.EasyS3(**self.aws)
             return s3
@@ -676,6 +678,7 @@ class StarClusterConfig(object):
         the StarCluster config file. Returns an EasyEC2 object if
         successful.
         """
+        from starcluster import awsutils
         try:
             ec2 = awsutils.EasyEC2(**self.aws)
             return ec2
@@ -683,6 +686,7 @@ class StarClusterConfig(object):
             raise exception.ConfigError("no aws credentials found")
 
     def get_cluster_manager(self):
+        from starcluster import cluster
         ec2 = self.get_easy_ec2()
         return cluster.ClusterManager(self, ec2)
 
@@ -30,8 +30,52 @@ from starcluster import awsutils
 from starcluster import managers
 from starcluster import userdata
 from starcluster import exception
+from starcluster import ratelimit
 from starcluster.logger import log
 
+IDENTITY_SEPARATOR = '#starcluster-etc-group#'
+
+
+def get_spot_batch_tags(spot_ids):
+    """
+    Returns the tags that record the order of a batch of spot requests made
+    by a single RequestSpotInstances call.
+
+    Spot instances requested together share one user data payload listing
+    all of the batch's aliases and always have an ami_launch_index of 0.
+    Instead the i-th alias belongs to the i-th spot request of the batch
+    ordered by request id. The ordered ids are saved when the batch is
+    created (split across as many SPOT_BATCH_TAG-<n> tags as needed) so that
+    the mapping survives requests of the batch being cancelled or expiring.
+    """
+    ids = ','.join(sorted(spot_ids))
+    size = static.MAX_TAG_LEN
+    return dict([('%s-%d' % (static.SPOT_BATCH_TAG, i / size), ids[i:i + size])
+                 for i in range(0, len(ids), size)])
+
+
+def get_spot_batch_ids(tags):
+    """
+    Returns the ordered spot request ids saved in a spot request's tags by
+    get_spot_batch_tags or an empty list if the request wasn't batched
+    """
+    chunks = []
+    while '%s-%d' % (static.SPOT_BATCH_TAG, len(chunks)) in tags:
+        chunks.append(tags['%s-%d' % (static.SPOT_BATCH_TAG, len(chunks))])
+    return ''.join(chunks).split(',') if chunks else []
+
+
+def names_regex(names):
+    """
+    Returns an extended regex that matches lines containing any of names as a
+    whole word (i.e. delimited by whitespace, commas or the line boundaries)
+    or None if names is empty
+    """
+    names = [n.replace('.', '\\.') for n in names if n]
+    if not names:
+        return None
+    return '(^|[[:space:],])(%s)([[:space:],]|$)' % '|'.join(names)
+
 
 class NodeManager(managers.Manager):
     """
@@ -93,6 +137,8 @@ class Node(object):
         self._num_procs = None
         self._memory = None
         self._user_data = None
+        self._etc_passwd = None
+        self._etc_group = None
 
     def __repr__(self):
         return '<Node: %s (%s)>' % (self.alias, self.id)
@@ -100,6 +146,7 @@ class Node(object):
     def _get_user_data(self, tries=5):
         tries = range(tries)
         last_try = tries[-1]
+        backoff = ratelimit.Backoff(base=1, max_delay=5, full_jitter=False)
         for i in tries:
             try:
                 user_data = self.ec2.get_instance_user_data(self.id)
@@ -110,7 +157,7 @@ class Node(object):
                     raise
                 log.debug("InvalidInstanceID.NotFound: "
                           "retrying fetching user data (tries: %s)" % (i + 1))
-                time.sleep(5)
+                time.sleep(backoff.delay(i))
 
     @property
     def user_data(self):
@@ -140,17 +187,24 @@ class Node(object):
                 aliasestxt = self.user_data.get(static.UD_ALIASES_FNAME, '')
                 aliases = aliasestxt.splitlines()[2:]
                 index = self.ami_launch_index
+                if self.is_spot() and len(aliases) > 1:
+                    ids = get_spot_batch_ids(self.ec2.get_tags(self.spot_id))
+                    index = ids.index(self.spot_id) if self.spot_id in ids \
+                        else len(aliases)
                 try:
                     alias = aliases[index]
                 except IndexError:
                     alias = None
+                if not alias:
                     log.debug("invalid aliases file in user_data:\n%s" %
                               aliasestxt)
-                if not alias:
                     raise exception.BaseException(
                         "instance %s has no alias" % self.id)
-                self.add_tag('alias', alias)
-            if not self.tags.get('Name'):
+                tags = {'alias': alias}
+                if not self.tags.get('Name'):
+                    tags['Name'] = alias
+                self.ec2.add_tags(self.instance, tags)
+            elif not self.tags.get('Name'):
                 self.add_tag('Name', alias)
             self._alias = alias
         return self._alias
@@ -188,19 +242,17 @@ class Node(object):
         return utils.decode_uncompress_load(payload)
 
     def _remove_all_tags(self):
-        tags = self.tags.keys()[:]
-        for t in tags:
-            self.remove_tag(t)
+        self.ec2.remove_tags(self.instance, self.tags.keys())
 
     @property
     def tags(self):
-        return self.instance.tags
+        return self.ec2.get_tags(self.instance)
 
     def add_tag(self, key, value=None):
-        return self.instance.add_tag(key, value)
+        return self.ec2.add_tags(self.instance, {key: value})
 
     def remove_tag(self, key, value=None):
-        return self.instance.remove_tag(key, value)
+        return self.ec2.remove_tags(self.instance, {key: value})
 
     @property
     def groups(self):
@@ -372,13 +424,57 @@ class Node(object):
         """
         Add user (if exists) to group (if exists)
         """
-        if user not in self.get_user_map():
+        if not self.getpwnam(user):
             raise exception.BaseException("user %s does not exist" % user)
-        if group in self.get_group_map():
+        if self.getgrnam(group):
             self.ssh.execute('gpasswd -a %s %s' % (user, 'utmp'))
+            self.invalidate_identity_cache()
         else:
             raise exception.BaseException("group %s does not exist" % group)
 
+    def invalidate_identity_cache(self):
+        """
+        Forget the cached contents of the remote /etc/passwd and /etc/group.
+        Must be called after adding/removing users or groups on the node
+        without using add_user/remove_user/add_user_to_group.
+        """
+        self._etc_passwd = None
+        self._etc_group = None
+
+    def load_identity_maps(self):
+        """
+        Fetches and caches the remote /etc/passwd and /etc/group files in a
+        single SSH round trip. get_user_map, get_group_map, getpwnam, etc.
+        are then served from the cache until invalidate_identity_cache() is
+        called. A getpwnam/getpwuid/getgrnam/getgrgid lookup that misses
+        reloads the cache once in case the files were changed behind its
+        back (e.g. by newusers).
+        """
+        output = self.ssh.execute(
+            'cat /etc/passwd; echo %s; cat /etc/group' % IDENTITY_SEPARATOR,
+            source_profile=False, log_output=False)
+        sep = output.index(IDENTITY_SEPARATOR)
+        self._etc_passwd = [utils.struct_passwd(self._parse_passwd_line(l))
+                            for l in output[:sep] if l]
+        self._etc_group = [utils.struct_group(self._parse_group_line(l))
+                           for l in output[sep + 1:] if l]
+
+    def _parse_passwd_line(self, line):
+        name, passwd, uid, gid, gecos, home, shell = line.split(':')
+        return [name, passwd, int(uid), int(gid), gecos, home, shell]
+
+    def _parse_group_line(self, line):
+        name, passwd, gid, mems = line.split(':')
+        return [name, passwd, int(gid), mems.split(',')]
+
+    def _lookup(self, get_map, key, **kwargs):
+        loaded = self._etc_passwd is not None
+        value = get_map(**kwargs).get(key)
+        if value is None and loaded:
+            self.invalidate_identity_cache()
+            value = get_map(**kwargs).get(key)
+        return value
+
     def get_group_map(self, key_by_gid=False):
         """
         Returns dictionary where keys are remote group names and values are
@@ -387,19 +483,11 @@ class Node(object):
         key_by_gid=True will use the integer gid as the returned dictionary's
         keys instead of the group's name
         """
-        grp_file = self.ssh.remote_file('/etc/group', 'r')
-        groups = [l.strip().split(':') for l in grp_file.readlines()]
-        grp_file.close()
-        grp_map = {}
-        for group in groups:
-            name, passwd, gid, mems = group
-            gid = int(gid)
-            mems = mems.split(',')
-            key = name
-            if key_by_gid:
-                key = gid
-            grp_map[key] = utils.struct_group([name, passwd, gid, mems])
-        return grp_map
+        if self._etc_group is None:
+            self.load_identity_maps()
+        if key_by_gid:
+            return dict([(g.gr_gid, g) for g in self._etc_group])
+        return dict([(g.gr_name, g) for g in self._etc_group])
 
     def get_user_map(self, key_by_uid=False):
         """
@@ -409,20 +497,11 @@ class Node(object):
         key_by_uid=True will use the integer uid as the returned dictionary's
         keys instead of the user's login name
         """
-        etc_passwd = self.ssh.remote_file('/etc/passwd', 'r')
-        users = [l.strip().split(':') for l in etc_passwd.readlines()]
-        etc_passwd.close()
-        user_map = {}
-        for user in users:
-            name, passwd, uid, gid, gecos, home, shell = user
-            uid = int(uid)
-            gid = int(gid)
-            key = name
-            if key_by_uid:
-                key = uid
-            user_map[key] = utils.struct_passwd([name, passwd, uid, gid, gecos,
-                                                 home, shell])
-        return user_map
+        if self._etc_passwd is None:
+            self.load_identity_maps()
+        if key_by_uid:
+            return dict([(u.pw_uid, u) for u in self._etc_passwd])
+        return dict([(u.pw_name, u) for u in self._etc_passwd])
 
     def getgrgid(self, gid):
         """
@@ -430,8 +509,7 @@ class Node(object):
 
         returns a grp.struct_group
         """
-        gmap = self.get_group_map(key_by_gid=True)
-        return gmap.get(gid)
+        return self._lookup(self.get_group_map, gid, key_by_gid=True)
 
     def getgrnam(self, groupname):
         """
@@ -439,8 +517,7 @@ class Node(object):
 
         returns a grp.struct_group
         """
-        gmap = self.get_group_map()
-        return gmap.get(groupname)
+        return self._lookup(self.get_group_map, groupname)
 
     def getpwuid(self, uid):
         """
@@ -448,8 +525,7 @@ class Node(object):
 
         returns a pwd.struct_passwd
         """
-        umap = self.get_user_map(key_by_uid=True)
-        return umap.get(uid)
+        return self._lookup(self.get_user_map, uid, key_by_uid=True)
 
     def getpwnam(self, username):
         """
@@ -457,8 +533,7 @@ class Node(object):
 
         returns a pwd.struct_passwd
         """
-        umap = self.get_user_map()
-        return umap.get(username)
+        return self._lookup(self.get_user_map, username)
 
     def add_user(self, name, uid=None, gid=None, shell="bash"):
         """
@@ -479,7 +554,10 @@ class Node(object):
         if shell:
             user_add_cmd += '-s `which %s` ' % shell
         user_add_cmd += "-m %s" % name
-        self.ssh.execute(user_add_cmd)
+        try:
+            self.ssh.execute(user_add_cmd)
+        finally:
+            self.invalidate_identity_cache()
 
     def generate_key_for_user(self, username, ignore_existing=False,
                               auth_new_key=False, auth_conn_key=False):
@@ -551,34 +629,59 @@ class Node(object):
         auth_keys.close()
         return key
 
-    def add_to_known_hosts(self, username, nodes, add_self=True):
+    @property
+    def network_names_list(self):
+        """
+        Returns every name this node is known by in /etc/hosts and
+        known_hosts files
+        """
+        return [self.alias, self.private_dns_name, self.private_dns_name_short,
+                self.public_dns_name]
+
+    def get_known_hosts_entries(self):
+        """
+        Returns the known_hosts lines for all of this node's network names
+        """
+        server_pkey = self.ssh.get_server_public_key()
+        key = ' '.join([server_pkey.get_name(),
+                        base64.b64encode(str(server_pkey))])
+        node_names = {}.fromkeys([self.alias, self.private_dns_name,
+                                  self.private_dns_name_short],
+                                 self.private_ip_address)
+        node_names[self.public_dns_name] = self.ip_address
+        return ["%s,%s %s" % (name, ip, key)
+                for name, ip in node_names.items()]
+
+    def add_to_known_hosts(self, username, nodes, add_self=True,
+                           host_keys=None):
         """
         Populate user's known_hosts file with pub keys from hosts in nodes list
 
         username - name of the user to add to known hosts for
         nodes - the nodes to add to the user's known hosts file
         add_self - add this Node to known_hosts in addition to nodes
+        host_keys - optional dict mapping node alias to the node's
+                    known_hosts lines (see get_known_hosts_entries) to avoid
+                    fetching each node's host key again
         """
         user = self.getpwnam(username)
         known_hosts_file = posixpath.join(user.pw_dir, '.ssh', 'known_hosts')
-        khosts = []
         if add_self and self not in nodes:
-            nodes.append(self)
-        self.remove_from_known_hosts(username, nodes)
+            nodes = nodes + [self]
+        host_keys = host_keys or {}
+        khosts = []
+        names = []
         for node in nodes:
-            server_pkey = node.ssh.get_server_public_key()
-            node_names = {}.fromkeys([node.alias, node.private_dns_name,
-                                      node.private_dns_name_short],
-                                     node.private_ip_address)
-            node_names[node.public_dns_name] = node.ip_address
-            for name, ip in node_names.items():
-                name_ip = "%s,%s" % (name, ip)
-                khosts.append(' '.join([name_ip, server_pkey.get_name(),
-                                        base64.b64encode(str(server_pkey))]))
-        khostsf = self.ssh.remote_file(known_hosts_file, 'a')
-        khostsf.write('\n'.join(khosts) + '\n')
-        khostsf.chown(user.pw_uid, user.pw_gid)
-        khostsf.close()
+            entries = host_keys.get(node.alias)
+            if entries is None:
+                entries = node.get_known_hosts_entries()
+            khosts.extend(entries)
+            names.extend(node.network_names_list)
+        batch = self.ssh.batch()
+        batch.replace_lines(known_hosts_file, khosts,
+                            purge_regex=names_regex(names),
+                            uid=user.pw_uid, gid=user.pw_gid)
+        batch.run()
 
     def remove_from_known_hosts(self, username, nodes):
         """
@@ -589,15 +692,19 @@ class Node(object):
         known_hosts_file = posixpath.join(user.pw_dir, '.ssh', 'known_hosts')
         hostnames = []
         for node in nodes:
-            hostnames += [node.alias, node.private_dns_name,
-                          node.private_dns_name_short, node.public_dns_name]
-        if self.ssh.isfile(known_hosts_file):
-            regex = '|'.join(hostnames)
-            self.ssh.remove_lines_from_file(known_hosts_file, regex)
+            hostnames += node.network_names_list
+        if hostnames and self.ssh.isfile(known_hosts_file):
+            batch = self.ssh.batch()
+            batch.replace_lines(known_hosts_file, [],
+                                purge_regex=names_regex(hostnames))
+            batch.run()
 
-    def enable_passwordless_ssh(self, username, nodes):
+    def enable_passwordless_ssh(self, username, nodes, host_keys=None):
         """
         Configure passwordless ssh for user between this Node and nodes
+
+        host_keys - optional dict of pre-fetched known_hosts lines keyed by
+                    node alias (see add_to_known_hosts)
         """
         user = self.getpwnam(username)
         ssh_folder = posixpath.join(user.pw_dir, '.ssh')
@@ -605,7 +712,7 @@ class Node(object):
         pub_key_file = priv_key_file + '.pub'
         known_hosts_file = posixpath.join(ssh_folder, 'known_hosts')
         auth_key_file = posixpath.join(ssh_folder, 'authorized_keys')
-        self.add_to_known_hosts(username, nodes)
+        self.add_to_known_hosts(username, nodes, host_keys=host_keys)
         # exclude this node from copying
         nodes = filter(lambda n: n.id != self.id, nodes)
         # copy private key and public key to node
@@ -649,8 +756,11 @@ class Node(object):
         """
         Remove a user from the remote system
         """
-        self.ssh.execute('userdel %s' % name)
-        self.ssh.execute('groupdel %s' % name)
+        try:
+            self.ssh.execute('userdel %s' % name)
+            self.ssh.execute('groupdel %s' % name)
+        finally:
+            self.invalidate_identity_cache()
 
     def export_fs_to_nodes(self, nodes, export_paths):
         """
@@ -702,9 +812,10 @@ class Node(object):
 
     def start_nfs_server(self):
         log.info("Starting NFS server on %s" % self.alias)
-        self.ssh.execute('/etc/init.d/portmap start', ignore_exit_status=True)
-        self.ssh.execute('mount -t rpc_pipefs sunrpc /var/lib/nfs/rpc_pipefs/',
-                         ignore_exit_status=True)
+        batch = self.ssh.batch()
+        batch.execute('/etc/init.d/portmap start', ignore_exit_status=True)
+        batch.execute('mount -t rpc_pipefs sunrpc /var/lib/nfs/rpc_pipefs/',
+                      ignore_exit_status=True)
         EXPORTSD = '/etc/exports.d'
         DUMMY_EXPORT_DIR = '/dummy_export_for_broken_init_script'
         DUMMY_EXPORT_LINE = ' '.join([DUMMY_EXPORT_DIR,
@@ -712,14 +823,14 @@ class Node(object):
         DUMMY_EXPORT_FILE = posixpath.join(EXPORTSD, 'dummy.exports')
         # Hack to get around broken debian nfs-kernel-server script
         # http://bugs.debian.org/cgi-bin/bugreport.cgi?bug=679274
-        self.ssh.execute("mkdir -p %s" % EXPORTSD)
-        self.ssh.execute("mkdir -p %s" % DUMMY_EXPORT_DIR)
-        with self.ssh.remote_file(DUMMY_EXPORT_FILE, 'w') as dummyf:
-            dummyf.write(DUMMY_EXPORT_LINE)
-        self.ssh.execute('/etc/init.d/nfs start')
-        self.ssh.execute('rm -f %s' % DUMMY_EXPORT_FILE)
-        self.ssh.execute('rm -rf %s' % DUMMY_EXPORT_DIR)
-        self.ssh.execute('exportfs -fra')
+        batch.mkdir(EXPORTSD)
+        batch.mkdir(DUMMY_EXPORT_DIR)
+        batch.write_file(DUMMY_EXPORT_FILE, DUMMY_EXPORT_LINE)
+        batch.execute('/etc/init.d/nfs start')
+        batch.execute('rm -f %s' % DUMMY_EXPORT_FILE)
+        batch.execute('rm -rf %s' % DUMMY_EXPORT_DIR)
+        batch.execute('exportfs -fra')
+        batch.run()
 
     def mount_nfs_shares(self, server_node, remote_paths):
         """
@@ -728,10 +839,12 @@ class Node(object):
         server_node - remote server node that is sharing the remote_paths
         remote_paths - list of remote paths to mount from server_node
         """
-        self.ssh.execute('/etc/init.d/portmap start')
+        batch = self.ssh.batch()
+        batch.execute('/etc/init.d/portmap start')
         # TODO: move this fix for xterm somewhere else
-        self.ssh.execute('mount -t devpts none /dev/pts',
-                         ignore_exit_status=True)
+        batch.execute('mount -t devpts none /dev/pts',
+                      ignore_exit_status=True)
+        batch.run()
         mount_map = self.get_mount_map()
         mount_paths = []
         for path in remote_paths:
@@ -747,16 +860,16 @@ class Node(object):
         remote_paths_regex = '|'.join(map(lambda x: x.center(len(x) + 2),
                                           remote_paths))
         self.ssh.remove_lines_from_file('/etc/fstab', remote_paths_regex)
-        fstab = self.ssh.remote_file('/etc/fstab', 'a')
         mount_opts = 'rw,exec,noauto'
+        fstab = ''.join(['%s:%s %s nfs %s 0 0\n' %
+                         (server_node.alias, path, path, mount_opts)
+                         for path in remote_paths])
+        batch = self.ssh.batch()
+        batch.write_file('/etc/fstab', fstab, append=True)
         for path in remote_paths:
-            fstab.write('%s:%s %s nfs %s 0 0\n' %
-                        (server_node.alias, path, path, mount_opts))
-        fstab.close()
-        for path in remote_paths:
-            if not self.ssh.path_exists(path):
-                self.ssh.makedirs(path)
-            self.ssh.execute('mount %s' % path)
+            batch.mkdir(path)
+            batch.execute('mount %s' % path)
+        batch.run()
 
     def get_mount_map(self):
         mount_map = {}
@@ -818,20 +931,31 @@ class Node(object):
     def add_to_etc_hosts(self, nodes):
         """
         Adds all names for node in nodes arg to this node's /etc/hosts file
+
+        Existing entries for nodes are replaced and the file is rewritten
+        atomically in a single remote command. Returns False if /etc/hosts
+        was already up to date.
         """
-        self.remove_from_etc_hosts(nodes)
-        host_file = self.ssh.remote_file('/etc/hosts', 'a')
-        for node in nodes:
-            print >> host_file, node.get_hosts_entry()
-        host_file.close()
+        if not nodes:
+            return False
+        aliases = map(lambda x: x.alias, nodes)
+        entries = map(lambda x: x.get_hosts_entry(), nodes)
+        batch = self.ssh.batch()
+        batch.replace_lines('/etc/hosts', entries,
+                            purge_regex=names_regex(aliases))
+        return batch.run()[0].output == ['updated']
 
     def remove_from_etc_hosts(self, nodes):
         """
         Remove all network names for node in nodes arg from this node's
         /etc/hosts file
         """
+        if not nodes:
+            return
         aliases = map(lambda x: x.alias, nodes)
-        self.ssh.remove_lines_from_file('/etc/hosts', '|'.join(aliases))
+        batch = self.ssh.batch()
+        batch.replace_lines('/etc/hosts', [], purge_regex=names_regex(aliases))
+        batch.run()
 
     def set_hostname(self, hostname=None):
         """
@@ -901,8 +1025,9 @@ class Node(object):
         vol_id = root_vol.volume_id
         vol = self.ec2.get_volume(vol_id)
         vol.detach()
+        poll = ratelimit.PollInterval(5)
         while vol.update() != 'available':
-            time.sleep(5)
+            poll.sleep()
         log.info("Deleting node %s's root volume" % self.alias)
         root_vol.delete()
 
@@ -1016,8 +1141,9 @@ class Node(object):
             return False
 
     def wait(self, interval=30):
+        poll = ratelimit.PollInterval(interval)
         while not self.is_up():
-            time.sleep(interval)
+            poll.sleep()
 
     def is_up(self):
         if self.update() != 'running':
@@ -1065,9 +1191,9 @@ class Node(object):
     @property
     def ssh(self):
         if not self._ssh:
-            self._ssh = sshutils.SSHClient(self.addr,
-                                           username=self.user,
-                                           private_key=self.key_location)
+            pool = sshutils.get_connection_pool()
+            self._ssh = pool.get(self.addr, username=self.user,
+                                 private_key=self.key_location)
         return self._ssh
 
     def shell(self, user=None, forward_x11=False, forward_agent=False,
@@ -1191,7 +1317,3 @@ class Node(object):
             self.apt_install(pkgs)
         elif self.package_provider == "yum":
             self.yum_install(pkgs)
-
-    def __del__(self):
-        if self._ssh:
-            self._ssh.close()
@@ -36,24 +36,24 @@ class SGEPlugin(clustersetup.DefaultClusterSetup):
             self.slots_per_host = int(slots_per_host)
         super(SGEPlugin, self).__init__(**kwargs)
 
-    def _add_sge_submit_host(self, node):
-        mssh = self._master.ssh
+    def _add_sge_submit_host(self, node, batch=None):
+        mssh = batch or self._master.ssh
         mssh.execute('qconf -as %s' % node.alias)
 
-    def _add_sge_admin_host(self, node):
-        mssh = self._master.ssh
+    def _add_sge_admin_host(self, node, batch=None):
+        mssh = batch or self._master.ssh
         mssh.execute('qconf -ah %s' % node.alias)
 
-    def _setup_sge_profile(self, node):
-        sge_profile = node.ssh.remote_file(self.SGE_PROFILE, "w")
+    def _setup_sge_profile(self, node, batch):
         arch = node.ssh.execute(self._sge_path("util/arch"))[0]
-        sge_profile.write(sge.sgeprofile_template % dict(arch=arch))
-        sge_profile.close()
+        batch.write_file(self.SGE_PROFILE,
+                         sge.sgeprofile_template % dict(arch=arch))
 
     def _add_to_sge(self, node):
-        node.ssh.execute('pkill -9 sge', ignore_exit_status=True)
-        node.ssh.execute('rm /etc/init.d/sge*', ignore_exit_status=True)
-        self._inst_sge(node, exec_host=True)
+        batch = node.ssh.batch()
+        batch.execute('pkill -9 sge', ignore_exit_status=True)
+        batch.execute('rm /etc/init.d/sge*', ignore_exit_status=True)
+        self._inst_sge(node, exec_host=True, batch=batch)
 
     def _create_sge_pe(self, name="orte", nodes=None, queue="all.q"):
         """
@@ -75,35 +75,43 @@ class SGEPlugin(clustersetup.DefaultClusterSetup):
                                          jobid_fn=lambda n: n.alias))
         else:
             pe_slots = self.slots_per_host * len(nodes)
+        batch = mssh.batch()
         if not pe_exists:
-            penv = mssh.remote_file("/tmp/pe.txt", "w")
-            penv.write(sge.sge_pe_template % (name, pe_slots))
-            penv.close()
-            mssh.execute("qconf -Ap %s" % penv.name)
+            penv = "/tmp/pe.txt"
+            batch.write_file(penv, sge.sge_pe_template % (name, pe_slots))
+            batch.execute("qconf -Ap %s" % penv)
         else:
-            mssh.execute("qconf -mattr pe slots %s %s" % (pe_slots, name))
+            batch.execute("qconf -mattr pe slots %s %s" % (pe_slots, name))
         if queue:
             log.info("Adding parallel environment '%s' to queue '%s'" %
                      (name, queue))
-            mssh.execute('qconf -mattr queue pe_list "%s" %s' % (name, queue))
+            batch.execute('qconf -mattr queue pe_list "%s" %s' %
+                          (name, queue))
+        batch.run()
 
-    def _inst_sge(self, node, exec_host=True):
-        self._setup_sge_profile(node)
+    def _inst_sge(self, node, exec_host=True, batch=None):
+        """
+        Install SGE on node in a single remote batch. Steps already added to
+        batch (if specified) are run before the install.
+        """
+        batch = batch or node.ssh.batch()
+        self._setup_sge_profile(node, batch)
         inst_sge = 'cd %s && TERM=rxvt ./%s ' % (self.SGE_ROOT, self.SGE_INST)
         if node.is_master():
             inst_sge += '-m '
         if exec_host:
             inst_sge += '-x '
         inst_sge += '-noremote -auto ./%s' % self.SGE_CONF
-        node.ssh.execute(inst_sge, silent=True, only_printable=True)
+        batch.execute(inst_sge)
         if exec_host:
             num_slots = self.slots_per_host
             if num_slots is None:
                 num_slots = node.num_processors
-            node.ssh.execute("qconf -aattr hostgroup hostlist %s @allhosts" %
-                             node.alias)
-            node.ssh.execute('qconf -aattr queue slots "[%s=%d]" all.q' %
-                             (node.alias, num_slots))
+            batch.execute("qconf -aattr hostgroup hostlist %s @allhosts" %
+                          node.alias)
+            batch.execute('qconf -aattr queue slots "[%s=%d]" all.q' %
+                          (node.alias, num_slots))
+        batch.run()
 
     def _sge_path(self, path):
         return posixpath.join(self.SGE_ROOT, path)
@@ -115,9 +123,11 @@ class SGEPlugin(clustersetup.DefaultClusterSetup):
         number of slots *before* the node is available to accept jobs.
         """
         master = self._master
-        master.ssh.execute("cd %s && sed 's/AddQueue/#AddQueue/g' inst_sge > "
-                           "%s" % (self.SGE_ROOT, self.SGE_INST))
-        master.ssh.chmod(0755, self._sge_path(self.SGE_INST))
+        batch = master.ssh.batch()
+        batch.execute("cd %s && sed 's/AddQueue/#AddQueue/g' inst_sge > %s" %
+                      (self.SGE_ROOT, self.SGE_INST))
+        batch.chmod(0755, self._sge_path(self.SGE_INST))
+        batch.run()
 
     def _setup_sge(self):
         """
@@ -127,9 +137,10 @@ class SGEPlugin(clustersetup.DefaultClusterSetup):
         master = self._master
         if not master.ssh.isdir(self.SGE_ROOT):
             # copy fresh sge installation files to SGE_ROOT
-            master.ssh.execute('cp -r %s %s' % (self.SGE_FRESH, self.SGE_ROOT))
-            master.ssh.execute('chown -R %(user)s:%(user)s %(sge_root)s' %
-                               {'user': self._user, 'sge_root': self.SGE_ROOT})
+            batch = master.ssh.batch()
+            batch.execute('cp -r %s %s' % (self.SGE_FRESH, self.SGE_ROOT))
+            batch.chown(self._user, self._user, self.SGE_ROOT, recursive=True)
+            batch.run()
         self._disable_add_queue()
         self._setup_nfs(self.nodes, export_paths=[self.SGE_ROOT],
                         start_server=False)
@@ -137,8 +148,10 @@ class SGEPlugin(clustersetup.DefaultClusterSetup):
         default_cell = self._sge_path('default')
         if master.ssh.isdir(default_cell):
             log.info("Removing previous SGE installation...")
-            master.ssh.execute('rm -rf %s' % default_cell)
-            master.ssh.execute('exportfs -fr')
+            batch = master.ssh.batch()
+            batch.execute('rm -rf %s' % default_cell)
+            batch.execute('exportfs -fr')
+            batch.run()
         admin_hosts = ' '.join(map(lambda n: n.alias, self._nodes))
         submit_hosts = admin_hosts
         exec_hosts = admin_hosts
@@ -157,15 +170,23 @@ class SGEPlugin(clustersetup.DefaultClusterSetup):
         self.pool.wait(numtasks=len(self.nodes))
         self._create_sge_pe()
 
-    def _remove_from_sge(self, node):
-        master = self._master
-        master.ssh.execute('qconf -dattr hostgroup hostlist %s @allhosts' %
-                           node.alias)
-        master.ssh.execute('qconf -purge queue slots all.q@%s' % node.alias)
-        master.ssh.execute('qconf -dconf %s' % node.alias)
-        master.ssh.execute('qconf -de %s' % node.alias)
-        node.ssh.execute('pkill -9 sge_execd')
-        nodes = filter(lambda n: n.alias != node.alias, self._nodes)
+    def _remove_from_sge(self, old_nodes):
+        batch = self._master.ssh.batch()
+        for node in old_nodes:
+            batch.execute('qconf -dattr hostgroup hostlist %s @allhosts' %
+                          node.alias)
+            batch.execute('qconf -purge queue slots all.q@%s' % node.alias)
+            batch.execute('qconf -dconf %s' % node.alias)
+            batch.execute('qconf -de %s' % node.alias)
+        batch.run()
+        for node in old_nodes:
+            self.pool.simple_job(node.ssh.execute, ('pkill -9 sge_execd',),
+                                 jobid=node.alias)
+        self.pool.wait(numtasks=len(old_nodes))
+        old_aliases = [n.alias for n in old_nodes]
+        nodes = filter(lambda n: n.alias not in old_aliases, self._nodes)
+        if not self.master_is_exec_host:
+            nodes = filter(lambda n: not n.is_master(), nodes)
         self._create_sge_pe(nodes=nodes)
 
     def run(self, nodes, master, user, user_shell, volumes):
@@ -180,19 +201,49 @@ class SGEPlugin(clustersetup.DefaultClusterSetup):
         self._volumes = volumes
         self._setup_sge()
 
+    def _add_nodes_to_sge(self, new_nodes):
+        """
+        Add new_nodes to SGE registering the admin/submit hosts and updating
+        the parallel environment once for the whole batch
+        """
+        log.info("Adding %s to SGE" % ', '.join([n.alias for n in new_nodes]))
+        self._setup_nfs(nodes=new_nodes, export_paths=[self.SGE_ROOT],
+                        start_server=False)
+        batch = self._master.ssh.batch()
+        for node in new_nodes:
+            self._add_sge_admin_host(node, batch=batch)
+            self._add_sge_submit_host(node, batch=batch)
+        batch.run()
+        for node in new_nodes:
+            self.pool.simple_job(self._add_to_sge, (node,), jobid=node.alias)
+        self.pool.wait(numtasks=len(new_nodes))
+        self._create_sge_pe()
+
     def on_add_node(self, node, nodes, master, user, user_shell, volumes):
         self._nodes = nodes
         self._master = master
         self._user = user
         self._user_shell = user_shell
         self._volumes = volumes
-        log.info("Adding %s to SGE" % node.alias)
-        self._setup_nfs(nodes=[node], export_paths=[self.SGE_ROOT],
-                        start_server=False)
-        self._add_sge_admin_host(node)
-        self._add_sge_submit_host(node)
-        self._add_to_sge(node)
-        self._create_sge_pe()
+        self._add_nodes_to_sge([node])
+
+    def on_add_nodes(self, new_nodes, nodes, master, user, user_shell,
+                     volumes):
+        if self._uses_legacy_hook(SGEPlugin, 'on_add_node'):
+            return clustersetup.ClusterSetup.on_add_nodes(
+                self, new_nodes, nodes, master, user, user_shell, volumes)
+        self._nodes = nodes
+        self._master = master
+        self._user = user
+        self._user_shell = user_shell
+        self._volumes = volumes
+        self._add_nodes_to_sge(new_nodes)
+
+    def _remove_nodes_from_sge(self, old_nodes):
+        log.info("Removing %s from SGE" %
+                 ', '.join([n.alias for n in old_nodes]))
+        self._remove_from_sge(old_nodes)
+        self._remove_nfs_exports(old_nodes)
 
     def on_remove_node(self, node, nodes, master, user, user_shell, volumes):
         self._nodes = nodes
@@ -200,6 +251,16 @@ class SGEPlugin(clustersetup.DefaultClusterSetup):
         self._user = user
         self._user_shell = user_shell
         self._volumes = volumes
-        log.info("Removing %s from SGE" % node.alias)
-        self._remove_from_sge(node)
-        self._remove_nfs_exports(node)
+        self._remove_nodes_from_sge([node])
+
+    def on_remove_nodes(self, old_nodes, nodes, master, user, user_shell,
+                        volumes):
+        if self._uses_legacy_hook(SGEPlugin, 'on_remove_node'):
+            return clustersetup.ClusterSetup.on_remove_nodes(
+                self, old_nodes, nodes, master, user, user_shell, volumes)
+        self._nodes = nodes
+        self._master = master
+        self._user = user
+        self._user_shell = user_shell
+        self._volumes = volumes
+        self._remove_nodes_from_sge(old_nodes)
@@ -73,6 +73,8 @@ class CreateUsers(clustersetup.DefaultClusterSetup):
                                  ("echo -n '%s' | newusers" % newusers),
                                  jobid=node.alias)
         self.pool.wait(numtasks=len(nodes))
+        for node in nodes:
+            node.invalidate_identity_cache()
         log.info("Configuring passwordless ssh for %d cluster users" %
                  self._num_users)
         pbar = self.pool.progress_bar.reset()
@@ -156,6 +158,7 @@ class CreateUsers(clustersetup.DefaultClusterSetup):
         newusers = self._get_newusers_batch_file(master, self._usernames,
                                                  user_shell)
         node.ssh.execute("echo -n '%s' | newusers" % newusers)
+        node.invalidate_identity_cache()
         log.info("Adding %s to known_hosts for %d users" %
                  (node.alias, self._num_users))
         pbar = self.pool.progress_bar.reset()
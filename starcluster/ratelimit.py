@@ -0,0 +1,316 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Client-side rate limiting for EC2 API requests
+
+All EC2 requests made through EasyEC2 pass through a process-wide
+RateGovernor which:
+
+    - paces requests with a token bucket per API action
+    - retries throttled requests and transient server/connection errors
+      using exponential backoff with jitter (boto's own unpaced retries are
+      turned off for governed connections)
+    - slows an action's bucket down after throttling and speeds it back up
+      after successful requests
+    - keeps per-action metrics of requests, throttles and time spent waiting
+
+This module also provides PollInterval for the various wait_for_* polling
+loops.
+"""
+import time
+import socket
+import random
+import httplib
+import threading
+
+from starcluster.logger import log
+
+THROTTLE_ERRORS = ['RequestLimitExceeded', 'Throttling',
+                   'ThrottlingException', 'RequestThrottled']
+SERVER_ERRORS = [500, 502, 503, 504]
+
+# (requests per second, burst) for read-only vs mutating API actions
+READ_RATE = (10.0, 50)
+WRITE_RATE = (5.0, 20)
+READ_ACTION_PREFIXES = ('Describe', 'Get')
+
+
+class TokenBucket(object):
+    """
+    Thread-safe token bucket that allows bursts of up to 'burst' requests
+    and refills at 'rate' tokens per second
+    """
+    def __init__(self, rate, burst, clock=time.time, sleep=time.sleep):
+        self.base_rate = self.rate = float(rate)
+        self.burst = burst
+        self.tokens = float(burst)
+        self._clock = clock
+        self._sleep = sleep
+        self._last = clock()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = self._clock()
+        elapsed = max(0, now - self._last)
+        self.tokens = min(self.burst, self.tokens + elapsed * self.rate)
+        self._last = now
+
+    def acquire(self):
+        """
+        Takes a token from the bucket, sleeping until one is available.
+        Returns the number of seconds spent waiting.
+        """
+        waited = 0
+        while True:
+            with self._lock:
+                self._refill()
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return waited
+                # never sleep less than 1ms so that float rounding can't
+                # leave us spinning just below a full token
+                delay = max(0.001, (1 - self.tokens) / self.rate)
+            self._sleep(delay)
+            waited += delay
+
+    def penalize(self, min_rate=0.5):
+        """
+        Halves the refill rate and drains the bucket after being throttled
+        """
+        with self._lock:
+            self.rate = max(min_rate, self.rate / 2)
+            self.tokens = 0
+
+    def reward(self):
+        """
+        Recovers a tenth of the base rate after a successful request
+        """
+        if self.rate < self.base_rate:
+            with self._lock:
+                self.rate = min(self.base_rate,
+                                self.rate + self.base_rate / 10)
+
+
+class Backoff(object):
+    """
+    Exponential backoff with jitter
+
+    base - delay before the first retry
+    max_delay - upper bound on any single delay
+    full_jitter - pick delays uniformly from [0, delay] when True otherwise
+                  from [delay / 2, delay] (equal jitter)
+    """
+    def __init__(self, base=0.5, max_delay=30, factor=2, full_jitter=True):
+        self.base = base
+        self.max_delay = max_delay
+        self.factor = factor
+        self.full_jitter = full_jitter
+
+    def delay(self, attempt):
+        delay = min(self.max_delay, self.base * self.factor ** attempt)
+        if self.full_jitter:
+            return random.uniform(0, delay)
+        return random.uniform(delay / 2.0, delay)
+
+
+class PollInterval(object):
+    """
+    Adaptive interval for polling loops that wait on a number of resources
+    to reach a target state. The interval tightens from 'interval' towards
+    'min_interval' as more of the resources reach the target state and is
+    jittered so that concurrent StarCluster processes don't poll in lockstep.
+    """
+    def __init__(self, interval, min_interval=1, jitter=0.1,
+                 sleep=time.sleep):
+        self.interval = max(interval, min_interval)
+        self.min_interval = min_interval
+        self.jitter = jitter
+        self._sleep = sleep
+        self.elapsed = 0
+
+    def next(self, done=0, total=1):
+        remaining = 1 - float(done) / total if total else 1
+        interval = self.min_interval + (
+            (self.interval - self.min_interval) * remaining)
+        spread = interval * self.jitter
+        return max(self.min_interval,
+                   interval + random.uniform(-spread, spread))
+
+    def sleep(self, done=0, total=1):
+        """
+        Sleeps for the next interval and returns the number of seconds slept
+        """
+        interval = self.next(done, total)
+        self._sleep(interval)
+        self.elapsed += interval
+        return interval
+
+
+def is_throttle_error(error):
+    return getattr(error, 'error_code', None) in THROTTLE_ERRORS
+
+
+def is_transient_error(error):
+    """
+    Returns True for errors that boto would normally have retried itself:
+    5xx responses and connection errors
+    """
+    if isinstance(error, (socket.error, httplib.HTTPException)):
+        return True
+    return getattr(error, 'status', None) in SERVER_ERRORS
+
+
+class RateGovernor(object):
+    """
+    Paces, retries and counts API requests per action
+
+    Use govern() to route a boto connection's requests through the governor
+    or call() to make a single governed request.
+    """
+    # boto's AWSQueryConnection funnels every EC2 request through these
+    GOVERNED_METHODS = ['get_list', 'get_object', 'get_status']
+
+    def __init__(self, max_retries=8, backoff=None, clock=time.time,
+                 sleep=time.sleep):
+        self.max_retries = max_retries
+        self.backoff = backoff or Backoff()
+        self._clock = clock
+        self._sleep = sleep
+        self._buckets = {}
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def _get_rate(self, action):
+        if action.startswith(READ_ACTION_PREFIXES):
+            return READ_RATE
+        return WRITE_RATE
+
+    def get_bucket(self, action):
+        with self._lock:
+            bucket = self._buckets.get(action)
+            if bucket is None:
+                rate, burst = self._get_rate(action)
+                bucket = TokenBucket(rate, burst, clock=self._clock,
+                                     sleep=self._sleep)
+                self._buckets[action] = bucket
+            return bucket
+
+    def _record(self, action, **counts):
+        with self._lock:
+            metrics = self._metrics.setdefault(
+                action, dict(calls=0, throttled=0, wait_time=0))
+            for key, value in counts.items():
+                metrics[key] += value
+
+    def call(self, action, func, *args, **kwargs):
+        """
+        Calls func(*args, **kwargs) once a token for action is available,
+        retrying with backoff if the request is throttled or fails with a
+        transient error
+        """
+        bucket = self.get_bucket(action)
+        attempt = 0
+        while True:
+            waited = bucket.acquire()
+            self._record(action, calls=1, wait_time=waited)
+            try:
+                result = func(*args, **kwargs)
+            except Exception, e:
+                throttled = is_throttle_error(e)
+                if not (throttled or is_transient_error(e)) or \
+                        attempt >= self.max_retries:
+                    raise
+                delay = self.backoff.delay(attempt)
+                if throttled:
+                    bucket.penalize()
+                    log.debug("%s request throttled (%s) - retrying in %.1fs"
+                              % (action, e.error_code, delay))
+                    self._record(action, throttled=1, wait_time=delay)
+                else:
+                    log.debug("%s request failed (%s) - retrying in %.1fs" %
+                              (action, e, delay))
+                    self._record(action, wait_time=delay)
+                self._sleep(delay)
+                attempt += 1
+                continue
+            bucket.reward()
+            return result
+
+    def _wrap(self, method):
+        def governed(action, *args, **kwargs):
+            return self.call(action, method, action, *args, **kwargs)
+        governed.__name__ = method.__name__
+        governed.__doc__ = method.__doc__
+        return governed
+
+    def _disable_retries(self, mexe):
+        def _mexe(request, sender=None, override_num_retries=None,
+                  retry_handler=None):
+            if override_num_retries is None:
+                override_num_retries = 0
+            return mexe(request, sender, override_num_retries, retry_handler)
+        return _mexe
+
+    def govern(self, conn):
+        """
+        Routes all requests made by a boto connection through this governor.
+        boto's own retries are disabled so that throttled requests reach
+        the governor right away instead of being retried unpaced first.
+        Calling govern() more than once on the same connection is a no-op.
+        """
+        if getattr(conn, '_sc_governor', None) is not self:
+            for name in self.GOVERNED_METHODS:
+                method = getattr(conn, name, None)
+                if method is not None:
+                    setattr(conn, name, self._wrap(method))
+            if hasattr(conn, '_mexe'):
+                conn._mexe = self._disable_retries(conn._mexe)
+            conn._sc_governor = self
+        return conn
+
+    @property
+    def metrics(self):
+        """
+        Returns a copy of the {action: {calls, throttled, wait_time}} metrics
+        """
+        with self._lock:
+            return dict([(action, dict(m))
+                         for action, m in self._metrics.items()])
+
+    def log_metrics(self, log_func=log.debug):
+        metrics = self.metrics
+        if not metrics:
+            return
+        log_func("EC2 API requests (calls/throttled/wait secs):")
+        for action in sorted(metrics):
+            m = metrics[action]
+            log_func("%s: %d/%d/%.1f" % (action, m['calls'], m['throttled'],
+                                         m['wait_time']))
+
+
+_governor = None
+
+
+def get_governor():
+    """
+    Returns the process-wide RateGovernor shared by all EasyEC2 objects
+    """
+    global _governor
+    if _governor is None:
+        _governor = RateGovernor()
+    return _governor
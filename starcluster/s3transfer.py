@@ -0,0 +1,271 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Concurrent and resumable transfers of S3 keys
+
+S3Transfer downloads a list of keys to a local directory, or copies them to
+another bucket, using a pool of worker threads. Keys larger than range_size
+are fetched with several ranged GETs in parallel. Each range is written to
+its own '.sc-part' file so that an interrupted download picks up where it
+left off, and local files whose size and ETag already match are skipped.
+"""
+
+import os
+import shutil
+import threading
+
+from starcluster import exception
+from starcluster import progressbar
+from starcluster import transfer
+from starcluster.logger import log
+
+RANGE_SIZE = 16 * 1024 * 1024
+
+
+def etag_md5(key):
+    """
+    Returns the md5 hex digest in key's ETag or None if the ETag is not an
+    md5 of the contents (e.g. keys uploaded with multipart uploads)
+    """
+    etag = (key.etag or '').strip('"')
+    if etag and '-' not in etag:
+        return etag
+
+
+class RangeJob(object):
+    """
+    Bytes start..end (inclusive) of key to be written to path. offset is the
+    number of bytes of the range already present in path.
+    """
+    def __init__(self, key, start, end, path, offset=0):
+        self.key = key
+        self.start = start
+        self.end = end
+        self.path = path
+        self.offset = offset
+
+    @property
+    def size(self):
+        return self.end - self.start + 1
+
+
+class S3Transfer(object):
+    """
+    Transfers S3 keys concurrently
+
+    workers - number of concurrent GET/COPY requests
+    range_size - keys larger than this many bytes are fetched in ranges
+    progress - show an aggregate progress bar on stderr
+    """
+    def __init__(self, workers=8, range_size=RANGE_SIZE, progress=True):
+        self.workers = max(1, workers)
+        self.range_size = max(1, range_size)
+        self.progress = progress
+        self._lock = threading.Lock()
+        self._pbar = None
+        self._done = 0
+
+    def _start_progress(self, label, total):
+        self._done = 0
+        self._pbar = None
+        if not self.progress or total <= 0:
+            return
+        widgets = ['%s: ' % label, progressbar.Percentage(), ' ',
+                   progressbar.Bar(marker=progressbar.RotatingMarker()), ' ',
+                   progressbar.ETA(), ' ', progressbar.FileTransferSpeed()]
+        self._pbar = progressbar.ProgressBar(widgets=widgets,
+                                             maxval=total).start()
+
+    def _add_progress(self, nbytes):
+        self._lock.acquire()
+        try:
+            self._done += nbytes
+            if self._pbar:
+                self._pbar.update(min(self._done, self._pbar.maxval))
+        finally:
+            self._lock.release()
+
+    def _finish_progress(self):
+        if self._pbar and not self._pbar.finished:
+            self._pbar.finish()
+        self._pbar = None
+
+    def is_complete(self, key, path):
+        """
+        Returns True if path has the same size as key and, when key's ETag is
+        an md5 sum, the same md5 sum
+        """
+        if not os.path.isfile(path) or os.path.getsize(path) != key.size:
+            return False
+        md5 = etag_md5(key)
+        return md5 is None or md5 == transfer.local_md5(path)
+
+    def _get_ranges(self, key, dest):
+        part = dest + transfer.PART_SUFFIX
+        if key.size <= self.range_size:
+            bounds = [(0, key.size - 1, part)]
+        else:
+            bounds = []
+            starts = range(0, key.size, self.range_size)
+            for i, start in enumerate(starts):
+                end = min(start + self.range_size, key.size) - 1
+                bounds.append((start, end, '%s.%d' % (part, i)))
+        jobs = []
+        for start, end, path in bounds:
+            job = RangeJob(key, start, end, path)
+            if os.path.isfile(path):
+                job.offset = min(os.path.getsize(path), job.size)
+            jobs.append(job)
+        return jobs
+
+    def _fetch_range(self, job):
+        # Key objects hold the open response so each request needs its own
+        key = job.key.bucket.new_key(job.key.name)
+        headers = {'Range': 'bytes=%d-%d' % (job.start + job.offset,
+                                             job.end)}
+        log.debug("fetching %s %s -> %s" % (key.name, headers['Range'],
+                                            job.path))
+        received = [0]
+
+        def _progress_cb(trans, total):
+            self._add_progress(trans - received[0])
+            received[0] = trans
+        f = open(job.path, 'ab' if job.offset else 'wb')
+        try:
+            key.get_contents_to_file(f, headers=headers, cb=_progress_cb,
+                                     num_cb=20)
+        finally:
+            f.close()
+
+    def _assemble(self, key, dest, jobs):
+        part = dest + transfer.PART_SUFFIX
+        if len(jobs) > 1:
+            out = open(part, 'wb')
+            try:
+                for job in jobs:
+                    f = open(job.path, 'rb')
+                    try:
+                        shutil.copyfileobj(f, out, transfer.CHUNK_SIZE)
+                    finally:
+                        f.close()
+            finally:
+                out.close()
+            for job in jobs:
+                os.unlink(job.path)
+        elif not os.path.exists(part):
+            open(part, 'wb').close()
+        md5 = etag_md5(key)
+        if md5 and md5 != transfer.local_md5(part):
+            os.unlink(part)
+            raise exception.BaseException(
+                "checksum mismatch while downloading %s" % key.name)
+        if os.path.exists(dest):
+            os.unlink(dest)
+        os.rename(part, dest)
+
+    def download(self, keys, destdir):
+        """
+        Downloads keys to destdir (preserving key names) and returns a
+        transfer.TransferStats
+        """
+        stats = transfer.TransferStats()
+        stats.targets.append(destdir)
+        files = {}
+        jobs = []
+        for key in keys:
+            dest = os.path.join(destdir, *key.name.split('/'))
+            if self.is_complete(key, dest):
+                stats.skipped += 1
+                continue
+            destparent = os.path.dirname(dest)
+            if not os.path.isdir(destparent):
+                os.makedirs(destparent)
+            ranges = self._get_ranges(key, dest)
+            offset = sum([j.offset for j in ranges])
+            fjob = transfer.FileJob(key.name, dest, key.size, None, None,
+                                    offset=offset)
+            pending = [j for j in ranges if j.offset < j.size]
+            files[key.name] = [fjob, ranges, len(pending)]
+            if not pending:
+                self._assemble(key, dest, ranges)
+                stats.add_job(fjob)
+            jobs.extend(pending)
+
+        def _run(job):
+            self._fetch_range(job)
+            self._lock.acquire()
+            try:
+                entry = files[job.key.name]
+                entry[2] -= 1
+                complete = entry[2] == 0
+            finally:
+                self._lock.release()
+            if complete:
+                fjob, ranges = entry[:2]
+                self._assemble(job.key, fjob.dest, ranges)
+                self._lock.acquire()
+                try:
+                    stats.add_job(fjob)
+                finally:
+                    self._lock.release()
+        jobs.sort(key=lambda j: j.size - j.offset, reverse=True)
+        self._start_progress("Downloading",
+                             sum([j.size - j.offset for j in jobs]))
+        try:
+            transfer.run_jobs(jobs, _run, self.workers)
+        finally:
+            self._finish_progress()
+        return stats
+
+    def copy(self, keys, destbucket):
+        """
+        Copies keys server-side to the boto Bucket destbucket under the same
+        names and returns a transfer.TransferStats. Keys already present in
+        destbucket with the same size and ETag are skipped.
+        """
+        stats = transfer.TransferStats()
+        stats.targets.append(destbucket.name)
+        prefix = os.path.commonprefix([k.name for k in keys])
+        existing = {}
+        for k in destbucket.list(prefix=prefix):
+            existing[k.name] = k
+        jobs = []
+        for key in keys:
+            other = existing.get(key.name)
+            if other and other.size == key.size and other.etag == key.etag:
+                stats.skipped += 1
+                continue
+            jobs.append(transfer.FileJob(key, key.name, key.size, None, None))
+
+        def _run(job):
+            log.debug("copying %s -> %s/%s" % (job.src.name, destbucket.name,
+                                               job.dest))
+            job.src.copy(destbucket.name, job.dest)
+            self._add_progress(job.size)
+            self._lock.acquire()
+            try:
+                stats.add_job(job)
+            finally:
+                self._lock.release()
+        jobs.sort(key=lambda j: j.size, reverse=True)
+        self._start_progress("Copying", sum([j.size for j in jobs]))
+        try:
+            transfer.run_jobs(jobs, _run, self.workers)
+        finally:
+            self._finish_progress()
+        return stats
@@ -0,0 +1,309 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Local time-series store and statistics for EC2 spot price history
+
+DescribeSpotPriceHistory only returns the points at which a price changed so
+each (region, product, instance type, zone) series is kept on disk as two
+append-only columns of doubles (timestamps and prices) under
+~/.starcluster/spothistory. Updating a series only asks EC2 for the points
+recorded since the previous fetch and series fetched less than max_age
+seconds ago are served straight from disk.
+
+Spot prices are step functions so SpotPriceStats weights every price by how
+long it was in effect when computing averages, percentiles, volatility and
+the interruption risk of a given bid.
+"""
+
+import os
+import re
+import math
+import time
+import array
+import bisect
+
+from starcluster import utils
+from starcluster import static
+from starcluster.logger import log
+
+TYPECODE = 'd'
+ITEMSIZE = array.array(TYPECODE).itemsize
+# seconds after which a series is brought up to date from EC2
+DEFAULT_MAX_AGE = 600
+# days of history used for stats when no start time is given
+DEFAULT_DAYS = 30
+PERCENTILES = (50, 90, 99)
+# seconds of overlap between fetches to pick up points published late
+FETCH_OVERLAP = 3600
+
+
+class SpotPriceSeries(object):
+    """
+    Append-only columnar price series for a single zone stored as
+    <path>.ts (unix timestamps) and <path>.px (prices)
+    """
+    def __init__(self, path):
+        self.path = path
+        self.ts_file = path + '.ts'
+        self.px_file = path + '.px'
+
+    def __len__(self):
+        sizes = []
+        for fname in self.ts_file, self.px_file:
+            try:
+                sizes.append(os.path.getsize(fname) / ITEMSIZE)
+            except OSError:
+                return 0
+        return min(sizes)
+
+    def _read_column(self, fname, count, offset=0):
+        col = array.array(TYPECODE)
+        if count > 0:
+            with open(fname, 'rb') as f:
+                f.seek(offset * ITEMSIZE)
+                col.fromfile(f, count)
+        return col
+
+    def load(self):
+        """
+        Returns (timestamps, prices) arrays in ascending time order
+        """
+        count = len(self)
+        return (self._read_column(self.ts_file, count),
+                self._read_column(self.px_file, count))
+
+    def last_timestamp(self):
+        count = len(self)
+        if not count:
+            return None
+        return self._read_column(self.ts_file, 1, offset=count - 1)[0]
+
+    def append(self, points):
+        """
+        Appends the (timestamp, price) points newer than the last stored
+        point and returns how many were added
+        """
+        last = self.last_timestamp()
+        points = sorted([p for p in points if last is None or p[0] > last])
+        if not points:
+            return 0
+        count = len(self)
+        for fname in self.ts_file, self.px_file:
+            # drop a trailing partial write left behind by an interrupted
+            # append so that both columns stay aligned
+            if os.path.exists(fname) and \
+                    os.path.getsize(fname) != count * ITEMSIZE:
+                with open(fname, 'r+b') as f:
+                    f.truncate(count * ITEMSIZE)
+        dirname = os.path.dirname(self.path)
+        if not os.path.isdir(dirname):
+            os.makedirs(dirname)
+        for fname, col in (self.ts_file, 0), (self.px_file, 1):
+            with open(fname, 'ab') as f:
+                array.array(TYPECODE, [p[col] for p in points]).tofile(f)
+        return len(points)
+
+
+def _slug(name):
+    return re.sub(r'[^\w.-]+', '_', name).strip('_')
+
+
+class SpotHistoryStore(object):
+    """
+    Spot price series for every region/product/instance type/zone fetched
+    so far, laid out as <root>/<region>/<product>/<instance_type>/<zone>.*
+    """
+    def __init__(self, root=None, max_age=DEFAULT_MAX_AGE):
+        self.root = root or static.SPOT_HISTORY_DIR
+        self.max_age = max_age
+
+    def _series_dir(self, region, product, instance_type):
+        return os.path.join(self.root, region, _slug(product), instance_type)
+
+    def _fetched_file(self, region, product, instance_type):
+        return os.path.join(self._series_dir(region, product, instance_type),
+                            'fetched')
+
+    def get_series(self, region, product, instance_type, zone):
+        return SpotPriceSeries(os.path.join(
+            self._series_dir(region, product, instance_type), zone))
+
+    def get_zones(self, region, product, instance_type):
+        sdir = self._series_dir(region, product, instance_type)
+        if not os.path.isdir(sdir):
+            return []
+        return sorted([f[:-3] for f in os.listdir(sdir) if f.endswith('.ts')])
+
+    def last_fetched(self, region, product, instance_type):
+        """
+        Returns the unix time of the last fetch from EC2 or None
+        """
+        try:
+            with open(self._fetched_file(region, product, instance_type)) as f:
+                return float(f.read().strip())
+        except (IOError, OSError, ValueError):
+            return None
+
+    def is_current(self, region, product, instance_type):
+        fetched = self.last_fetched(region, product, instance_type)
+        return fetched is not None and time.time() - fetched < self.max_age
+
+    def update(self, conn, region, product, instance_type, force=False):
+        """
+        Fetches the spot price points for instance_type recorded since the
+        last fetch (or all available history the first time) using the boto
+        EC2 connection conn and appends them to their zones' series. Returns
+        the number of new points. Nothing is fetched if the series was
+        updated less than max_age seconds ago unless force is True.
+        """
+        if not force and self.is_current(region, product, instance_type):
+            return 0
+        fetched = self.last_fetched(region, product, instance_type)
+        start = None
+        if fetched is not None:
+            start = time.strftime('%Y-%m-%dT%H:%M:%SZ',
+                                  time.gmtime(fetched - FETCH_OVERLAP))
+        now = time.time()
+        points = {}
+        next_token = None
+        while True:
+            hist = conn.get_spot_price_history(
+                start_time=start, instance_type=instance_type,
+                product_description=product, next_token=next_token)
+            for item in hist:
+                ts = utils.iso_to_unix_time(item.timestamp)
+                zpoints = points.setdefault(item.availability_zone, [])
+                zpoints.append((float(ts), float(item.price)))
+            next_token = getattr(hist, 'next_token', None)
+            if not next_token:
+                break
+        added = 0
+        for zone, zpoints in points.items():
+            series = self.get_series(region, product, instance_type, zone)
+            added += series.append(zpoints)
+        log.debug("fetched %d new spot price points for %s (%s)" %
+                  (added, instance_type, product))
+        fetched_file = self._fetched_file(region, product, instance_type)
+        if not os.path.isdir(os.path.dirname(fetched_file)):
+            os.makedirs(os.path.dirname(fetched_file))
+        with open(fetched_file, 'w') as f:
+            f.write('%f\n' % now)
+        return added
+
+    def load(self, region, product, instance_type, zone=None, start=None,
+             end=None):
+        """
+        Returns a dictionary mapping each zone (or only zone if specified) to
+        its (timestamps, prices) arrays between the unix times start and end.
+        The price already in effect at start is included as the first point.
+        """
+        zones = [zone] if zone else self.get_zones(region, product,
+                                                   instance_type)
+        series = {}
+        for z in zones:
+            ts, px = self.get_series(region, product, instance_type,
+                                     z).load()
+            lo, hi = 0, len(ts)
+            if start is not None:
+                lo = max(bisect.bisect_right(ts, start) - 1, 0)
+            if end is not None:
+                hi = bisect.bisect_right(ts, end)
+            if lo < hi:
+                series[z] = (ts[lo:hi], px[lo:hi])
+        return series
+
+
+class SpotPriceStats(object):
+    """
+    Time-weighted statistics of a spot price series between start (defaults
+    to the first point) and now. When bid is given also estimates how often
+    and for how long the price exceeded the bid (i.e. instances would have
+    been interrupted) and the expected hourly cost while running at that bid.
+    """
+    def __init__(self, timestamps, prices, bid=None, start=None, now=None):
+        now = now or time.time()
+        start = max(start or timestamps[0], timestamps[0])
+        n = len(prices)
+        weights = []
+        for i in range(n):
+            begin = max(timestamps[i], start)
+            end = timestamps[i + 1] if i + 1 < n else max(now, begin)
+            weights.append(max(end - begin, 0))
+        total = float(sum(weights))
+        if not total:
+            weights = [0] * (n - 1) + [1]
+            total = 1.0
+        self.bid = bid
+        self.current = prices[-1]
+        self.minimum = min(prices)
+        self.maximum = max(prices)
+        self.duration = total
+        self.average = sum([p * w for p, w in zip(prices, weights)]) / total
+        variance = sum([w * (p - self.average) ** 2
+                        for p, w in zip(prices, weights)]) / total
+        # coefficient of variation of the price over time
+        self.volatility = 0.0
+        if self.average:
+            self.volatility = math.sqrt(variance) / self.average
+        self.percentiles = self._percentiles(prices, weights, total)
+        self.risk = None
+        self.interruptions = None
+        self.expected_cost = None
+        if bid is not None:
+            self._bid_stats(prices, weights, total, bid)
+
+    def _percentiles(self, prices, weights, total):
+        pairs = sorted(zip(prices, weights))
+        pcts = {}
+        for q in PERCENTILES:
+            target = total * q / 100.0
+            cum = 0
+            for price, weight in pairs:
+                cum += weight
+                if cum >= target:
+                    break
+            pcts[q] = price
+        return pcts
+
+    def _bid_stats(self, prices, weights, total, bid):
+        above = sum([w for p, w in zip(prices, weights) if p > bid])
+        self.risk = above / total
+        self.interruptions = len([i for i in range(1, len(prices))
+                                  if prices[i] > bid >= prices[i - 1]])
+        running = total - above
+        if running:
+            self.expected_cost = sum([p * w for p, w in zip(prices, weights)
+                                      if p <= bid]) / running
+
+    @property
+    def interruptions_per_day(self):
+        if self.interruptions is None:
+            return None
+        return self.interruptions / (self.duration / 86400.)
+
+
+def rank_by_expected_cost(stats):
+    """
+    Sorts a dictionary of SpotPriceStats computed for the same bid into a
+    list of (key, stats) tuples ordered by expected cost then interruption
+    risk. Entries whose price never fell to the bid come last.
+    """
+    def sort_key(item):
+        s = item[1]
+        return (s.expected_cost is None, s.expected_cost, s.risk, item[0])
+    return sorted(stats.items(), key=sort_key)
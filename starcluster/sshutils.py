@@ -20,13 +20,17 @@ import re
 import sys
 import stat
 import glob
+import uuid
+import pipes
 import atexit
 import string
+import base64
 import socket
 import fnmatch
 import hashlib
 import warnings
 import posixpath
+import threading
 
 import scp
 import paramiko
@@ -46,6 +50,47 @@ from starcluster import progressbar
 from starcluster.logger import log
 
 
+class SSHConnection(object):
+    """
+    The transport (and SFTP session) of an SSH connection together with the
+    lock that serializes reconnecting it. A connection may be shared by
+    several SSHClient objects (see SSHConnectionPool).
+    """
+    def __init__(self, max_channels=None):
+        self.transport = None
+        self.sftp = None
+        self.stale = False
+        self.reconnects = 0
+        self.lock = threading.RLock()
+        self.channel_sem = None
+        if max_channels:
+            self.channel_sem = threading.BoundedSemaphore(max_channels)
+
+    def is_active(self):
+        if self.transport:
+            return self.transport.is_active()
+        return False
+
+    def is_healthy(self):
+        """
+        Returns True if the transport is active and still responds to an
+        SSH_MSG_IGNORE probe
+        """
+        if not self.is_active():
+            return False
+        try:
+            self.transport.send_ignore()
+            return True
+        except (paramiko.SSHException, socket.error, EOFError):
+            return False
+
+    def close(self):
+        if self.sftp:
+            self.sftp.close()
+        if self.transport:
+            self.transport.close()
+
+
 class SSHClient(object):
     """
     Establishes an SSH connection to a remote host using either password or
@@ -62,18 +107,24 @@ class SSHClient(object):
                  private_key_pass=None,
                  compress=False,
                  port=22,
-                 timeout=30):
+                 timeout=30,
+                 keepalive=0,
+                 max_channels=None,
+                 connection=None,
+                 pool=None):
         self._host = host
         self._port = port
         self._pkey = None
         self._username = username or os.environ['LOGNAME']
         self._password = password
+        self._private_key = private_key
         self._timeout = timeout
-        self._sftp = None
         self._scp = None
-        self._transport = None
         self._progress_bar = None
         self._compress = compress
+        self._keepalive = keepalive
+        self._conn = connection or SSHConnection(max_channels)
+        self._pool = pool
         if private_key:
             self._pkey = self.load_private_key(private_key, private_key_pass)
         elif not password:
@@ -118,6 +169,8 @@ class SSHClient(object):
             raise exception.SSHConnectionError(host, port)
         # Enable/disable compression
         transport.use_compression(compress)
+        if self._keepalive:
+            transport.set_keepalive(self._keepalive)
         # Authenticate the transport.
         try:
             transport.connect(username=username, pkey=pkey, password=password)
@@ -132,15 +185,20 @@ class SSHClient(object):
             raise exception.SSHConnectionError(host, port)
         except Exception, e:
             raise exception.SSHError(str(e))
-        self.close()
-        self._transport = transport
+        self._conn.lock.acquire()
         try:
-            assert self.sftp is not None
-        except paramiko.SFTPError, e:
-            if 'Garbage packet received' in e:
-                log.debug("Garbage packet received", exc_info=True)
-                raise exception.SSHAccessDeniedViaAuthKeys(username)
-            raise
+            self._conn.close()
+            self._conn.transport = transport
+            self._conn.stale = False
+            try:
+                assert self.sftp is not None
+            except paramiko.SFTPError, e:
+                if 'Garbage packet received' in e:
+                    log.debug("Garbage packet received", exc_info=True)
+                    raise exception.SSHAccessDeniedViaAuthKeys(username)
+                raise
+        finally:
+            self._conn.lock.release()
         return self
 
     @property
@@ -148,19 +206,61 @@ class SSHClient(object):
         """
         This property attempts to return an active SSH transport
         """
-        if not self._transport or not self._transport.is_active():
-            self.connect(self._host, self._username, self._password,
-                         port=self._port, timeout=self._timeout,
-                         compress=self._compress)
-        return self._transport
+        conn = self._conn
+        if conn.is_active() and not conn.stale:
+            return conn.transport
+        conn.lock.acquire()
+        try:
+            # another client sharing this connection may have reconnected it
+            # while we were waiting for the lock
+            if not conn.is_active() or conn.stale:
+                if conn.transport:
+                    log.debug("transport to %s is no longer active, "
+                              "reconnecting" % self._host)
+                    conn.reconnects += 1
+                self.connect(self._host, self._username, self._password,
+                             port=self._port, timeout=self._timeout,
+                             compress=self._compress)
+            return conn.transport
+        finally:
+            conn.lock.release()
+
+    @property
+    def reconnects(self):
+        return self._conn.reconnects
 
     def get_server_public_key(self):
         return self.transport.get_remote_server_key()
 
     def is_active(self):
-        if self._transport:
-            return self._transport.is_active()
-        return False
+        return self._conn.is_active()
+
+    def is_healthy(self):
+        """
+        Returns True if the underlying transport is active and still
+        responds to an SSH_MSG_IGNORE probe
+        """
+        return self._conn.is_healthy()
+
+    def _open_session(self):
+        """
+        Opens a new channel on the transport, blocking if this client
+        already has max_channels channels in use
+        """
+        if self._conn.channel_sem:
+            self._conn.channel_sem.acquire()
+        try:
+            return self.transport.open_session()
+        except:
+            self._release_channel()
+            raise
+
+    def _release_channel(self):
+        if self._conn.channel_sem:
+            try:
+                self._conn.channel_sem.release()
+            except ValueError:
+                pass
 
     def _get_socket(self, hostname, port):
         addrinfo = socket.getaddrinfo(hostname, port, socket.AF_UNSPEC,
@@ -200,17 +300,26 @@ class SSHClient(object):
     @property
     def sftp(self):
         """Establish the SFTP connection."""
-        if not self._sftp or self._sftp.sock.closed:
-            log.debug("creating sftp connection")
-            self._sftp = paramiko.SFTPClient.from_transport(self.transport)
-        return self._sftp
+        conn = self._conn
+        if conn.sftp and not conn.sftp.sock.closed:
+            return conn.sftp
+        conn.lock.acquire()
+        try:
+            if not conn.sftp or conn.sftp.sock.closed:
+                log.debug("creating sftp connection")
+                transport = self.transport
+                conn.sftp = paramiko.SFTPClient.from_transport(transport)
+            return conn.sftp
+        finally:
+            conn.lock.release()
 
     @property
     def scp(self):
         """Initialize the SCP client."""
-        if not self._scp or not self._scp.transport.is_active():
+        transport = self.transport
+        if not self._scp or self._scp.transport is not transport:
             log.debug("creating scp connection")
-            self._scp = scp.SCPClient(self.transport,
+            self._scp = scp.SCPClient(transport,
                                       progress=self._file_transfer_progress,
                                       socket_timeout=self._timeout)
         return self._scp
@@ -491,11 +600,14 @@ class SSHClient(object):
         """
         Execute a remote command and return the exit status
         """
-        channel = self.transport.open_session()
-        if source_profile:
-            command = "source /etc/profile && %s" % command
-        channel.exec_command(command)
-        self.__last_status = channel.recv_exit_status()
+        channel = self._open_session()
+        try:
+            if source_profile:
+                command = "source /etc/profile && %s" % command
+            channel.exec_command(command)
+            self.__last_status = channel.recv_exit_status()
+        finally:
+            self._release_channel()
         return self.__last_status
 
     def _get_output(self, channel, silent=True, only_printable=False):
@@ -548,22 +660,25 @@ class SSHClient(object):
         raise_on_failure - raise exception.SSHError if command fails
         returns List of output lines
         """
-        channel = self.transport.open_session()
-        if detach:
-            command = "nohup %s &" % command
+        channel = self._open_session()
+        try:
+            if detach:
+                command = "nohup %s &" % command
+                if source_profile:
+                    command = "source /etc/profile && %s" % command
+                channel.exec_command(command)
+                channel.close()
+                self.__last_status = None
+                return
             if source_profile:
                 command = "source /etc/profile && %s" % command
+            log.debug("executing remote command: %s" % command)
             channel.exec_command(command)
-            channel.close()
-            self.__last_status = None
-            return
-        if source_profile:
-            command = "source /etc/profile && %s" % command
-        log.debug("executing remote command: %s" % command)
-        channel.exec_command(command)
-        output = self._get_output(channel, silent=silent,
-                                  only_printable=only_printable)
-        exit_status = channel.recv_exit_status()
+            output = self._get_output(channel, silent=silent,
+                                      only_printable=only_printable)
+            exit_status = channel.recv_exit_status()
+        finally:
+            self._release_channel()
         self.__last_status = exit_status
         out_str = '\n'.join(output)
         if exit_status != 0:
@@ -588,6 +703,14 @@ class SSHClient(object):
                 log.debug("output of '%s' has been hidden" % command)
         return output
 
+    def batch(self, source_profile=True):
+        """
+        Returns a CommandBatch that accumulates commands, file writes and
+        permission changes and runs them all on this host in a single SSH
+        round trip when its run() method is called
+        """
+        return CommandBatch(self, source_profile=source_profile)
+
     def has_required(self, progs):
         """
         Same as check_required but returns False if not all commands exist
@@ -625,10 +748,7 @@ class SSHClient(object):
 
     def close(self):
         """Closes the connection and cleans up."""
-        if self._sftp:
-            self._sftp.close()
-        if self._transport:
-            self._transport.close()
+        self._conn.close()
 
     def _invoke_shell(self, term='screen', cols=80, lines=24):
         chan = self.transport.open_session()
@@ -644,8 +764,20 @@ class SSHClient(object):
     def switch_user(self, user):
         """
         Reconnect, if necessary, to host as user
+
+        Pooled clients switch to the pool's connection for user rather than
+        reconnecting the connection they share with other clients.
         """
-        if not self.is_active() or user and self.get_current_user() != user:
+        if self._pool and user and user != self._username:
+            log.debug("switching to pooled connection to %s as user %s" %
+                      (self._host, user))
+            self._conn = self._pool.get_connection(
+                self._host, username=user, private_key=self._private_key,
+                port=self._port)
+            self._username = user
+            self._scp = None
+            assert self.transport is not None
+        elif not self.is_active() or user and self.get_current_user() != user:
             self.connect(username=user)
         else:
             user = user or self._username
@@ -739,6 +871,332 @@ class SSHClient(object):
 Connection = SSHClient
 
 
+class BatchResult(object):
+    """
+    Exit status and output of a single step in a CommandBatch
+    """
+    def __init__(self, command, exit_status=None, output=None):
+        self.command = command
+        self.exit_status = exit_status
+        self.output = output or []
+
+    @property
+    def skipped(self):
+        return self.exit_status is None
+
+    def __repr__(self):
+        return '<BatchResult: %s (status: %s)>' % (self.command,
+                                                   self.exit_status)
+
+
+class CommandBatch(object):
+    """
+    Builds a remote bash script out of a sequence of steps and runs it over a
+    single SSH channel instead of opening a new channel (and re-sourcing
+    /etc/profile) for every command.
+
+    Each step runs in its own subshell so that steps behave the same as
+    separate SSHClient.execute calls. Execution stops at the first step that
+    fails unless that step was added with ignore_exit_status=True. The
+    profile is sourced once up front and again after any step that writes a
+    file under /etc/profile or /etc/profile.d so that later steps see the
+    environment it sets up.
+
+    Example:
+    $ batch = node.ssh.batch()
+    $ batch.mkdir('/scratch').chown('sgeadmin', 'sgeadmin', '/scratch')
+    $ batch.execute('exportfs -fra')
+    $ results = batch.run()
+    """
+    profile = '/etc/profile'
+
+    def __init__(self, ssh, source_profile=True):
+        self.ssh = ssh
+        self.source_profile = source_profile
+        self._steps = []
+        self._reload_profile = set()
+        self._token = uuid.uuid4().hex
+
+    def __len__(self):
+        return len(self._steps)
+
+    def _add(self, label, script, ignore_exit_status=False):
+        self._steps.append((label, script, ignore_exit_status))
+        return self
+
+    def _add_write(self, remote_path, label, script):
+        if posixpath.normpath(remote_path).startswith(self.profile):
+            self._reload_profile.add(len(self._steps))
+        return self._add(label, script)
+
+    def execute(self, command, ignore_exit_status=False):
+        """
+        Add a shell command to the batch
+        """
+        return self._add(command, command, ignore_exit_status)
+
+    def mkdir(self, path, mode=None, ignore_exit_status=False):
+        """
+        Add a step that creates path (and any missing parents)
+        """
+        cmd = 'mkdir -p %s' % pipes.quote(path)
+        if mode is not None:
+            cmd += ' && chmod %o %s' % (mode, pipes.quote(path))
+        return self._add(cmd, cmd, ignore_exit_status)
+
+    def chown(self, uid, gid, remote_path, recursive=False):
+        """
+        Add a step that sets the user (uid) and group (gid) owner of
+        remote_path. uid/gid can be either names or integer ids.
+        """
+        opts = '-R ' if recursive else ''
+        cmd = 'chown %s%s:%s %s' % (opts, uid, gid, pipes.quote(remote_path))
+        return self._add(cmd, cmd)
+
+    def chmod(self, mode, remote_path):
+        """
+        Add a step that applies permissions (mode) to remote_path
+        """
+        cmd = 'chmod %o %s' % (mode, pipes.quote(remote_path))
+        return self._add(cmd, cmd)
+
+    def write_file(self, remote_path, contents, mode=None, uid=None,
+                   gid=None, append=False):
+        """
+        Add a step that writes (or appends) contents to remote_path and
+        optionally sets its permissions and ownership
+        """
+        path = pipes.quote(remote_path)
+        redirect = '>>' if append else '>'
+        eof = '__SC_EOF_%s' % self._token
+        cmd = "base64 -d %s %s <<'%s'" % (redirect, path, eof)
+        if mode is not None:
+            cmd += ' && chmod %o %s' % (mode, path)
+        if uid is not None and gid is not None:
+            cmd += ' && chown %s:%s %s' % (uid, gid, path)
+        payload = base64.encodestring(contents)
+        script = '%s\n%s%s' % (cmd, payload, eof)
+        label = "write %s" % remote_path
+        return self._add_write(remote_path, label, script)
+
+    def replace_lines(self, remote_path, lines, purge_regex=None, mode=None,
+                      uid=None, gid=None):
+        """
+        Add a step that removes every line of remote_path matching
+        purge_regex (an extended regex), appends lines and atomically
+        replaces remote_path with the result. The file is left untouched if
+        its contents would not change. The step outputs 'updated' or
+        'unchanged'.
+
+        The new file keeps the permissions/ownership of the old one unless
+        mode/uid/gid are given.
+        """
+        path = pipes.quote(remote_path)
+        tmp = pipes.quote(remote_path + '.sc-tmp')
+        eof = '__SC_EOF_%s' % self._token
+        purge = 'cat %s' % path
+        if purge_regex:
+            purge = 'grep -v -E %s %s' % (pipes.quote(purge_regex), path)
+        payload = base64.encodestring(''.join([l + '\n' for l in lines]))
+        script = '\n'.join([
+            "{ if [ -f %s ]; then %s; fi; base64 -d <<'%s'" % (path, purge,
+                                                               eof),
+            "%s%s" % (payload, eof),
+            "} > %s || exit 1" % tmp,
+            "if cmp -s %s %s; then rm -f %s; echo unchanged; exit 0; fi" %
+            (tmp, path, tmp),
+            "if [ -f %s ]; then chmod --reference=%s %s; "
+            "chown --reference=%s %s; fi" % (path, path, tmp, path, tmp)])
+        if mode is not None:
+            script += '\nchmod %o %s' % (mode, tmp)
+        if uid is not None and gid is not None:
+            script += '\nchown %s:%s %s' % (uid, gid, tmp)
+        script += '\nmv -f %s %s && echo updated' % (tmp, path)
+        label = "update %s" % remote_path
+        return self._add_write(remote_path, label, script)
+
+    def script(self):
+        """
+        Returns the bash script that will be run for this batch
+        """
+        lines = []
+        if self.source_profile:
+            # steps run in subshells of this script and inherit the profile
+            lines.append('source %s' % self.profile)
+        for i, (label, cmd, ignore) in enumerate(self._steps):
+            lines.append("echo '__SC_BEGIN_%s_%d'" % (self._token, i))
+            lines.append('(%s\n) 2>&1' % cmd)
+            lines.append('__sc_status=$?')
+            lines.append('echo "__SC_END_%s_%d $__sc_status"' %
+                         (self._token, i))
+            if not ignore:
+                lines.append('[ $__sc_status -eq 0 ] || exit $__sc_status')
+            if self.source_profile and i in self._reload_profile:
+                # pick up what this step added to the profile
+                lines.append('source %s' % self.profile)
+        return '\n'.join(lines) + '\n'
+
+    def _parse_output(self, output):
+        results = [BatchResult(label) for label, cmd, ign in self._steps]
+        begin = '__SC_BEGIN_%s_' % self._token
+        end = '__SC_END_%s_' % self._token
+        current = None
+        for line in output.splitlines():
+            if line.startswith(begin):
+                current = results[int(line[len(begin):])]
+            elif line.startswith(end):
+                status = line[len(end):].split()[1]
+                current.exit_status = int(status)
+                current = None
+            elif current is not None:
+                current.output.append(line.strip())
+        return results
+
+    def run(self, raise_on_failure=True, log_output=True):
+        """
+        Ships the batch to the remote host as a single script and returns a
+        list of BatchResult objects (one per step, in order). Steps that were
+        not run because an earlier step failed have exit_status=None.
+
+        raise_on_failure - raise exception.RemoteCommandFailed if a step
+                           fails and its exit status is not ignored
+        """
+        if not self._steps:
+            return []
+        ssh = self.ssh
+        channel = ssh._open_session()
+        try:
+            log.debug("executing batch of %d remote command(s) on %s" %
+                      (len(self._steps), ssh._host))
+            channel.exec_command('bash -s')
+            channel.sendall(self.script())
+            channel.shutdown_write()
+            stdout = channel.makefile('rb', -1).read()
+            stderr = channel.makefile_stderr('rb', -1).read()
+            channel.recv_exit_status()
+        finally:
+            ssh._release_channel()
+        results = self._parse_output(stdout)
+        for (label, cmd, ignore), res in zip(self._steps, results):
+            if res.skipped:
+                continue
+            out_str = '\n'.join(res.output)
+            if res.exit_status == 0 or ignore:
+                if log_output:
+                    log.debug("output of '%s' (status %d):\n%s" %
+                              (label, res.exit_status, out_str))
+                continue
+            msg = "remote command '%s' failed with status %d"
+            msg %= (label, res.exit_status)
+            if log_output:
+                msg += ":\n%s" % (out_str or stderr)
+            if raise_on_failure:
+                raise exception.RemoteCommandFailed(msg, label,
+                                                    res.exit_status, out_str)
+            log.error(msg)
+        return results
+
+
+class SSHConnectionPool(object):
+    """
+    Process-wide pool of SSH connections keyed by (host, port, user, key)
+
+    Node objects (and the threads working on them) each get their own
+    SSHClient but clients for the same remote host and user share a single
+    connection rather than each creating and negotiating their own
+    transport. Pooled connections send keepalives, bound the number of
+    concurrent channels per host, and transparently reconnect when their
+    transport goes stale.
+    """
+    def __init__(self, keepalive=30, max_channels=10, timeout=30):
+        self.keepalive = keepalive
+        self.max_channels = max_channels
+        self.timeout = timeout
+        self.hits = 0
+        self.misses = 0
+        self._connections = {}
+        self._lock = threading.Lock()
+
+    def get_connection(self, host, username=None, private_key=None, port=22):
+        """
+        Returns the pooled SSHConnection for host/port/username/private_key
+        creating it if necessary. A connection that no longer responds is
+        marked stale so that it is reconnected on next use rather than closed
+        under the clients that share it.
+        """
+        key = (host, port, username, private_key)
+        self._lock.acquire()
+        try:
+            conn = self._connections.get(key)
+            if conn is None:
+                self.misses += 1
+                conn = SSHConnection(max_channels=self.max_channels)
+                self._connections[key] = conn
+            else:
+                self.hits += 1
+                if conn.transport and not conn.is_healthy():
+                    log.debug("pooled connection to %s is stale" % host)
+                    conn.stale = True
+            return conn
+        finally:
+            self._lock.release()
+
+    def get(self, host, username=None, private_key=None, password=None,
+            port=22):
+        """
+        Returns a new SSHClient for host/port/username/private_key that uses
+        the pooled connection (see get_connection)
+        """
+        conn = self.get_connection(host, username=username,
+                                   private_key=private_key, port=port)
+        return SSHClient(host, username=username, password=password,
+                         private_key=private_key, port=port,
+                         timeout=self.timeout, keepalive=self.keepalive,
+                         connection=conn, pool=self)
+
+    def close(self, host=None):
+        """
+        Closes all pooled connections (or only those for host if specified)
+        """
+        self._lock.acquire()
+        try:
+            for key in self._connections.keys():
+                if host is None or key[0] == host:
+                    self._connections.pop(key).close()
+        finally:
+            self._lock.release()
+
+    @property
+    def reconnects(self):
+        self._lock.acquire()
+        try:
+            return sum([c.reconnects for c in self._connections.values()])
+        finally:
+            self._lock.release()
+
+    @property
+    def stats(self):
+        """
+        Returns a dictionary of pool counters useful for tuning
+        """
+        return dict(connections=len(self._connections), hits=self.hits,
+                    misses=self.misses, reconnects=self.reconnects)
+
+
+_connection_pool = None
+
+
+def get_connection_pool():
+    """
+    Returns the process-wide SSHConnectionPool
+    """
+    global _connection_pool
+    if _connection_pool is None:
+        _connection_pool = SSHConnectionPool()
+        atexit.register(_connection_pool.close)
+    return _connection_pool
+
+
 class SSHGlob(object):
 
     def __init__(self, ssh_client):
@@ -71,6 +71,7 @@ STARCLUSTER_CFG_DIR = os.path.join(os.path.expanduser('~'), '.starcluster')
 STARCLUSTER_CFG_FILE = os.path.join(STARCLUSTER_CFG_DIR, 'config')
 STARCLUSTER_PLUGIN_DIR = os.path.join(STARCLUSTER_CFG_DIR, 'plugins')
 STARCLUSTER_LOG_DIR = os.path.join(STARCLUSTER_CFG_DIR, 'logs')
+SPOT_HISTORY_DIR = os.path.join(STARCLUSTER_CFG_DIR, 'spothistory')
 STARCLUSTER_RECEIPT_DIR = "/var/run/starcluster"
 STARCLUSTER_RECEIPT_FILE = os.path.join(STARCLUSTER_RECEIPT_DIR, "receipt.pkl")
 STARCLUSTER_OWNER_ID = 342652561657
@@ -79,6 +80,8 @@ DEBUG_FILE = os.path.join(STARCLUSTER_LOG_DIR, 'debug.log')
 SSH_DEBUG_FILE = os.path.join(STARCLUSTER_LOG_DIR, 'ssh-debug.log')
 AWS_DEBUG_FILE = os.path.join(STARCLUSTER_LOG_DIR, 'aws-debug.log')
 CRASH_FILE = os.path.join(STARCLUSTER_LOG_DIR, 'crash-report-%d.txt' % PID)
+COMPLETION_CACHE_FILE = os.path.join(STARCLUSTER_CFG_DIR,
+                                     'completion-cache.json')
 
 # StarCluster BASE AMIs (us-east-1)
 BASE_AMI_32 = "ami-9bf9c9f2"
@@ -95,15 +98,26 @@ VERSION_TAG = SECURITY_GROUP_PREFIX + 'version'
 CORE_TAG = SECURITY_GROUP_PREFIX + 'core'
 USER_TAG = SECURITY_GROUP_PREFIX + 'user'
 MAX_TAG_LEN = 255
+# EC2 API limits for CreateTags/DeleteTags/DescribeTags requests
+MAX_TAG_RESOURCES = 1000
+MAX_TAGS_PER_RESOURCE = 50
+MAX_FILTER_VALUES = 200
+# max number of instances requested by a single RequestSpotInstances call
+MAX_SPOT_REQUEST_COUNT = 100
+# prefix of the tags recording the ordered spot request ids of a batch
+SPOT_BATCH_TAG = 'alias-batch'
 
 # Internal StarCluster userdata filenames
 UD_PLUGINS_FNAME = "_sc_plugins.txt"
 UD_VOLUMES_FNAME = "_sc_volumes.txt"
 UD_ALIASES_FNAME = "_sc_aliases.txt"
+# EC2 limit on the size of an instance's raw (not base64-encoded) user data
+MAX_USERDATA_SIZE = 16 * 1024
 
 INSTANCE_METADATA_URI = "http://169.254.169.254/latest"
 INSTANCE_STATES = ['pending', 'running', 'shutting-down',
                    'terminated', 'stopping', 'stopped']
+TRANSITIONAL_INSTANCE_STATES = ['pending', 'stopping', 'shutting-down']
 VOLUME_STATUS = ['creating', 'available', 'in-use',
                  'deleting', 'deleted', 'error']
 VOLUME_ATTACH_STATUS = ['attaching', 'attached', 'detaching', 'detached']
@@ -317,4 +331,8 @@ CLUSTER_SETTINGS = {
     'force_spot_master': (bool, False, False, None, None),
     'disable_cloudinit': (bool, False, False, None, None),
     'dns_prefix': (bool, False, False, None, None),
+    'pipelined_start': (bool, False, False, None, None),
+    'min_nodes': (int, False, None, None, None),
+    'min_start_fraction': (float, False, None, None, None),
+    'node_cache_ttl': (int, False, 30, None, None),
 }
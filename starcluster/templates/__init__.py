@@ -15,9 +15,6 @@
 # You should have received a copy of the GNU Lesser General Public License
 # along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
 
-import jinja2
-import pkg_resources
-
 __all__ = [
     'config',
     'sge',
@@ -25,23 +22,35 @@ __all__ = [
     'user_msgs',
 ]
 
-_web_tmpl_loader = jinja2.Environment(loader=jinja2.PrefixLoader({
-    'web': jinja2.PackageLoader('starcluster.templates', 'web'),
-}))
+# jinja2 and pkg_resources are slow to import and only a few commands render
+# templates so both are imported on first use rather than at startup
+_loaders = {}
+
+
+def _get_loader(name):
+    if name not in _loaders:
+        import jinja2
+        if name == 'web':
+            loader = jinja2.PrefixLoader({
+                'web': jinja2.PackageLoader('starcluster.templates', 'web'),
+            })
+        else:
+            loader = jinja2.PackageLoader('starcluster', 'templates')
+        _loaders[name] = jinja2.Environment(loader=loader)
+    return _loaders[name]
 
-get_web_template = _web_tmpl_loader.get_template
 
-_tmpl_loader = jinja2.Environment(
-    loader=jinja2.PackageLoader('starcluster', 'templates'))
+def get_web_template(name, *args, **kwargs):
+    return _get_loader('web').get_template(name, *args, **kwargs)
 
-get_template = _tmpl_loader.get_template
+
+def get_template(name, *args, **kwargs):
+    return _get_loader('default').get_template(name, *args, **kwargs)
 
 
 def get_resource(pkg_data_path, stream=True):
+    import pkg_resources
     pkg_res_meth = pkg_resources.resource_filename
     if stream:
         pkg_res_meth = pkg_resources.resource_stream
     return pkg_res_meth('starcluster.templates', pkg_data_path)
-
-
-TemplateNotFound = jinja2.TemplateNotFound
@@ -0,0 +1,237 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+import boto.ec2
+
+from starcluster import static
+from starcluster import awsutils
+from starcluster import exception
+from starcluster import ratelimit
+
+
+class FakeTag(object):
+    def __init__(self, res_id, name, value):
+        self.res_id = res_id
+        self.name = name
+        self.value = value
+
+
+class FakeResource(object):
+    def __init__(self, id, tags=None):
+        self.id = id
+        self.tags = tags or {}
+
+
+class FakeTagConnection(object):
+    def __init__(self, tags=None):
+        self.tags = tags or []
+        self.calls = []
+
+    def create_tags(self, resource_ids, tags):
+        self.calls.append(('create', resource_ids, tags))
+
+    def delete_tags(self, resource_ids, tags):
+        self.calls.append(('delete', resource_ids, tags))
+
+    def get_all_tags(self, filters=None):
+        ids = filters['resource-id']
+        self.calls.append(('describe', ids))
+        return [t for t in self.tags if t.res_id in ids]
+
+
+def test_tag_batch_coalesces_requests():
+    conn = FakeTagConnection()
+    ec2 = awsutils.EasyEC2('id', 'secret', connection=conn)
+    r1, r2 = FakeResource('i-1'), FakeResource('i-2', {'old': 'x'})
+    with ec2.tag_batch():
+        ec2.add_tags(r1, {'cluster': 'mycl', 'alias': 'master'})
+        with ec2.tag_batch():
+            ec2.add_tags(r2, {'cluster': 'mycl'})
+        ec2.remove_tags(r2, ['old'])
+        ec2.add_tags('vol-1', {'tmp': '1'})
+        ec2.remove_tags('vol-1', ['tmp'])
+        # nothing is sent until the outermost block exits
+        assert conn.calls == []
+        assert r1.tags == {'cluster': 'mycl', 'alias': 'master'}
+        assert r2.tags == {'cluster': 'mycl'}
+    assert conn.calls == [
+        ('delete', ['i-2'], {'old': None}),
+        ('delete', ['vol-1'], {'tmp': None}),
+        ('create', ['i-1'], {'alias': 'master'}),
+        ('create', ['i-1', 'i-2'], {'cluster': 'mycl'})]
+    # outside of a batch tags are written immediately
+    ec2.add_tags(r1, {'Name': 'master'})
+    assert conn.calls[-1] == ('create', ['i-1'], {'Name': 'master'})
+    assert ec2.flush_tags() == 0
+
+
+def test_failed_tag_flush_keeps_tags_queued():
+    conn = FakeTagConnection()
+    ec2 = awsutils.EasyEC2('id', 'secret', connection=conn)
+    create_tags = conn.create_tags
+
+    def fail_once(resource_ids, tags):
+        conn.create_tags = create_tags
+        raise boto.exception.EC2ResponseError(400, 'Bad Request')
+    conn.create_tags = fail_once
+    try:
+        with ec2.tag_batch():
+            ec2.add_tags('i-1', {'alias': 'master'})
+            ec2.add_tags('i-2', {'alias': 'node001'})
+        assert False, "expected EC2ResponseError"
+    except boto.exception.EC2ResponseError:
+        pass
+    assert conn.calls == []
+    # newer mutations of the same tag win over the re-queued ones
+    with ec2.tag_batch():
+        ec2.add_tags('i-2', {'alias': 'node002'})
+    assert sorted(conn.calls) == [('create', ['i-1'], {'alias': 'master'}),
+                                  ('create', ['i-2'], {'alias': 'node002'})]
+    assert ec2.flush_tags() == 0
+
+
+def test_tag_batch_respects_api_limits(monkeypatch):
+    monkeypatch.setattr(static, 'MAX_TAG_RESOURCES', 2)
+    monkeypatch.setattr(static, 'MAX_TAGS_PER_RESOURCE', 2)
+    conn = FakeTagConnection()
+    ec2 = awsutils.EasyEC2('id', 'secret', connection=conn)
+    with ec2.tag_batch():
+        for i in range(3):
+            ec2.add_tags('i-%d' % i, {'a': '1', 'b': '2', 'c': '3'})
+    assert conn.calls == [
+        ('create', ['i-0', 'i-1'], {'a': '1', 'b': '2'}),
+        ('create', ['i-0', 'i-1'], {'c': '3'}),
+        ('create', ['i-2'], {'a': '1', 'b': '2'}),
+        ('create', ['i-2'], {'c': '3'})]
+
+
+def test_tag_cache():
+    conn = FakeTagConnection([FakeTag('sg-1', 'a', '1'),
+                              FakeTag('sg-2', 'b', '2')])
+    ec2 = awsutils.EasyEC2('id', 'secret', connection=conn)
+    sg = FakeResource('sg-3', {'c': '3'})
+    # tags that came with the object don't need a DescribeTags request
+    assert ec2.get_tags(sg) == {'c': '3'}
+    tags = ec2.get_all_tags(['sg-1', 'sg-2', 'sg-3', 'sg-4'])
+    assert tags == {'sg-1': {'a': '1'}, 'sg-2': {'b': '2'},
+                    'sg-3': {'c': '3'}, 'sg-4': {}}
+    assert conn.calls == [('describe', ['sg-1', 'sg-2', 'sg-4'])]
+    assert ec2.get_tags('sg-1') == {'a': '1'}
+    assert len(conn.calls) == 1
+    ec2.add_tags('sg-1', {'d': '4'})
+    assert ec2.get_tags('sg-1') == {'a': '1', 'd': '4'}
+    assert ec2.get_tags('sg-1', refresh=True) == {'a': '1'}
+
+
+class FakeImage(object):
+    root_device_type = 'ebs'
+    root_device_name = '/dev/sda1'
+
+    def __init__(self, id, states):
+        self.id = id
+        self.states = states
+        self.state = None
+        self.state_reason = {'message': 'copy aborted'}
+        root = type('Root', (), {'snapshot_id': 'snap-' + id})
+        self.block_device_mapping = {'/dev/sda1': root}
+
+
+class FakeSnapshot(object):
+    def __init__(self, progress):
+        self.progress = progress
+
+
+class FakeRegionEC2(object):
+    """Replays a sequence of image states, one per DescribeImages call"""
+    def __init__(self, image):
+        self.image = image
+        self.calls = 0
+
+    def get_image_or_none(self, image_id):
+        self.calls += 1
+        state = self.image.states.pop(0)
+        if state is None:
+            return None
+        self.image.state = state
+        return self.image
+
+    def get_snapshots(self, filters=None):
+        return [FakeSnapshot('%d%%' % (100 - 25 * len(self.image.states)))]
+
+
+def test_image_copy_tracker():
+    now = [0]
+    sleeps = []
+
+    def sleep(secs):
+        sleeps.append(secs)
+        now[0] += secs
+    tracker = awsutils.ImageCopyTracker(interval=30, min_interval=5,
+                                        clock=lambda: now[0], sleep=sleep)
+    fast = FakeRegionEC2(FakeImage('ami-1', [None, 'available']))
+    slow = FakeRegionEC2(FakeImage('ami-2', ['pending', 'pending', 'pending',
+                                             'available']))
+    broken = FakeRegionEC2(FakeImage('ami-3', ['pending', 'failed']))
+    tracker.add('us-west-1', fast, 'ami-1')
+    tracker.add('us-west-2', slow, 'ami-2')
+    tracker.add('eu-west-1', broken, 'ami-3')
+    assert tracker.wait() == ['eu-west-1']
+    # all regions are polled in the same passes and done regions drop out
+    assert len(sleeps) == 3
+    assert (fast.calls, slow.calls, broken.calls) == (2, 4, 2)
+    # the interval tightens as the copies progress
+    assert sleeps[-1] < sleeps[0]
+    elapsed = dict([(r, c['elapsed']) for r, c in tracker.copies.items()])
+    assert elapsed['us-west-1'] == elapsed['eu-west-1'] == sleeps[0]
+    assert elapsed['us-west-2'] == sum(sleeps)
+    assert tracker.copies['us-west-2']['state'] == 'available'
+    tracker.log_summary()
+
+
+def test_for_region_leaves_original_untouched():
+    conn = FakeTagConnection()
+    ec2 = awsutils.EasyEC2('id', 'secret', connection=conn)
+    region = boto.ec2.regioninfo.RegionInfo(name='eu-west-1',
+                                            endpoint='ec2.example.com')
+    ec2._regions = {'eu-west-1': region}
+    other = ec2.for_region('eu-west-1')
+    assert other is not ec2
+    assert other._kwargs['region'] is region
+    assert 'region' not in ec2._kwargs or ec2._kwargs['region'] is None
+    assert ec2.conn is conn
+    assert other.s3 is ec2.s3
+
+
+def test_propagation_wait_is_bounded_by_time(monkeypatch):
+    slept = []
+    poll_cls = ratelimit.PollInterval
+
+    class FakePoll(poll_cls):
+        def __init__(self, interval):
+            poll_cls.__init__(self, interval, jitter=0, sleep=slept.append)
+    monkeypatch.setattr(ratelimit, 'PollInterval', FakePoll)
+    ids = ['i-%d' % i for i in range(60)]
+    visible = [FakeResource(i) for i in ids[:-1]]
+    ec2 = awsutils.EasyEC2('id', 'secret', connection=FakeTagConnection())
+    try:
+        ec2._wait_for_propagation(ids, lambda filters: visible,
+                                  'instance-id', 'instances')
+        assert False, "expected PropagationException"
+    except exception.PropagationException:
+        pass
+    # 59/60 visible shortens every sleep but not the overall budget
+    assert 300 <= sum(slept) < 305
+    assert max(slept) < 5
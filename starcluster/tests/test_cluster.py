@@ -0,0 +1,570 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+import base64
+import datetime
+import threading
+
+import pytest
+
+from starcluster import utils
+from starcluster import awsutils
+from starcluster import static
+from starcluster import exception
+from starcluster import userdata
+from starcluster import ratelimit
+from starcluster import clustersetup
+from starcluster.node import Node, get_spot_batch_ids, get_spot_batch_tags
+from starcluster.cluster import Cluster, ClusterManager
+
+
+class FakeConnection(object):
+    aws_access_key_id = 'id'
+    aws_secret_access_key = 'secret'
+
+
+class FakeInstance(object):
+    connection = FakeConnection()
+    dns_name = 'ec2.example.com'
+    spot_instance_request_id = None
+
+    def __init__(self, id, alias, state='running', launch_time=None):
+        self.id = id
+        self.state = state
+        self.tags = {'alias': alias, 'Name': alias}
+        self.launch_time = launch_time or utils.get_utc_now(iso=True)
+
+
+class FakeEC2(object):
+    def __init__(self, instances):
+        self.instances = instances
+        self.calls = []
+
+    def get_all_instances(self, filters={}):
+        self.calls.append(filters)
+        ids = filters.get('instance-id')
+        states = filters.get('instance-state-name', static.INSTANCE_STATES)
+        return [FakeInstance(i.id, i.tags['alias'], i.state, i.launch_time)
+                for i in self.instances if i.state in states and
+                (ids is None or i.id in ids)]
+
+
+def test_node_cache():
+    instances = [FakeInstance('i-1', 'master'),
+                 FakeInstance('i-2', 'node001', state='pending')]
+    ec2 = FakeEC2(instances)
+    cl = Cluster(ec2_conn=ec2, cluster_tag='test', node_cache_ttl=60)
+    assert [n.alias for n in cl.nodes] == ['master', 'node001']
+    assert len(ec2.calls) == 1
+    # only the pending node should be re-described
+    instances[1].state = 'running'
+    assert [n.state for n in cl.nodes] == ['running', 'running']
+    assert ec2.calls[-1] == {'instance-id': ['i-2']}
+    # no transitional nodes left - served entirely from cache
+    cl.nodes
+    assert len(ec2.calls) == 2
+    cl.invalidate_nodes()
+    cl.nodes
+    assert len(ec2.calls) == 3
+    assert cl.node_cache_stats == dict(full_refreshes=2, delta_refreshes=1,
+                                       api_calls_saved=1)
+
+
+def test_node_cache_refresh_is_locked(monkeypatch):
+    instances = [FakeInstance('i-1', 'master'),
+                 FakeInstance('i-2', 'node001')]
+    cl = Cluster(ec2_conn=FakeEC2(instances), cluster_tag='test')
+    nodes = cl.nodes
+    assert nodes is not cl.nodes
+    seen = []
+    reader = threading.Thread(
+        target=lambda: seen.append([n.alias for n in cl.nodes]))
+
+    def resolve_aliases(new_nodes):
+        # a reader must wait for the refresh rather than see a partially
+        # updated node list
+        reader.start()
+        reader.join(0.2)
+        assert reader.is_alive()
+    monkeypatch.setattr(cl, '_resolve_aliases', resolve_aliases)
+    instances.append(FakeInstance('i-3', 'node002'))
+    cl.invalidate_nodes()
+    cl.nodes
+    reader.join()
+    assert seen == [['master', 'node001', 'node002']]
+
+
+def test_node_cache_disabled():
+    ec2 = FakeEC2([FakeInstance('i-1', 'master')])
+    cl = Cluster(ec2_conn=ec2, cluster_tag='test', node_cache_ttl=0)
+    cl.nodes
+    cl.nodes
+    assert len(ec2.calls) == 2
+
+
+class LegacyPlugin(clustersetup.ClusterSetup):
+    def __init__(self):
+        self.added = []
+
+    def on_add_node(self, node, nodes, master, user, user_shell, volumes):
+        self.added.append([node.alias])
+
+
+class LegacyDefaultPlugin(clustersetup.DefaultClusterSetup):
+    def __init__(self):
+        super(LegacyDefaultPlugin, self).__init__()
+        self.added = []
+
+    def on_add_node(self, node, nodes, master, user, user_shell, volumes):
+        self.added.append([node.alias])
+
+
+class BatchedPlugin(LegacyPlugin):
+    def on_add_nodes(self, new_nodes, nodes, master, user, user_shell,
+                     volumes):
+        self.added.append([n.alias for n in new_nodes])
+
+
+class PlainPlugin(object):
+    def __init__(self):
+        self.added = []
+
+    def on_add_node(self, node, nodes, master, user, user_shell, volumes):
+        self.added.append([node.alias])
+
+
+def test_batched_plugin_hooks():
+    ec2 = FakeEC2([FakeInstance('i-1', 'master'),
+                   FakeInstance('i-2', 'node001'),
+                   FakeInstance('i-3', 'node002')])
+    cl = Cluster(ec2_conn=ec2, cluster_tag='test', node_cache_ttl=60)
+    new_nodes = cl.nodes[1:]
+    for klass, expected in [
+            (LegacyPlugin, [['node001'], ['node002']]),
+            (LegacyDefaultPlugin, [['node001'], ['node002']]),
+            (PlainPlugin, [['node001'], ['node002']]),
+            (BatchedPlugin, [['node001', 'node002']])]:
+        plugin = klass()
+        cl.run_plugin(plugin, method_name='on_add_nodes', node=new_nodes)
+        assert plugin.added == expected, klass
+    assert LegacyDefaultPlugin()._uses_legacy_hook(
+        clustersetup.DefaultClusterSetup, 'on_add_node')
+    assert not clustersetup.DefaultClusterSetup()._uses_legacy_hook(
+        clustersetup.DefaultClusterSetup, 'on_add_node')
+
+
+class FakeGroup(object):
+    def __init__(self, id, name):
+        self.id = id
+        self.name = name
+
+
+class FakeSpotRequest(object):
+    def __init__(self, id, state, groups):
+        self.id = id
+        self.state = state
+        self.launch_specification = type('FakeLaunchSpec', (object,),
+                                         dict(groups=groups))()
+
+
+def test_bulk_cluster_instances():
+    g1 = FakeGroup('sg-1', static.SECURITY_GROUP_TEMPLATE % 'one')
+    g2 = FakeGroup('sg-2', static.SECURITY_GROUP_TEMPLATE % 'two')
+    other = FakeGroup('sg-3', 'default')
+    instances = [FakeInstance('i-1', 'master'), FakeInstance('i-2', 'master'),
+                 FakeInstance('i-3', 'node001')]
+    for inst, groups in zip(instances, [[g1], [g2, other], [g2]]):
+        inst.groups = groups
+
+    class BulkEC2(FakeEC2):
+        def get_all_spot_requests(self, filters=None):
+            self.calls.append(filters)
+            return [FakeSpotRequest('sir-1', 'open', [g2]),
+                    FakeSpotRequest('sir-2', 'open', [other])]
+
+        def get_all_instances(self, filters={}):
+            self.calls.append(filters)
+            return self.instances
+    ec2 = BulkEC2(instances)
+    cm = ClusterManager(None, ec2=ec2)
+    insts, spots = cm._get_instances_by_group([g1, g2], list_all=True)
+    assert len(ec2.calls) == 2
+    assert ec2.calls[0]['instance.group-name'] == \
+        static.SECURITY_GROUP_TEMPLATE % '*'
+    assert [i.id for i in insts[g1.name]] == ['i-1']
+    assert [i.id for i in insts[g2.name]] == ['i-2', 'i-3']
+    assert [r.id for r in spots[g2.name]] == ['sir-1']
+    assert spots[g1.name] == []
+    cl = Cluster(ec2_conn=ec2, cluster_tag='two', cluster_group=g2)
+    cl.prime_node_cache(insts[g2.name])
+    assert [n.alias for n in cl.nodes] == ['master', 'node001']
+    # nodes were served from the primed cache
+    assert len(ec2.calls) == 2
+
+
+def test_bulk_alias_resolution():
+    aliases = ['master', 'node001', 'node002']
+    alias_file = utils.string_to_file('\n'.join(['#ignored'] + aliases),
+                                      static.UD_ALIASES_FNAME)
+    udata = userdata.bundle_userdata_files([alias_file])
+
+    class UserDataConnection(FakeConnection):
+        fetched = []
+
+        def get_instance_attribute(self, instance_id, attribute):
+            self.fetched.append(instance_id)
+            return {'userData': base64.b64encode(udata)}
+
+        def create_tags(self, resource_ids, tags):
+            self.fetched.append((resource_ids, tags))
+
+    conn = UserDataConnection()
+
+    class TaggingEC2(FakeEC2):
+        easy_ec2 = awsutils.EasyEC2('id', 'secret', connection=conn)
+
+        def __getattr__(self, name):
+            return getattr(self.easy_ec2, name)
+
+    instances = []
+    for i, alias in enumerate(aliases):
+        inst = FakeInstance('i-%d' % i, alias)
+        inst.connection = conn
+        inst.reservation_id = 'r-1'
+        inst.ami_launch_index = str(i)
+        inst.tags = {}
+        instances.append(inst)
+    instances[0].tags['Name'] = 'custom'
+    ec2 = TaggingEC2(instances)
+    cl = Cluster(ec2_conn=ec2, cluster_tag='test')
+    cl.prime_node_cache(instances[::-1])
+    assert [n.alias for n in cl.nodes] == aliases
+    # one user data fetch for the whole reservation
+    assert conn.fetched[0] == 'i-2'
+    assert sorted(conn.fetched[1:]) == [
+        (['i-0'], {'alias': 'master'}),
+        (['i-1'], {'alias': 'node001', 'Name': 'node001'}),
+        (['i-2'], {'alias': 'node002', 'Name': 'node002'})]
+    assert instances[0].tags == {'alias': 'master', 'Name': 'custom'}
+
+
+class FakeTag(object):
+    def __init__(self, res_id, name, value):
+        self.res_id = res_id
+        self.name = name
+        self.value = value
+
+
+def test_spot_batch_aliases(monkeypatch):
+    aliases = ['node%03d' % i for i in range(1, 6)]
+    udata = {}
+    for chunk, ids in [(aliases[:3], 'ebd'), (aliases[3:], 'ac')]:
+        alias_file = utils.string_to_file('\n'.join(['#ignored'] + chunk),
+                                          static.UD_ALIASES_FNAME)
+        bundled = userdata.bundle_userdata_files([alias_file])
+        for i in ids:
+            udata['i-' + i] = bundled
+    spot_ids = ['sir-e', 'sir-b', 'sir-d', 'sir-a', 'sir-c']
+
+    class SpotConnection(FakeConnection):
+        calls = []
+        tags = []
+
+        def request_spot_instances(self, **kwargs):
+            self.calls.append(('request', kwargs['count']))
+            ids = spot_ids[:kwargs['count']]
+            del spot_ids[:kwargs['count']]
+            return [FakeSpotRequest(i, 'open', []) for i in ids]
+
+        def create_tags(self, resource_ids, tags):
+            self.calls.append(('tag', len(resource_ids)))
+            for rid in resource_ids:
+                for k, v in tags.items():
+                    self.tags.append(FakeTag(rid, k, v))
+
+        def get_all_tags(self, filters=None):
+            ids = filters['resource-id']
+            self.calls.append(('describe_tags', len(ids)))
+            return [t for t in self.tags if t.res_id in ids]
+
+        def get_instance_attribute(self, instance_id, attribute):
+            self.calls.append(('user_data', instance_id))
+            return {'userData': base64.b64encode(udata[instance_id])}
+
+    conn = SpotConnection()
+
+    class SpotEC2(FakeEC2):
+        easy_ec2 = awsutils.EasyEC2('id', 'secret', connection=conn)
+
+        def __getattr__(self, name):
+            return getattr(self.easy_ec2, name)
+
+        def request_instances(self, image_id, **kwargs):
+            return self.easy_ec2.request_spot_instances(
+                kwargs['price'], image_id, count=kwargs['count'])
+
+        def wait_for_propagation(self, **kwargs):
+            pass
+
+    monkeypatch.setattr(static, 'MAX_SPOT_REQUEST_COUNT', 3)
+    ec2 = SpotEC2([])
+    cl = Cluster(ec2_conn=ec2, cluster_tag='test', spot_bid=0.5,
+                 node_image_id='ami-1', node_instance_type='m1.small')
+    cl._cluster_group = FakeGroup('sg-1', 'test')
+    cl._zone = FakeGroup('us-east-1a', 'us-east-1a')
+    reqs = cl.create_nodes(aliases)
+    assert len(reqs) == 5
+    # two requests of 3 and 2 instances, each batch tagged in one call
+    assert conn.calls == [('request', 3), ('request', 2), ('tag', 2),
+                          ('tag', 3)]
+    instances = []
+    for req in reqs:
+        if req.id == 'sir-d':
+            # cancelled requests don't affect their siblings' aliases
+            continue
+        inst = FakeInstance('i-' + req.id[-1], None)
+        inst.connection = conn
+        inst.spot_instance_request_id = req.id
+        inst.reservation_id = 'r-' + req.id
+        inst.ami_launch_index = '0'
+        inst.tags = {}
+        instances.append(inst)
+    conn.calls = []
+    # start from an empty tag cache as a later 'starcluster' run would
+    ec2.easy_ec2 = awsutils.EasyEC2('id', 'secret', connection=conn)
+    cl.prime_node_cache(instances)
+    # requests are matched to the batch's aliases in order of request id
+    assert dict([(n.spot_id, n.alias) for n in cl.nodes]) == {
+        'sir-b': 'node001', 'sir-e': 'node003', 'sir-a': 'node004',
+        'sir-c': 'node005'}
+    # one tag lookup for all nodes plus one user data fetch per batch
+    assert sorted([c[0] for c in conn.calls if c[0] != 'tag']) == [
+        'describe_tags', 'user_data', 'user_data']
+
+
+def test_untagged_spot_batch_aliases():
+    alias_file = utils.string_to_file('#ignored\nnode001\nnode002',
+                                      static.UD_ALIASES_FNAME)
+    udata = userdata.bundle_userdata_files([alias_file])
+
+    class SpotConnection(FakeConnection):
+        tags = []
+
+        def get_all_tags(self, filters=None):
+            return []
+
+        def create_tags(self, resource_ids, tags):
+            self.tags.extend(resource_ids)
+
+        def get_instance_attribute(self, instance_id, attribute):
+            return {'userData': base64.b64encode(udata)}
+
+    conn = SpotConnection()
+
+    class SpotEC2(FakeEC2):
+        easy_ec2 = awsutils.EasyEC2('id', 'secret', connection=conn)
+
+        def __getattr__(self, name):
+            return getattr(self.easy_ec2, name)
+
+    cl = Cluster(ec2_conn=SpotEC2([]), cluster_tag='test')
+    nodes = []
+    for i in ['1', '2']:
+        inst = FakeInstance('i-' + i, None)
+        inst.connection = conn
+        inst.spot_instance_request_id = 'sir-' + i
+        inst.reservation_id = 'r-1'
+        inst.ami_launch_index = '0'
+        inst.tags = {}
+        nodes.append(Node(inst, cl.key_location))
+    cl._resolve_aliases(nodes)
+    # without the batch's request order the aliases can't be matched so the
+    # instances must not all be tagged with the batch's first alias
+    assert conn.tags == []
+    assert [n._alias for n in nodes] == [None, None]
+
+
+def test_spot_batches_tagged_on_failure(monkeypatch):
+    class SpotEC2(FakeEC2):
+        def request_instances(self, image_id, **kwargs):
+            if self.calls:
+                raise exception.BaseException('MaxSpotInstanceCountExceeded')
+            self.calls.append(kwargs['count'])
+            return [FakeSpotRequest('sir-%d' % i, 'open', [])
+                    for i in range(kwargs['count'])]
+
+    monkeypatch.setattr(static, 'MAX_SPOT_REQUEST_COUNT', 3)
+    cl = Cluster(ec2_conn=SpotEC2([]), cluster_tag='test', spot_bid=0.5,
+                 node_image_id='ami-1', node_instance_type='m1.small')
+    cl._cluster_group = FakeGroup('sg-1', 'test')
+    cl._zone = FakeGroup('us-east-1a', 'us-east-1a')
+    tagged = []
+    monkeypatch.setattr(cl, '_tag_spot_batches', tagged.extend)
+    with pytest.raises(exception.BaseException):
+        cl.create_nodes(['node%03d' % i for i in range(1, 6)])
+    # the batch requested before the failure is still tagged
+    assert [[r.id for r in reqs] for reqs in tagged] == [
+        ['sir-0', 'sir-1', 'sir-2']]
+
+
+def test_spot_batch_tags():
+    ids = ['sir-%08d' % i for i in range(100)]
+    tags = get_spot_batch_tags(reversed(ids))
+    assert len(tags) > 1
+    assert max([len(v) for v in tags.values()]) <= static.MAX_TAG_LEN
+    assert get_spot_batch_ids(tags) == ids
+    assert get_spot_batch_ids({'alias': 'node001'}) == []
+
+
+def _get_pipelined_cluster(monkeypatch, **kwargs):
+    instances = [FakeInstance('i-1', 'master'),
+                 FakeInstance('i-2', 'node001'),
+                 FakeInstance('i-3', 'node002')]
+    up_after = dict(master=2, node001=1, node002=3)
+    rounds = [1]
+
+    class SpotEC2(FakeEC2):
+        def get_all_spot_requests(self, filters=None):
+            return []
+
+    def next_round(self, done=0, total=1):
+        rounds[0] += 1
+
+    monkeypatch.setattr(ratelimit.PollInterval, 'sleep', next_round)
+    monkeypatch.setattr(Node, 'is_ssh_up',
+                        lambda n: rounds[0] >= up_after[n.alias])
+    cl = Cluster(ec2_conn=SpotEC2(instances), cluster_tag='test',
+                 disable_queue=True, **kwargs)
+    cl._cluster_group = FakeGroup('sg-1', 'test')
+    cl._cluster_group.vpc_id = None
+    cl.plugins = [LegacyPlugin()]
+    calls = []
+
+    def run_plugin(plugin, method_name='run', node=None, nodes=None):
+        calls.append((plugin.__class__.__name__, method_name,
+                      [n.alias for n in node or []],
+                      [n.alias for n in nodes]))
+    monkeypatch.setattr(cl, 'run_plugin', run_plugin)
+    return cl, calls
+
+
+def test_pipelined_setup(monkeypatch):
+    cl, calls = _get_pipelined_cluster(monkeypatch, pipelined_start=True)
+    cl.setup_cluster()
+    assert calls == [
+        ('DefaultClusterSetup', 'run', [], ['master', 'node001']),
+        ('DefaultClusterSetup', 'on_add_nodes', ['node002'],
+         ['master', 'node001', 'node002']),
+        ('LegacyPlugin', 'run', [], ['master', 'node001', 'node002'])]
+    assert not cl.is_backfilling
+
+
+def test_partial_capacity_start(monkeypatch):
+    cl, calls = _get_pipelined_cluster(monkeypatch, min_start_fraction=0.5)
+    assert cl._get_min_nodes(3) == 2
+    cl.min_nodes = 3
+    assert cl._get_min_nodes(3) == 3
+    cl.min_nodes = 5
+    assert cl._get_min_nodes(3) == 3
+    cl.min_nodes = None
+    cl.setup_cluster()
+    cl.wait_for_backfill()
+    assert calls == [
+        ('DefaultClusterSetup', 'run', [], ['master', 'node001']),
+        ('LegacyPlugin', 'run', [], ['master', 'node001']),
+        ('DefaultClusterSetup', 'on_add_nodes', ['node002'],
+         ['master', 'node001', 'node002']),
+        ('LegacyPlugin', 'on_add_nodes', ['node002'],
+         ['master', 'node001', 'node002'])]
+    assert not cl.is_backfilling
+
+
+def test_pending_nodes_timed_from_launch(monkeypatch):
+    cl, calls = _get_pipelined_cluster(monkeypatch, pipelined_start=True)
+    instances = cl.ec2.instances
+    long_ago = utils.get_utc_now() - datetime.timedelta(minutes=20)
+    # node001 has been pending for too long, node002 was only just fulfilled
+    # (e.g. a late spot request) long after setup started
+    instances[1].state = 'pending'
+    instances[1].launch_time = utils.datetime_tuple_to_iso(long_ago)
+    instances[2].state = 'pending'
+    terminated = []
+
+    def terminate(node):
+        terminated.append(node.alias)
+        instances[1].state = 'shutting-down'
+    monkeypatch.setattr(Node, 'terminate', terminate)
+    monkeypatch.setattr(Node, 'is_ssh_up', lambda n: True)
+
+    def next_round(self, done=0, total=1):
+        instances[2].state = 'running'
+        cl.invalidate_nodes()
+    monkeypatch.setattr(ratelimit.PollInterval, 'sleep', next_round)
+    batches = [([n.alias for n in nodes], total)
+               for nodes, total in cl._iter_ready_nodes(3)]
+    assert terminated == ['node001']
+    assert batches == [(['master'], 2), (['node002'], 2)]
+
+
+def test_pipelined_setup_without_master(monkeypatch):
+    cl, calls = _get_pipelined_cluster(monkeypatch, min_start_fraction=0.5)
+    master = cl.ec2.instances[0]
+    master.state = 'pending'
+    master.launch_time = utils.datetime_tuple_to_iso(
+        utils.get_utc_now() - datetime.timedelta(minutes=20))
+
+    def terminate(node):
+        master.state = 'shutting-down'
+    monkeypatch.setattr(Node, 'terminate', terminate)
+    with pytest.raises(exception.BaseException):
+        cl.setup_cluster()
+    assert calls == []
+    assert not cl.is_backfilling
+
+
+class FakeIdentitySSH(object):
+    def __init__(self):
+        self.passwd = ['root:x:0:0:root:/root:/bin/bash']
+        self.group = ['root:x:0:', 'utmp:x:43:']
+        self.commands = []
+
+    def execute(self, command, **kwargs):
+        self.commands.append(command)
+        if command.startswith('cat /etc/passwd'):
+            return self.passwd + ['#starcluster-etc-group#'] + self.group
+        if command.startswith('useradd'):
+            self.passwd.append('sgeadmin:x:1000:1000::/home/sgeadmin:/bin/sh')
+        return []
+
+
+def test_identity_cache():
+    node = Node(FakeInstance('i-1', 'master'), '/dev/null', alias='master')
+    ssh = node._ssh = FakeIdentitySSH()
+    assert node.getpwnam('root').pw_uid == 0
+    assert node.getpwuid(0).pw_dir == '/root'
+    assert node.getgrnam('utmp').gr_gid == 43
+    assert node.getgrgid(0).gr_name == 'root'
+    assert len(ssh.commands) == 1
+    # a miss reloads the files once in case they changed behind our back
+    assert node.getpwnam('sgeadmin') is None
+    assert len(ssh.commands) == 2
+    ssh.passwd.append('user001:x:1001:1001::/home/user001:/bin/sh')
+    assert node.getpwnam('user001').pw_dir == '/home/user001'
+    assert len(ssh.commands) == 3
+    node.add_user('sgeadmin', uid=1000, gid=1000, shell=None)
+    assert node.getpwnam('sgeadmin').pw_uid == 1000
+    assert node.get_user_map(key_by_uid=True)[1000].pw_name == 'sgeadmin'
+    assert len([c for c in ssh.commands if c.startswith('cat')]) == 4
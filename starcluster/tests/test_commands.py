@@ -0,0 +1,43 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+from starcluster import commands
+
+
+def test_command_registry():
+    seen = set()
+    for spec in commands.all_specs:
+        cmd = spec.load()
+        assert cmd.names == spec.names
+        # the registry's help text is what 'starcluster --help' displays
+        assert cmd.__doc__.splitlines()[3].strip() == spec.help
+        seen.update(spec.names)
+    assert len(seen) == sum([len(s.names) for s in commands.all_specs])
+
+
+def test_command_map_loads_lazily():
+    specs = [commands.CommandSpec('listclusters', 'CmdListClusters',
+                                  ['listclusters', 'lc'],
+                                  'List all active clusters')]
+    loaded = []
+    scmap = commands.CommandMap(specs, on_load=loaded.append)
+    assert sorted(scmap.keys()) == ['lc', 'listclusters']
+    assert specs[0]._cmd is None
+    cmd = scmap['lc']
+    assert scmap['listclusters'] is cmd
+    assert loaded == [cmd]
+    assert scmap.get('bogus') is None
+    assert 'bogus' not in scmap
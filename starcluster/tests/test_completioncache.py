@@ -0,0 +1,60 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+import os
+import shutil
+import tempfile
+
+from starcluster import completioncache
+from starcluster.utils import AttributeDict
+
+
+def test_completion_cache():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        cfg = AttributeDict(aws=dict(aws_access_key_id='AKIAEXAMPLE'))
+        key = completioncache.get_cache_key(cfg)
+        assert key.endswith(':us-east-1')
+        assert completioncache.get_cache_key(cfg, 'eu-west-1') != key
+        cache_file = os.path.join(tmpdir, 'cache.json')
+        cache = completioncache.CompletionCache(key, cache_file=cache_file)
+        assert cache.get('clusters') == (None, False)
+        calls = []
+
+        def fetch():
+            calls.append(1)
+            return ['mycluster']
+        assert cache.fetch('clusters', fetch) == ['mycluster']
+        assert cache.fetch('clusters', fetch) == ['mycluster']
+        assert len(calls) == 1
+        # partial updates don't make the full node list fresh
+        cache.update_cluster('other', ['master', 'node001'])
+        assert cache.get('clusters') == (['mycluster', 'other'], True)
+        assert cache.get('nodes') == ({'other': ['master', 'node001']},
+                                      False)
+        cache.remove_cluster('mycluster')
+        assert cache.get('clusters')[0] == ['other']
+        # entries are kept separately for each account/region
+        other = completioncache.CompletionCache('other:region',
+                                                cache_file=cache_file)
+        assert other.get('clusters') == (None, False)
+        stale = completioncache.CompletionCache(key, cache_file=cache_file,
+                                                ttl=0)
+        assert stale.fetch('clusters', fetch, background=False) == \
+            ['mycluster']
+        assert len(calls) == 2
+    finally:
+        shutil.rmtree(tmpdir)
@@ -0,0 +1,133 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+from boto.exception import BotoServerError, EC2ResponseError
+
+from starcluster import ratelimit
+
+
+class FakeClock(object):
+    def __init__(self):
+        self.now = 0.0
+        self.slept = []
+
+    def time(self):
+        return self.now
+
+    def sleep(self, secs):
+        self.slept.append(secs)
+        self.now += secs
+
+
+def throttle_error():
+    e = EC2ResponseError(503, 'Service Unavailable')
+    e.error_code = 'RequestLimitExceeded'
+    return e
+
+
+def test_token_bucket():
+    clock = FakeClock()
+    bucket = ratelimit.TokenBucket(2, 3, clock=clock.time, sleep=clock.sleep)
+    # burst goes through without waiting
+    assert [bucket.acquire() for i in range(3)] == [0, 0, 0]
+    assert bucket.acquire() == 0.5
+    bucket.penalize()
+    assert bucket.rate == 1
+    assert bucket.acquire() == 1
+    bucket.reward()
+    assert bucket.rate == 1.2
+
+
+def test_governor_retries_throttled_requests():
+    clock = FakeClock()
+    gov = ratelimit.RateGovernor(max_retries=2, clock=clock.time,
+                                 sleep=clock.sleep)
+    attempts = []
+
+    class FakeConnection(object):
+        def get_list(self, action, params, markers):
+            attempts.append(action)
+            if len(attempts) < 3:
+                raise throttle_error()
+            return ['i-1']
+
+        def get_status(self, action, params):
+            raise EC2ResponseError(400, 'Bad Request')
+
+    conn = gov.govern(gov.govern(FakeConnection()))
+    assert conn.get_list('DescribeInstances', {}, []) == ['i-1']
+    assert attempts == ['DescribeInstances'] * 3
+    metrics = gov.metrics['DescribeInstances']
+    assert metrics['calls'] == 3
+    assert metrics['throttled'] == 2
+    assert gov.get_bucket('DescribeInstances').rate < ratelimit.READ_RATE[0]
+    # non-throttle errors are raised right away
+    try:
+        conn.get_status('TerminateInstances', {})
+        assert False, "should have raised"
+    except EC2ResponseError:
+        pass
+    assert gov.metrics['TerminateInstances']['calls'] == 1
+    del attempts[:]
+    gov.max_retries = 1
+    try:
+        conn.get_list('DescribeInstances', {}, [])
+        assert False, "should have raised"
+    except EC2ResponseError, e:
+        assert e.error_code == 'RequestLimitExceeded'
+
+
+def test_governor_disables_boto_retries():
+    clock = FakeClock()
+    gov = ratelimit.RateGovernor(max_retries=2, clock=clock.time,
+                                 sleep=clock.sleep)
+    retries = []
+
+    class FakeConnection(object):
+        def _mexe(self, request, sender=None, override_num_retries=None,
+                  retry_handler=None):
+            retries.append(override_num_retries)
+            if len(retries) == 1:
+                raise BotoServerError(502, 'Bad Gateway')
+            return 'response'
+
+        def get_status(self, action, params):
+            return self._mexe(action)
+
+    conn = gov.govern(gov.govern(FakeConnection()))
+    # transient errors are retried by the governor rather than by boto
+    assert conn.get_status('RebootInstances', {}) == 'response'
+    assert retries == [0, 0]
+    assert gov.metrics['RebootInstances']['throttled'] == 0
+    assert conn._mexe('req', override_num_retries=3) == 'response'
+    assert retries[-1] == 3
+
+
+def test_poll_interval():
+    clock = FakeClock()
+    poll = ratelimit.PollInterval(30, min_interval=2, jitter=0,
+                                  sleep=clock.sleep)
+    assert poll.next(0, 10) == 30
+    assert poll.next(5, 10) == 16
+    assert poll.next(10, 10) == 2
+    poll.sleep(0, 4)
+    poll.sleep(3, 4)
+    assert clock.slept == [30, 9]
+    assert poll.elapsed == 39
+    backoff = ratelimit.Backoff(base=1, max_delay=5, full_jitter=False)
+    for attempt, (low, high) in enumerate([(0.5, 1), (1, 2), (2, 4),
+                                           (2.5, 5), (2.5, 5)]):
+        assert low <= backoff.delay(attempt) <= high
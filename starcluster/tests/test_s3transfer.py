@@ -0,0 +1,182 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+import os
+import shutil
+import hashlib
+import tempfile
+
+import pytest
+
+from starcluster import exception
+from starcluster import transfer
+from starcluster import s3transfer
+
+
+class FakeS3(object):
+    """A minimal in-memory stand-in for boto's S3 buckets and keys"""
+    def __init__(self):
+        self.buckets = {}
+        self.requests = []
+        self.fail_after = None
+
+    def bucket(self, name, files=None):
+        bucket = FakeBucket(self, name)
+        for kname, data in (files or {}).items():
+            bucket.put(kname, data)
+        self.buckets[name] = bucket
+        return bucket
+
+
+class FakeBucket(object):
+    def __init__(self, s3, name):
+        self.s3 = s3
+        self.name = name
+        self.data = {}
+
+    def put(self, name, data):
+        self.data[name] = data
+
+    def new_key(self, name):
+        return FakeKey(self, name)
+
+    def list(self, prefix=''):
+        return [FakeKey(self, n) for n in sorted(self.data)
+                if n.startswith(prefix)]
+
+
+class FakeKey(object):
+    def __init__(self, bucket, name):
+        self.bucket = bucket
+        self.name = name
+
+    @property
+    def size(self):
+        return len(self.bucket.data[self.name])
+
+    @property
+    def etag(self):
+        return '"%s"' % hashlib.md5(self.bucket.data[self.name]).hexdigest()
+
+    def get_contents_to_file(self, fp, headers=None, cb=None, num_cb=10):
+        s3 = self.bucket.s3
+        data = self.bucket.data[self.name]
+        start, end = headers['Range'][len('bytes='):].split('-')
+        data = data[int(start):int(end) + 1]
+        s3.requests.append((self.name, headers['Range']))
+        if s3.fail_after is not None and len(s3.requests) > s3.fail_after:
+            fp.write(data[:len(data) / 2])
+            raise IOError("connection reset")
+        fp.write(data)
+        cb(len(data), len(data))
+
+    def copy(self, dst_bucket, dst_key):
+        s3 = self.bucket.s3
+        s3.requests.append((self.name, 'copy'))
+        s3.buckets[dst_bucket].put(dst_key, self.bucket.data[self.name])
+
+
+@pytest.fixture
+def destdir(request):
+    tmpdir = tempfile.mkdtemp()
+    request.addfinalizer(lambda: shutil.rmtree(tmpdir))
+    return tmpdir
+
+
+def _image(s3):
+    files = {'img.manifest.xml': 'manifest'}
+    for i in range(5):
+        files['img.part.%d' % i] = os.urandom(1000 + i)
+    files['big/img.part.5'] = os.urandom(3500)
+    return s3.bucket('src', files)
+
+
+def _read(path):
+    f = open(path, 'rb')
+    try:
+        return f.read()
+    finally:
+        f.close()
+
+
+def test_download_and_skip(destdir):
+    s3 = FakeS3()
+    src = _image(s3)
+    xfer = s3transfer.S3Transfer(workers=4, range_size=1024, progress=False)
+    stats = xfer.download(src.list(), destdir)
+    assert stats.transferred == 7
+    for name, data in src.data.items():
+        assert _read(os.path.join(destdir, *name.split('/'))) == data
+    ranges = [r for n, r in s3.requests if n == 'big/img.part.5']
+    assert sorted(ranges) == ['bytes=0-1023', 'bytes=1024-2047',
+                              'bytes=2048-3071', 'bytes=3072-3499']
+    assert not [f for f in os.listdir(destdir)
+                if transfer.PART_SUFFIX in f]
+    # corrupt one file without changing its size
+    path = os.path.join(destdir, 'img.part.0')
+    f = open(path, 'wb')
+    f.write('x' * 1000)
+    f.close()
+    s3.requests = []
+    stats = xfer.download(src.list(), destdir)
+    assert (stats.transferred, stats.skipped) == (1, 6)
+    assert s3.requests == [('img.part.0', 'bytes=0-999')]
+    assert _read(path) == src.data['img.part.0']
+
+
+def test_download_resume(destdir):
+    s3 = FakeS3()
+    src = _image(s3)
+    s3.fail_after = 3
+    xfer = s3transfer.S3Transfer(workers=1, range_size=1024, progress=False)
+    with pytest.raises(IOError):
+        xfer.download(src.list(), destdir)
+    s3.fail_after = None
+    s3.requests = []
+    stats = xfer.download(src.list(), destdir)
+    # the three 1024 byte ranges completed, img.part.4 was cut off halfway
+    assert (stats.transferred, stats.resumed) == (7, 2)
+    assert ('big/img.part.5', 'bytes=3072-3499') in s3.requests
+    assert ('img.part.4', 'bytes=502-1003') in s3.requests
+    # completed ranges are not fetched again
+    assert len(s3.requests) == 7
+    for name, data in src.data.items():
+        assert _read(os.path.join(destdir, *name.split('/'))) == data
+
+
+def test_download_checksum_mismatch(destdir):
+    s3 = FakeS3()
+    src = s3.bucket('src', {'img.part.0': 'data'})
+    key = src.list()[0]
+    src.data['img.part.0'] = 'DATA'
+    key.__class__ = type('StaleKey', (FakeKey,), {'etag': '"%s"' %
+                         hashlib.md5('data').hexdigest()})
+    xfer = s3transfer.S3Transfer(progress=False)
+    with pytest.raises(exception.BaseException):
+        xfer.download([key], destdir)
+    assert os.listdir(destdir) == []
+
+
+def test_copy_skips_existing():
+    s3 = FakeS3()
+    src = _image(s3)
+    dest = s3.bucket('dest', {'img.part.0': src.data['img.part.0'],
+                              'img.part.1': 'stale'})
+    xfer = s3transfer.S3Transfer(workers=3, progress=False)
+    stats = xfer.copy(src.list(), dest)
+    assert (stats.transferred, stats.skipped) == (6, 1)
+    assert dest.data == src.data
+    assert ('img.part.0', 'copy') not in s3.requests
@@ -0,0 +1,137 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+import time
+import shutil
+import tempfile
+
+import pytest
+
+from starcluster import spotstore
+
+PRODUCT = 'Linux/UNIX (Amazon VPC)'
+HOUR = 3600.
+
+
+def _iso(ts):
+    return time.strftime('%Y-%m-%dT%H:%M:%S.000Z', time.gmtime(ts))
+
+
+class FakePrice(object):
+    def __init__(self, ts, zone, price):
+        self.timestamp = _iso(ts)
+        self.availability_zone = zone
+        self.price = price
+
+
+class FakeResultSet(list):
+    next_token = None
+
+
+class FakeConnection(object):
+    """Serves spot price history newest first, two items per page"""
+    def __init__(self, prices):
+        self.prices = prices
+        self.requests = []
+
+    def get_spot_price_history(self, start_time=None, instance_type=None,
+                               product_description=None, next_token=None):
+        self.requests.append((start_time, next_token))
+        items = sorted(self.prices, key=lambda p: p.timestamp, reverse=True)
+        if start_time:
+            items = [p for p in items if p.timestamp >= start_time]
+        offset = int(next_token or 0)
+        page = FakeResultSet(items[offset:offset + 2])
+        if offset + 2 < len(items):
+            page.next_token = str(offset + 2)
+        return page
+
+
+@pytest.fixture
+def store(request):
+    root = tempfile.mkdtemp(prefix='sc-spot-')
+    request.addfinalizer(lambda: shutil.rmtree(root))
+    return spotstore.SpotHistoryStore(root=root)
+
+
+def test_store_incremental_update(store):
+    now = time.time()
+    conn = FakeConnection([FakePrice(now - 5 * HOUR, 'us-east-1a', 0.02),
+                           FakePrice(now - 4 * HOUR, 'us-east-1b', 0.03),
+                           FakePrice(now - 3 * HOUR, 'us-east-1a', 0.05)])
+    args = ('us-east-1', PRODUCT, 'm1.small')
+    assert store.update(conn, *args) == 3
+    # all history is fetched the first time, page by page
+    assert conn.requests == [(None, None), (None, '2')]
+    assert store.get_zones(*args) == ['us-east-1a', 'us-east-1b']
+    ts, px = store.get_series(*(args + ('us-east-1a',))).load()
+    assert list(px) == [0.02, 0.05]
+    assert list(ts) == sorted(ts)
+    # recently updated series are served from disk
+    assert store.update(conn, *args) == 0
+    assert len(conn.requests) == 2
+    # later updates only ask for new points and skip those already stored
+    conn.prices.append(FakePrice(now + 60, 'us-east-1b', 0.01))
+    conn.requests = []
+    assert store.update(conn, *args, force=True) == 1
+    assert conn.requests[0][0] is not None
+    series = store.load(*args, start=now - 3.5 * HOUR)
+    # the price in effect at start is kept as the first point
+    assert list(series['us-east-1a'][1]) == [0.02, 0.05]
+    assert list(series['us-east-1b'][1]) == [0.03, 0.01]
+    assert store.load(*args, zone='us-east-1a', end=now - 6 * HOUR) == {}
+
+
+def test_series_recovers_from_partial_append(store):
+    series = store.get_series('us-east-1', PRODUCT, 'm1.small', 'zone')
+    assert series.append([(1.0, 0.1), (2.0, 0.2)]) == 2
+    with open(series.ts_file, 'ab') as f:
+        f.write('\0' * spotstore.ITEMSIZE)
+    assert len(series) == 2
+    assert series.append([(2.0, 0.2), (3.0, 0.3)]) == 1
+    assert [list(c) for c in series.load()] == [[1.0, 2.0, 3.0],
+                                                [0.1, 0.2, 0.3]]
+
+
+def test_price_stats():
+    # 0.01 for 6 hours, 0.10 for 2 hours, 0.02 for 2 hours
+    ts = [0, 6 * HOUR, 8 * HOUR]
+    px = [0.01, 0.10, 0.02]
+    stats = spotstore.SpotPriceStats(ts, px, bid=0.05, now=10 * HOUR)
+    assert stats.current == 0.02
+    assert stats.maximum == 0.10
+    assert abs(stats.average - 0.03) < 1e-9
+    assert stats.percentiles == {50: 0.01, 90: 0.10, 99: 0.10}
+    assert stats.volatility > 1
+    assert abs(stats.risk - 0.2) < 1e-9
+    assert stats.interruptions == 1
+    assert abs(stats.interruptions_per_day - 2.4) < 1e-9
+    assert abs(stats.expected_cost - 0.0125) < 1e-9
+    # a start time after the first point only counts time since start
+    stats = spotstore.SpotPriceStats(ts, px, start=5 * HOUR, now=10 * HOUR)
+    assert abs(stats.average - 0.05) < 1e-9
+    assert stats.risk is None
+
+
+def test_rank_by_expected_cost():
+    cheap = spotstore.SpotPriceStats([0], [0.01], bid=0.05, now=HOUR)
+    risky = spotstore.SpotPriceStats([0, HOUR / 2], [0.01, 0.2], bid=0.05,
+                                     now=HOUR)
+    pricey = spotstore.SpotPriceStats([0], [0.04], bid=0.05, now=HOUR)
+    never = spotstore.SpotPriceStats([0], [0.5], bid=0.05, now=HOUR)
+    ranked = spotstore.rank_by_expected_cost(
+        {'a': never, 'b': pricey, 'c': risky, 'd': cheap})
+    assert [k for k, s in ranked] == ['d', 'c', 'b', 'a']
@@ -0,0 +1,171 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+from starcluster import sshutils
+from starcluster.node import names_regex
+
+
+def test_connection_pool_reuse():
+    pool = sshutils.SSHConnectionPool(max_channels=2)
+    c1 = pool.get('node001', username='root', password='secret')
+    c2 = pool.get('node001', username='root', password='secret')
+    c3 = pool.get('node001', username='sgeadmin', password='secret')
+    assert c1 is not c2
+    assert c1._conn is c2._conn
+    assert c1._conn is not c3._conn
+    assert pool.stats == dict(connections=2, hits=1, misses=2, reconnects=0)
+    pool.close(host='node001')
+    assert pool.stats['connections'] == 0
+
+
+class FakeTransport(object):
+    def __init__(self, healthy):
+        self.healthy = healthy
+        self.closed = False
+
+    def is_active(self):
+        return not self.closed
+
+    def send_ignore(self):
+        if not self.healthy:
+            raise EOFError()
+
+    def close(self):
+        self.closed = True
+
+
+def test_connection_pool_checks_health():
+    pool = sshutils.SSHConnectionPool()
+    client = pool.get('node001', username='root', password='secret')
+    conn = client._conn
+    # connections that were never established are not probed
+    assert pool.get_connection('node001', username='root') is conn
+    conn.transport = healthy = FakeTransport(True)
+    pool.get_connection('node001', username='root')
+    assert not healthy.closed and not conn.stale
+    conn.transport = stale = FakeTransport(False)
+    assert pool.get_connection('node001', username='root') is conn
+    # other clients may still be using a stale connection so it is only
+    # marked for reconnection on next use
+    assert not stale.closed and conn.stale
+    assert pool.stats['connections'] == 1
+
+
+def test_pooled_switch_user():
+    pool = sshutils.SSHConnectionPool()
+    c1 = pool.get('node001', username='root', password='secret')
+    c2 = pool.get('node001', username='root', password='secret')
+    root_conn = c1._conn
+    sgeadmin_conn = pool.get_connection('node001', username='sgeadmin')
+    sgeadmin_conn.transport = FakeTransport(True)
+    c1.switch_user('sgeadmin')
+    assert c1._conn is sgeadmin_conn
+    # switching users does not affect other clients of the root connection
+    assert c2._conn is root_conn and root_conn.transport is None
+    assert pool.get('node001', username='root',
+                    password='secret')._conn is root_conn
+
+
+def _run_batch_locally(batch):
+    import subprocess
+    proc = subprocess.Popen(['bash', '-s'], stdin=subprocess.PIPE,
+                            stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = proc.communicate(batch.script())
+    return batch._parse_output(stdout)
+
+
+def test_command_batch():
+    import tempfile
+    tmpdir = tempfile.mkdtemp()
+    path = tmpdir + '/sub dir/file.txt'
+    batch = sshutils.CommandBatch(None, source_profile=False)
+    batch.mkdir(tmpdir + '/sub dir', mode=0700)
+    batch.write_file(path, "line1\n'quoted' $HOME\n", mode=0600)
+    batch.execute('cat %r' % path)
+    batch.execute('false', ignore_exit_status=True)
+    batch.execute('echo oops; exit 3')
+    batch.execute('echo never')
+    results = _run_batch_locally(batch)
+    assert [r.exit_status for r in results] == [0, 0, 0, 1, 3, None]
+    assert results[2].output == ['line1', "'quoted' $HOME"]
+    assert results[4].output == ['oops']
+    assert results[5].skipped
+
+
+def test_command_batch_sources_profile_once():
+    batch = sshutils.CommandBatch(None)
+    batch.execute('true').execute('true')
+    script = batch.script()
+    assert script.count('/etc/profile') == 1
+    assert script.startswith('source /etc/profile\n')
+    assert '/etc/profile' not in sshutils.CommandBatch(
+        None, source_profile=False).execute('true').script()
+
+
+def test_command_batch_reloads_written_profile():
+    import os
+    import shutil
+    import tempfile
+    tmpdir = tempfile.mkdtemp()
+    profile = os.path.join(tmpdir, 'profile')
+    try:
+        with open(profile, 'w') as f:
+            f.write('for f in %s/profile.d/*.sh; do [ -r "$f" ] && . "$f"; '
+                    'done\n' % tmpdir)
+        batch = sshutils.CommandBatch(None)
+        batch.profile = profile
+        batch.mkdir(os.path.join(tmpdir, 'profile.d'))
+        batch.write_file(os.path.join(tmpdir, 'profile.d', 'sc.sh'),
+                         'export SC_TEST_ROOT=/opt/sc\n')
+        batch.execute('echo "root=$SC_TEST_ROOT"')
+        results = _run_batch_locally(batch)
+        assert [r.exit_status for r in results] == [0, 0, 0]
+        assert results[2].output == ['root=/opt/sc']
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_command_batch_replace_lines():
+    import os
+    import shutil
+    import tempfile
+    tmpdir = tempfile.mkdtemp()
+    path = os.path.join(tmpdir, 'hosts')
+    try:
+        with open(path, 'w') as f:
+            f.write("127.0.0.1   localhost\n\n10.0.0.9 node0011\n"
+                    "10.0.0.1 node001\n")
+        os.chmod(path, 0640)
+        regex = names_regex(['node001', 'node002'])
+        lines = ['10.0.0.1 node001', '10.0.0.2 node002']
+        batch = sshutils.CommandBatch(None, source_profile=False)
+        batch.replace_lines(path, lines, purge_regex=regex)
+        batch.replace_lines(path, lines, purge_regex=regex)
+        # no names means nothing to purge rather than an empty pattern
+        batch.replace_lines(path, [], purge_regex=names_regex([]))
+        batch.replace_lines(os.path.join(tmpdir, 'new'), lines, mode=0600)
+        results = _run_batch_locally(batch)
+        assert [r.output for r in results] == [['updated'], ['unchanged'],
+                                               ['unchanged'], ['updated']]
+        with open(path) as f:
+            assert f.read() == ("127.0.0.1   localhost\n\n"
+                                "10.0.0.9 node0011\n"
+                                "10.0.0.1 node001\n10.0.0.2 node002\n")
+        assert os.stat(path).st_mode & 0777 == 0640
+        assert os.stat(os.path.join(tmpdir, 'new')).st_mode & 0777 == 0600
+        assert sorted(os.listdir(tmpdir)) == ['hosts', 'new']
+    finally:
+        shutil.rmtree(tmpdir)
@@ -137,3 +137,50 @@ class TestThreadPool(tests.StarClusterTest):
         except exception.ThreadPoolException, e:
             assert len(e.exceptions) == r
             assert self.pool._exception_queue.qsize() == 0
+
+    def test_submit(self):
+        futures = [self.pool.submit(self._args_only, i, jobid=i)
+                   for i in range(self._jobs)]
+        assert sorted(f.result() for f in futures) == range(self._jobs)
+        assert self.pool._results_queue.qsize() == 0
+
+    def test_as_completed(self):
+        futures = [self.pool.submit(lambda x: x ** 2, (i,), jobid=i)
+                   for i in range(self._jobs)] + \
+            [self.pool.submit(lambda x: x ** 2, ('1',), jobid='bad')]
+        done = list(self.pool.as_completed(futures))
+        assert len(done) == len(futures)
+        failed = [f for f in done if f.exception() is not None]
+        assert len(failed) == 1 and failed[0].jobid == 'bad'
+        assert self.pool._exception_queue.qsize() == 0
+        try:
+            failed[0].result()
+        except exception.ThreadPoolException, e:
+            assert e.exceptions[0][2] == 'bad'
+        else:
+            raise Exception("expected ThreadPoolException")
+
+    def test_gather_without_jobids(self):
+        futures = [self.pool.submit(lambda x: x ** 2, (i,))
+                   for i in range(self._jobs)]
+        results = self.pool.gather(futures)
+        assert [results[f] for f in futures] == \
+            [i ** 2 for i in range(self._jobs)]
+
+    def test_map_jobs(self):
+        r = 20
+        results = self.pool.map_jobs(lambda x: x ** 2, range(r))
+        assert results == dict((i, i ** 2) for i in range(r))
+        try:
+            self.pool.map_jobs(lambda x: x ** 2, range(r) + ['21'])
+        except exception.ThreadPoolException, e:
+            assert len(e.exceptions) == 1
+            assert e.exceptions[0][2] == '21'
+        else:
+            raise Exception("expected ThreadPoolException")
+        try:
+            self.pool.map_jobs(lambda x: x, [1, 2], jobid_fn=lambda x: 'same')
+        except exception.BaseException, e:
+            assert 'unique' in str(e)
+        else:
+            raise Exception("expected duplicate jobids to be rejected")
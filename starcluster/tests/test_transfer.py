@@ -0,0 +1,180 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+import os
+import shutil
+import tempfile
+import subprocess
+
+from starcluster import transfer
+
+
+class LocalChannel(object):
+    """Runs a 'remote' command locally through bash"""
+    def __init__(self):
+        self.proc = None
+
+    def exec_command(self, command):
+        self.proc = subprocess.Popen(['bash', '-c', command],
+                                     stdin=subprocess.PIPE,
+                                     stdout=subprocess.PIPE,
+                                     stderr=subprocess.PIPE)
+
+    def sendall(self, data):
+        self.proc.stdin.write(data)
+
+    def shutdown_write(self):
+        self.proc.stdin.close()
+
+    def recv(self, nbytes):
+        return self.proc.stdout.read(nbytes)
+
+    def makefile_stderr(self, *args):
+        return self.proc.stderr
+
+    def recv_exit_status(self):
+        if not self.proc.stdin.closed:
+            self.proc.stdin.close()
+        self.proc.stdout.read()
+        return self.proc.wait()
+
+    def close(self):
+        pass
+
+
+class LocalSSH(object):
+    def __init__(self):
+        self.streams = 0
+
+    def execute(self, command, **kwargs):
+        proc = subprocess.Popen(['bash', '-c', command],
+                                stdout=subprocess.PIPE)
+        return [l.strip() for l in proc.communicate()[0].splitlines()]
+
+    def _open_session(self):
+        self.streams += 1
+        return LocalChannel()
+
+    def _release_channel(self):
+        pass
+
+
+def _write(path, contents):
+    with open(path, 'wb') as f:
+        f.write(contents)
+
+
+def _read(path):
+    with open(path, 'rb') as f:
+        return f.read()
+
+
+def test_put_skips_unchanged_and_resumes():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        src = os.path.join(tmpdir, 'data')
+        os.makedirs(os.path.join(src, 'sub'))
+        _write(os.path.join(src, 'a.txt'), 'a' * 1000)
+        _write(os.path.join(src, 'sub', 'b.txt'), 'b' * 5000)
+        remote = os.path.join(tmpdir, 'remote')
+        os.makedirs(remote)
+        ssh = LocalSSH()
+        for compress in (False, True):
+            ft = transfer.FileTransfer(ssh, compress=compress, streams=2)
+            stats = ft.put([src], remote)
+            assert stats.transferred == 2
+            assert stats.targets == [os.path.join(remote, 'data')]
+            dest_b = os.path.join(remote, 'data', 'sub', 'b.txt')
+            assert _read(dest_b) == 'b' * 5000
+            assert int(os.stat(dest_b).st_mtime) == int(
+                os.stat(os.path.join(src, 'sub', 'b.txt')).st_mtime)
+            shutil.rmtree(os.path.join(remote, 'data'))
+        ft = transfer.FileTransfer(ssh)
+        ft.put([src], remote)
+        ssh.streams = 0
+        stats = ft.put([src], remote)
+        assert (stats.transferred, stats.skipped) == (0, 2)
+        assert ssh.streams == 0
+        # an interrupted transfer leaves a partial file that is resumed
+        dest_a = os.path.join(remote, 'data', 'a.txt')
+        mtime_a = int(os.stat(os.path.join(src, 'a.txt')).st_mtime)
+        part_a = transfer.part_path(dest_a, 1000, mtime_a)
+        stale = transfer.part_path(dest_a, 999, mtime_a)
+        os.unlink(dest_a)
+        _write(part_a, 'a' * 400)
+        _write(stale, 'z' * 500)
+        stats = ft.put([src], remote)
+        assert (stats.transferred, stats.resumed) == (1, 1)
+        assert stats.bytes == 600
+        assert _read(dest_a) == 'a' * 1000
+        assert not os.path.exists(part_a)
+        assert not os.path.exists(stale)
+        # a part left by another version of the source is never resumed
+        os.unlink(dest_a)
+        _write(stale, 'z' * 500)
+        stats = ft.put([src], remote)
+        assert (stats.transferred, stats.resumed) == (1, 0)
+        assert _read(dest_a) == 'a' * 1000
+        assert not os.path.exists(stale)
+        # with --checksum a resumed file that does not match is re-sent
+        os.unlink(dest_a)
+        _write(part_a, 'z' * 400)
+        stats = transfer.FileTransfer(ssh, checksum=True).put([src], remote)
+        assert (stats.transferred, stats.bytes) == (1, 1000)
+        assert _read(dest_a) == 'a' * 1000
+        # same size and different mtime is only re-sent without --checksum
+        os.utime(dest_a, (0, 0))
+        stats = transfer.FileTransfer(ssh, checksum=True).put([src], remote)
+        assert stats.transferred == 0
+        assert transfer.FileTransfer(ssh).put([src], remote).transferred == 1
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+def test_get():
+    tmpdir = tempfile.mkdtemp()
+    try:
+        remote = os.path.join(tmpdir, 'remote')
+        os.makedirs(os.path.join(remote, 'sub'))
+        _write(os.path.join(remote, 'x.log'), 'x' * 3000)
+        _write(os.path.join(remote, 'sub', 'y.log'), 'y' * 10)
+        local = os.path.join(tmpdir, 'local')
+        os.makedirs(local)
+        ssh = LocalSSH()
+        ft = transfer.FileTransfer(ssh, compress=True)
+        stats = ft.get([remote], local)
+        assert stats.transferred == 2
+        assert _read(os.path.join(local, 'remote', 'sub', 'y.log')) == 'y' * 10
+        dest = os.path.join(local, 'x.log')
+        mtime = int(os.stat(os.path.join(remote, 'x.log')).st_mtime)
+        stale = transfer.part_path(dest, 3000, mtime - 1)
+        _write(transfer.part_path(dest, 3000, mtime), 'x' * 1000)
+        _write(stale, 'z' * 1000)
+        # part files on the remote side are never copied
+        _write(transfer.part_path(os.path.join(remote, 'z.log'), 5, 0), 'z')
+        stats = ft.get([os.path.join(remote, '*.log*')], local)
+        assert (stats.transferred, stats.resumed) == (1, 1)
+        assert _read(dest) == 'x' * 3000
+        assert sorted(os.listdir(local)) == ['remote', 'x.log']
+        assert ft.get([os.path.join(remote, 'x.log')], local).skipped == 1
+        try:
+            ft.get([os.path.join(remote, 'missing')], local)
+        except transfer.exception.BaseException, e:
+            assert 'missing' in e.msg
+        else:
+            raise AssertionError("missing remote path not detected")
+    finally:
+        shutil.rmtree(tmpdir)
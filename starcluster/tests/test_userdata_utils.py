@@ -106,3 +106,41 @@ def test_cloudinit_remove_no_compression():
 
 def test_non_cloudinit_remove():
     _test_remove_userdata(use_cloudinit=False)
+
+
+def _test_userdata_bundle(compress=True, use_cloudinit=True):
+    shared = [IGNORED, BASH_SCRIPT]
+    bundle = userdata.UserDataBundle(
+        utils.strings_to_files(shared, fname_prefix='sc'),
+        compress=compress, use_cloudinit=use_cloudinit)
+    for aliases in ['#ignored\nmaster', '#ignored\nnode001\nnode002']:
+        alias_file = utils.string_to_file(aliases, 'aliases')
+        ud = bundle.build([alias_file])
+        files = utils.strings_to_files(shared, fname_prefix='sc')
+        files.append(utils.string_to_file(aliases, 'aliases'))
+        expected = userdata.bundle_userdata_files(
+            files, compress=compress, use_cloudinit=use_cloudinit)
+        decompress = compress or not use_cloudinit
+        unbundled = userdata.unbundle_userdata(ud, decompress=decompress)
+        assert unbundled == userdata.unbundle_userdata(
+            expected, decompress=decompress)
+        assert unbundled['aliases'] == '#!/bin/false\n' + aliases
+        # the shared prefix is reused verbatim
+        if use_cloudinit:
+            assert abs(len(ud) - len(expected)) < 16
+
+
+def test_userdata_bundle():
+    _test_userdata_bundle(compress=True, use_cloudinit=True)
+
+
+def test_userdata_bundle_no_compression():
+    _test_userdata_bundle(compress=False, use_cloudinit=True)
+
+
+def test_userdata_bundle_non_cloudinit():
+    _test_userdata_bundle(use_cloudinit=False)
+
+
+def test_size_in_kb():
+    assert utils.size_in_kb('x' * 2048) == 2.0
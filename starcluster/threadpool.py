@@ -18,9 +18,9 @@
 """
 ThreadPool module for StarCluster based on WorkerPool
 """
-import time
 import Queue
 import thread
+import threading
 import traceback
 import workerpool
 
@@ -51,7 +51,10 @@ class DaemonWorker(workerpool.workers.Worker):
             except Exception, e:
                 tb_msg = traceback.format_exc()
                 jid = job.jobid or str(thread.get_ident())
-                self.jobs.store_exception([e, tb_msg, jid])
+                if getattr(job, 'future', None):
+                    job.future.set_exception(e, tb_msg)
+                else:
+                    self.jobs.store_exception([e, tb_msg, jid])
             finally:
                 self.jobs.task_done()
 
@@ -60,14 +63,86 @@ def _worker_factory(parent):
     return DaemonWorker(parent)
 
 
+class Future(object):
+    """
+    Handle to the eventual result of a job submitted via ThreadPool.submit
+
+    Callers block in result() on a condition variable that is signaled as
+    soon as the job finishes rather than polling the pool.
+    """
+    def __init__(self, jobid=None):
+        self.jobid = jobid
+        self._done = False
+        self._result = None
+        self._exception = None
+        self._traceback = None
+        self._cond = threading.Condition()
+
+    def done(self):
+        return self._done
+
+    def _finish(self, result=None, exc=None, tb_msg=None):
+        self._cond.acquire()
+        try:
+            self._result = result
+            self._exception = exc
+            self._traceback = tb_msg
+            self._done = True
+            self._cond.notify_all()
+        finally:
+            self._cond.release()
+
+    def set_result(self, result):
+        self._finish(result=result)
+
+    def set_exception(self, exc, tb_msg=None):
+        self._finish(exc=exc, tb_msg=tb_msg)
+
+    def _wait(self, timeout=None):
+        self._cond.acquire()
+        try:
+            if not self._done:
+                self._cond.wait(timeout)
+        finally:
+            self._cond.release()
+        return self._done
+
+    def exception(self, timeout=None):
+        """
+        Returns the exception raised by the job (or None if it succeeded)
+        waiting up to timeout seconds for the job to finish
+        """
+        if not self._wait(timeout):
+            raise exception.ThreadPoolException(
+                "Timed out waiting for job (id=%s)" % self.jobid, [])
+        return self._exception
+
+    @property
+    def traceback(self):
+        return self._traceback
+
+    def result(self, timeout=None):
+        """
+        Returns the job's return value waiting up to timeout seconds for the
+        job to finish. Raises a ThreadPoolException if the job failed.
+        """
+        exc = self.exception(timeout)
+        if exc is not None:
+            raise exception.ThreadPoolException(
+                "An error occurred in ThreadPool",
+                [[exc, self._traceback, self.jobid]])
+        return self._result
+
+
 class SimpleJob(workerpool.jobs.SimpleJob):
     def __init__(self, method, args=[], kwargs={}, jobid=None,
-                 results_queue=None):
+                 results_queue=None, future=None):
         self.method = method
         self.args = args
         self.kwargs = kwargs
         self.jobid = jobid
         self.results_queue = results_queue
+        self.future = future
 
     def run(self):
         if isinstance(self.args, list) or isinstance(self.args, tuple):
@@ -82,6 +157,8 @@ class SimpleJob(workerpool.jobs.SimpleJob):
                 r = self.method(self.args)
         else:
             r = self.method()
+        if self.future:
+            self.future.set_result(r)
         if self.results_queue:
             return self.results_queue.put(r)
         return r
@@ -94,6 +171,7 @@ class ThreadPool(workerpool.WorkerPool):
         self._exception_queue = Queue.Queue()
         self._results_queue = Queue.Queue()
         self._progress_bar = None
+        self._task_cond = threading.Condition()
         if self.disable_threads:
             size = 0
         workerpool.WorkerPool.__init__(self, size, maxjobs, worker_factory)
@@ -119,6 +197,90 @@ class ThreadPool(workerpool.WorkerPool):
         else:
             return job.run()
 
+    def submit(self, method, args=[], kwargs={}, jobid=None):
+        """
+        Schedule method(*args, **kwargs) and return a Future for its result
+
+        Unlike simple_job, exceptions raised by submitted jobs are stored on
+        the returned Future rather than in the pool's exception queue so that
+        callers can handle per-job failures as they arrive.
+        """
+        future = Future(jobid=jobid)
+        job = SimpleJob(method, args, kwargs, jobid, future=future)
+        if not self.disable_threads:
+            self.put(job)
+        else:
+            try:
+                job.run()
+            except Exception, e:
+                future.set_exception(e, traceback.format_exc())
+        return future
+
+    def as_completed(self, futures):
+        """
+        Generator that yields each future in futures as soon as it finishes
+        (successfully or not) in completion order
+        """
+        pending = list(futures)
+        while pending:
+            self._task_cond.acquire()
+            try:
+                finished = [f for f in pending if f.done()]
+                if not finished:
+                    # timeout only bounds the wait so that KeyboardInterrupt
+                    # is still delivered - any job completion wakes us early
+                    self._task_cond.wait(1)
+                    continue
+            finally:
+                self._task_cond.release()
+            for f in finished:
+                pending.remove(f)
+                yield f
+
+    def gather(self, futures):
+        """
+        Waits for all futures to finish and returns a dictionary mapping each
+        future to its result (jobids are optional and need not be unique).
+        Raises a ThreadPoolException containing every failed job once all
+        jobs have finished.
+        """
+        results = {}
+        excs = []
+        for f in self.as_completed(futures):
+            if f.exception() is not None:
+                excs.append([f.exception(), f.traceback, f.jobid])
+            else:
+                results[f] = f.result()
+        if excs:
+            raise exception.ThreadPoolException(
+                "An error occurred in ThreadPool", excs)
+        return results
+
+    def map_jobs(self, fn, *seq, **kwargs):
+        """
+        Same as map() but returns a dictionary of results keyed by jobid
+        where each jobid is given by jobid_fn(item) (defaults to the item).
+        Raises an exception if the jobids are not unique.
+        """
+        jobid_fn = kwargs.get('jobid_fn') or (lambda *item: item[0])
+        items = zip(*seq)
+        jobids = [jobid_fn(*item) for item in items]
+        if len(set(jobids)) != len(jobids):
+            raise exception.BaseException(
+                "map_jobs requires a unique jobid per item")
+        futures = [self.submit(fn, item, jobid=jobid)
+                   for item, jobid in zip(items, jobids)]
+        results = self.gather(futures)
+        return dict([(f.jobid, results[f]) for f in futures])
+
+    def task_done(self):
+        workerpool.WorkerPool.task_done(self)
+        self._task_cond.acquire()
+        try:
+            self._task_cond.notify_all()
+        finally:
+            self._task_cond.release()
+
     def get_results(self):
         results = []
         for i in range(self._results_queue.qsize()):
@@ -162,11 +324,17 @@ class ThreadPool(workerpool.WorkerPool):
         pbar.maxval = self.unfinished_tasks
         if numtasks is not None:
             pbar.maxval = max(numtasks, self.unfinished_tasks)
-        while self.unfinished_tasks != 0:
-            finished = pbar.maxval - self.unfinished_tasks
-            pbar.update(finished)
-            log.debug("unfinished_tasks = %d" % self.unfinished_tasks)
-            time.sleep(1)
+        self._task_cond.acquire()
+        try:
+            while self.unfinished_tasks != 0:
+                finished = pbar.maxval - self.unfinished_tasks
+                pbar.update(finished)
+                log.debug("unfinished_tasks = %d" % self.unfinished_tasks)
+                # woken by task_done() as soon as any job finishes - the
+                # timeout only keeps the wait interruptible (Ctrl-C)
+                self._task_cond.wait(1)
+        finally:
+            self._task_cond.release()
         if pbar.maxval != 0:
             pbar.finish()
         self.join()
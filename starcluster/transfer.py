@@ -0,0 +1,616 @@
+# Copyright 2009-2014 Justin Riley
+#
+# This file is part of StarCluster.
+#
+# StarCluster is free software: you can redistribute it and/or modify it under
+# the terms of the GNU Lesser General Public License as published by the Free
+# Software Foundation, either version 3 of the License, or (at your option) any
+# later version.
+#
+# StarCluster is distributed in the hope that it will be useful, but WITHOUT
+# ANY WARRANTY; without even the implied warranty of MERCHANTABILITY or FITNESS
+# FOR A PARTICULAR PURPOSE. See the GNU Lesser General Public License for more
+# details.
+#
+# You should have received a copy of the GNU Lesser General Public License
+# along with StarCluster. If not, see <http://www.gnu.org/licenses/>.
+
+"""
+Incremental, resumable and parallel file transfers to and from cluster nodes
+
+Unlike SSHClient.put/get, which hand everything to a single scp session, the
+FileTransfer class lists the destination once, skips files whose size and
+mtime (or md5 checksum) already match, streams the remaining files over
+several concurrent SSH channels (optionally gzip-compressed on the fly) and
+writes each file to a '.sc-part' file first so that interrupted transfers
+resume where they left off. Part files are named after the source's size and
+mtime so that a source that changed in between is never spliced onto a stale
+partial copy.
+"""
+
+import os
+import re
+import stat
+import pipes
+import zlib
+import Queue
+import hashlib
+import posixpath
+import threading
+
+from starcluster import exception
+from starcluster.logger import log
+
+PART_SUFFIX = '.sc-part'
+CHUNK_SIZE = 64 * 1024
+# max number of paths passed to a single remote mkdir/md5sum command
+ARGS_PER_COMMAND = 500
+# type, size, mtime, permissions and path of each remote file or dir
+FIND_FORMAT = "'%y\\t%s\\t%T@\\t%m\\t%p\\n'"
+PART_RE = re.compile(re.escape(PART_SUFFIX) + r'(-\d+-\d+)?$')
+
+
+def part_path(path, size, mtime):
+    """
+    Returns the partial file used while copying a source of the given size
+    and mtime to path
+    """
+    return '%s%s-%d-%d' % (path, PART_SUFFIX, size, mtime)
+
+
+def _part_glob(path):
+    """
+    Returns a shell pattern matching every partial file of path
+    """
+    return pipes.quote(path + PART_SUFFIX) + '*'
+
+
+def _remove_local_parts(path):
+    dirname, name = os.path.split(path)
+    for f in os.listdir(dirname or '.'):
+        if f.startswith(name + PART_SUFFIX) and PART_RE.search(f):
+            os.unlink(os.path.join(dirname, f))
+
+
+def _chunks(seq, size=ARGS_PER_COMMAND):
+    for i in range(0, len(seq), size):
+        yield seq[i:i + size]
+
+
+def local_md5(path):
+    md5 = hashlib.md5()
+    f = open(path, 'rb')
+    try:
+        for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+            md5.update(chunk)
+    finally:
+        f.close()
+    return md5.hexdigest()
+
+
+def run_jobs(jobs, fn, streams):
+    """
+    Calls fn(job) for each job in order using up to streams threads. No new
+    jobs are started once one fails and the first error is re-raised.
+    """
+    queue = Queue.Queue()
+    for job in jobs:
+        queue.put(job)
+    errors = []
+
+    def _worker():
+        while not errors:
+            try:
+                job = queue.get_nowait()
+            except Queue.Empty:
+                return
+            try:
+                fn(job)
+            except Exception, e:
+                errors.append(e)
+                return
+    nthreads = min(streams, len(jobs))
+    if nthreads <= 1:
+        _worker()
+    else:
+        threads = [threading.Thread(target=_worker) for i in range(nthreads)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        for t in threads:
+            # join with a timeout so that KeyboardInterrupt is delivered
+            while t.is_alive():
+                t.join(1)
+    if errors:
+        raise errors[0]
+
+
+class RemoteEntry(object):
+    def __init__(self, ftype, size, mtime, mode, path):
+        self.type = ftype
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+        self.path = path
+
+    @classmethod
+    def parse(cls, line):
+        ftype, size, mtime, mode, path = line.split('\t', 4)
+        return cls(ftype, int(size), int(float(mtime)), int(mode, 8), path)
+
+    @property
+    def isdir(self):
+        return self.type == 'd'
+
+
+class FileJob(object):
+    """
+    A single file to copy from src to dest. offset is the number of bytes
+    already present in dest's partial file.
+    """
+    def __init__(self, src, dest, size, mtime, mode, offset=0):
+        self.src = src
+        self.dest = dest
+        self.size = size
+        self.mtime = mtime
+        self.mode = mode
+        self.offset = offset
+
+    @property
+    def part(self):
+        return part_path(self.dest, self.size, self.mtime)
+
+
+class TransferStats(object):
+    def __init__(self):
+        self.transferred = 0
+        self.skipped = 0
+        self.resumed = 0
+        self.bytes = 0
+        self.targets = []
+
+    def add_job(self, job):
+        self.transferred += 1
+        self.bytes += job.size - job.offset
+        if job.offset:
+            self.resumed += 1
+
+    def __str__(self):
+        msg = "%d file(s) copied (%.1f MB)" % (self.transferred,
+                                               self.bytes / 1048576.0)
+        if self.resumed:
+            msg += ", %d resumed" % self.resumed
+        return msg + ", %d unchanged" % self.skipped
+
+
+class FileTransfer(object):
+    """
+    Copies files between the local host and the host behind an SSHClient
+
+    compress - gzip each file stream on the fly
+    checksum - compare md5 sums instead of mtimes for files of equal size
+    streams - number of files transferred concurrently
+    """
+    def __init__(self, ssh, compress=False, checksum=False, streams=4):
+        self.ssh = ssh
+        self.compress = compress
+        self.checksum = checksum
+        self.streams = max(1, streams)
+
+    def _list_remote(self, command):
+        output = self.ssh.execute(command, log_output=False)
+        entries = []
+        for line in output:
+            if line.count('\t') >= 4:
+                entries.append(RemoteEntry.parse(line))
+        return output, entries
+
+    def _remote_md5(self, paths):
+        sums = {}
+        for chunk in _chunks(paths):
+            cmd = "md5sum %s" % ' '.join(map(pipes.quote, chunk))
+            for line in self.ssh.execute(cmd, ignore_exit_status=True,
+                                         log_output=False):
+                digest, sep, path = line.partition('  ')
+                if sep:
+                    sums[path] = digest
+        return sums
+
+    def _is_unchanged(self, size, mtime, other_size, other_mtime):
+        if size != other_size:
+            return False
+        if self.checksum:
+            # md5 sums are compared in bulk by the caller
+            return None
+        return mtime == other_mtime
+
+    def _run_stream(self, command, fn):
+        """
+        Runs command on the remote host and calls fn(channel) to feed or
+        drain its stdin/stdout. Raises SCPException if the command fails.
+        """
+        channel = self.ssh._open_session()
+        try:
+            channel.exec_command(command)
+            fn(channel)
+            stderr = channel.makefile_stderr('rb', -1).read()
+            status = channel.recv_exit_status()
+        finally:
+            channel.close()
+            self.ssh._release_channel()
+        if status != 0:
+            raise exception.SCPException(
+                "remote command '%s' failed with status %d: %s" %
+                (command, status, stderr.strip()))
+
+    def _run_jobs(self, jobs, fn, stats):
+        """
+        Runs fn(job) for each job using up to self.streams threads
+        """
+        lock = threading.Lock()
+
+        def _run(job):
+            fn(job)
+            lock.acquire()
+            try:
+                stats.add_job(job)
+            finally:
+                lock.release()
+        jobs = sorted(jobs, key=lambda j: j.size - j.offset, reverse=True)
+        run_jobs(jobs, _run, self.streams)
+
+    def _verified(self, fn, job, src_md5, dest_md5):
+        """
+        Calls fn(job) and, if job resumed a partial file and checksums are
+        enabled, copies the whole file again when the result does not match
+        the source's md5 sum. Raises SCPException if the full copy does not
+        match either.
+        """
+        fn(job)
+        if not (self.checksum and job.offset):
+            return
+        if src_md5() == dest_md5():
+            return
+        log.warn("%s changed while it was being copied - copying it again" %
+                 job.src)
+        job.offset = 0
+        fn(job)
+        if src_md5() != dest_md5():
+            raise exception.SCPException("checksum mismatch copying %s -> %s"
+                                         % (job.src, job.dest))
+
+    def _local_manifest(self, lpath, dest):
+        """
+        Returns (dirs, files) needed to copy lpath to dest where files is a
+        list of (local_path, remote_path, os.stat result)
+        """
+        dirs = []
+        files = []
+        if not os.path.isdir(lpath):
+            return dirs, [(lpath, dest, os.stat(lpath))]
+        dirs.append(dest)
+        for root, dnames, fnames in os.walk(lpath):
+            rel = os.path.relpath(root, lpath)
+            rroot = dest if rel == '.' else posixpath.join(
+                dest, *rel.split(os.sep))
+            for d in sorted(dnames):
+                dirs.append(posixpath.join(rroot, d))
+            for f in sorted(fnames):
+                path = os.path.join(root, f)
+                if os.path.isfile(path):
+                    files.append((path, posixpath.join(rroot, f),
+                                  os.stat(path)))
+        return dirs, files
+
+    def put(self, localpaths, remotepath='.'):
+        """
+        Copies one or more local files or directories to remotepath on the
+        remote host and returns a TransferStats. Follows scp semantics: if
+        remotepath is a directory each local path is copied into it,
+        otherwise the single local path is copied to remotepath.
+        """
+        if not isinstance(localpaths, (list, tuple)):
+            localpaths = [localpaths]
+        localpaths = [os.path.normpath(p) for p in localpaths]
+        names = [os.path.basename(os.path.abspath(p)) for p in localpaths]
+        rpath = pipes.quote(remotepath)
+        inside = []
+        for name in names:
+            dest = posixpath.join(remotepath, name)
+            inside += [pipes.quote(dest), _part_glob(dest)]
+        cmd = ("if [ -d %(r)s ]; then echo dir; find %(inside)s %(fmt)s; "
+               "else echo nodir; find %(r)s %(rp)s %(fmt)s; fi "
+               "2>/dev/null; true")
+        cmd %= dict(r=rpath, rp=_part_glob(remotepath),
+                    inside=' '.join(inside), fmt="-printf " + FIND_FORMAT)
+        output, entries = self._list_remote(cmd)
+        remote_is_dir = output[:1] == ['dir']
+        if not remote_is_dir and len(localpaths) > 1:
+            raise exception.BaseException(
+                "Remote path is not a directory: %s" % remotepath)
+        remote = dict([(e.path, e) for e in entries])
+        stats = TransferStats()
+        dirs = []
+        files = []
+        for lpath, name in zip(localpaths, names):
+            dest = remotepath
+            if remote_is_dir:
+                dest = posixpath.join(remotepath, name)
+            stats.targets.append(dest)
+            ldirs, lfiles = self._local_manifest(lpath, dest)
+            dirs.extend([d for d in ldirs if d not in remote or
+                         not remote[d].isdir])
+            files.extend(lfiles)
+        jobs = []
+        verify = []
+        for src, dest, st in files:
+            mtime = int(st.st_mtime)
+            job = FileJob(src, dest, st.st_size, mtime,
+                          stat.S_IMODE(st.st_mode))
+            existing = remote.get(dest)
+            if existing and not existing.isdir:
+                same = self._is_unchanged(st.st_size, mtime, existing.size,
+                                          existing.mtime)
+                if same:
+                    stats.skipped += 1
+                    continue
+                elif same is None:
+                    verify.append(job)
+                    continue
+            part = remote.get(job.part)
+            if part and not part.isdir and part.size < job.size:
+                job.offset = part.size
+            jobs.append(job)
+        if verify:
+            sums = self._remote_md5([j.dest for j in verify])
+            for job in verify:
+                if sums.get(job.dest) == local_md5(job.src):
+                    stats.skipped += 1
+                else:
+                    jobs.append(job)
+        for chunk in _chunks(dirs):
+            self.ssh.execute("mkdir -p %s" % ' '.join(map(pipes.quote,
+                                                          chunk)))
+        self._run_jobs(jobs, self._put_file, stats)
+        return stats
+
+    def _put_file(self, job):
+        self._verified(self._send_file, job, lambda: local_md5(job.src),
+                       lambda: self._remote_md5([job.dest]).get(job.dest))
+
+    def _send_file(self, job):
+        log.debug("sending %s -> %s (offset %d)" % (job.src, job.dest,
+                                                    job.offset))
+        part = pipes.quote(job.part)
+        dest = pipes.quote(job.dest)
+        redirect = '>>' if job.offset else '>'
+        reader = 'gzip -dc' if self.compress else 'cat'
+        # stale parts left by other versions of the file are removed once
+        # the copy is complete
+        cmd = ("%s %s %s && mv -f %s %s && rm -f %s && touch -m -d @%d %s "
+               "&& chmod %o %s")
+        cmd %= (reader, redirect, part, part, dest, _part_glob(job.dest),
+                job.mtime, dest, job.mode, dest)
+
+        def _send(channel):
+            compressor = None
+            if self.compress:
+                compressor = zlib.compressobj(6, zlib.DEFLATED,
+                                              16 + zlib.MAX_WBITS)
+            f = open(job.src, 'rb')
+            try:
+                f.seek(job.offset)
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), ''):
+                    if compressor:
+                        chunk = compressor.compress(chunk)
+                    if chunk:
+                        channel.sendall(chunk)
+            finally:
+                f.close()
+            if compressor:
+                channel.sendall(compressor.flush())
+            channel.shutdown_write()
+        self._run_stream(cmd, _send)
+
+    def get(self, remotepaths, localpath=''):
+        """
+        Copies one or more remote files or directories (glob patterns are
+        expanded on the remote host) to localpath and returns a
+        TransferStats. Raises BaseException if a remote path does not exist.
+        """
+        if not isinstance(remotepaths, (list, tuple)):
+            remotepaths = [remotepaths]
+        localpath = localpath or os.getcwd()
+        args = []
+        for rpath in remotepaths:
+            if any(c in rpath for c in '*?['):
+                # leave glob characters unquoted for the remote shell
+                args.append(rpath.replace(' ', '\\ '))
+            else:
+                args.append(pipes.quote(rpath))
+        cmd = ('for p in %s; do if [ -e "$p" ]; then printf "T\\t%%s\\n" '
+               '"$p"; find -L "$p" -printf %s; else printf "M\\t%%s\\n" "$p"; '
+               'fi; done 2>/dev/null; true')
+        cmd %= (' '.join(args), FIND_FORMAT)
+        output, entries = self._list_remote(cmd)
+        missing = [l[2:] for l in output if l.startswith('M\t')]
+        if missing:
+            raise exception.BaseException(
+                "Remote file or directory does not exist: %s" %
+                ', '.join(missing))
+        tops = [l[2:] for l in output if l.startswith('T\t')]
+        local_is_dir = os.path.isdir(localpath)
+        if not local_is_dir and len(tops) > 1:
+            raise exception.BaseException(
+                "Local path is not a directory: %s" % localpath)
+        stats = TransferStats()
+        jobs = []
+        verify = []
+        dirs = []
+        top = None
+        base = None
+        for entry in entries:
+            if entry.path in tops:
+                top = entry.path
+                base = localpath
+                if local_is_dir:
+                    base = os.path.join(localpath,
+                                        posixpath.basename(top.rstrip('/')))
+                stats.targets.append(base)
+            rel = entry.path[len(top):].lstrip('/')
+            dest = os.path.join(base, *rel.split('/')) if rel else base
+            if entry.isdir:
+                dirs.append((dest, entry.mode))
+                continue
+            elif entry.type != 'f' or PART_RE.search(entry.path):
+                continue
+            job = FileJob(entry.path, dest, entry.size, entry.mtime,
+                          entry.mode)
+            if os.path.isfile(dest):
+                st = os.stat(dest)
+                same = self._is_unchanged(entry.size, entry.mtime,
+                                          st.st_size, int(st.st_mtime))
+                if same:
+                    stats.skipped += 1
+                    continue
+                elif same is None:
+                    verify.append(job)
+                    continue
+            if os.path.isfile(job.part):
+                partsize = os.path.getsize(job.part)
+                if partsize < job.size:
+                    job.offset = partsize
+            jobs.append(job)
+        if verify:
+            sums = self._remote_md5([j.src for j in verify])
+            for job in verify:
+                if sums.get(job.src) == local_md5(job.dest):
+                    stats.skipped += 1
+                else:
+                    jobs.append(job)
+        for d, mode in dirs:
+            if not os.path.isdir(d):
+                os.makedirs(d)
+                os.chmod(d, mode)
+        self._run_jobs(jobs, self._get_file, stats)
+        return stats
+
+    def _get_file(self, job):
+        self._verified(self._fetch_file, job,
+                       lambda: self._remote_md5([job.src]).get(job.src),
+                       lambda: local_md5(job.dest))
+
+    def _fetch_file(self, job):
+        log.debug("fetching %s -> %s (offset %d)" % (job.src, job.dest,
+                                                     job.offset))
+        cmd = "tail -c +%d %s" % (job.offset + 1, pipes.quote(job.src))
+        if self.compress:
+            cmd += " | gzip -c"
+        f = open(job.part, 'ab' if job.offset else 'wb')
+
+        def _recv(channel):
+            decompressor = None
+            if self.compress:
+                decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+            for chunk in iter(lambda: channel.recv(CHUNK_SIZE), ''):
+                if decompressor:
+                    chunk = decompressor.decompress(chunk)
+                f.write(chunk)
+            if decompressor:
+                f.write(decompressor.flush())
+        try:
+            self._run_stream(cmd, _recv)
+        finally:
+            f.close()
+        if os.path.exists(job.dest):
+            os.unlink(job.dest)
+        os.rename(job.part, job.dest)
+        _remove_local_parts(job.dest)
+        os.utime(job.dest, (job.mtime, job.mtime))
+        os.chmod(job.dest, job.mode)
+
+
+def put_to_nodes(nodes, localpaths, remotepath, pool, relay=False,
+                 **kwargs):
+    """
+    Copies localpaths to remotepath on every node in nodes concurrently and
+    returns a dictionary mapping node alias to TransferStats (or None for
+    nodes fed by relay).
+
+    If relay is True the files are only uploaded to the first node in nodes
+    and then copied from node to node with rsync, doubling the number of
+    nodes that have the files each round, so that the local uplink is only
+    used once. Remaining kwargs are passed to FileTransfer.
+    """
+    nodes = list(nodes)
+    if relay and len(nodes) > 1:
+        if nodes[0].ssh.has_required(['rsync']):
+            return _relay_put(nodes, localpaths, remotepath, pool, **kwargs)
+        log.warn("rsync not found on %s - copying to each node directly" %
+                 nodes[0].alias)
+
+    def _put(node):
+        stats = FileTransfer(node.ssh, **kwargs).put(localpaths, remotepath)
+        log.info("%s: %s" % (node.alias, stats))
+        return stats
+    return pool.map_jobs(_put, nodes, jobid_fn=lambda n: n.alias)
+
+
+def _relay_put(nodes, localpaths, remotepath, pool, **kwargs):
+    seed = nodes[0]
+    stats = FileTransfer(seed.ssh, **kwargs).put(localpaths, remotepath)
+    log.info("%s: %s" % (seed.alias, stats))
+    results = {seed.alias: stats}
+    parent = posixpath.dirname(stats.targets[0].rstrip('/')) or '.'
+    srcs = ' '.join(map(pipes.quote, stats.targets))
+    rsync = "rsync -a --partial"
+    if kwargs.get('compress'):
+        rsync += " -z"
+    if kwargs.get('checksum'):
+        rsync += " --checksum"
+    # nodes already know each other's host keys (see
+    # DefaultClusterSetup._setup_passwordless_ssh)
+    rsync += " --rsync-path=%s"
+    rsync %= pipes.quote("mkdir -p %s && rsync" % pipes.quote(parent))
+
+    def _hop(src, dest):
+        log.debug("relaying %s -> %s" % (src.alias, dest.alias))
+        src.ssh.execute("%s %s %s:%s/" % (rsync, srcs, dest.alias,
+                                          pipes.quote(parent)))
+    have = [seed]
+    pending = nodes[1:]
+    while pending:
+        dests = pending[:len(have)]
+        pending = pending[len(have):]
+        log.info("Relaying to %s" % ', '.join([n.alias for n in dests]))
+        pool.map_jobs(_hop, have[:len(dests)], dests,
+                      jobid_fn=lambda src, dest: dest.alias)
+        for node in dests:
+            results[node.alias] = None
+        have.extend(dests)
+    return results
+
+
+def get_from_nodes(nodes, remotepaths, localpath, pool, **kwargs):
+    """
+    Copies remotepaths from every node in nodes concurrently and returns a
+    dictionary mapping node alias to TransferStats. When more than one node
+    is given each node's files are stored in localpath/<node alias>.
+    Remaining kwargs are passed to FileTransfer.
+    """
+    nodes = list(nodes)
+    multi = len(nodes) > 1
+    if multi and not os.path.isdir(localpath):
+        raise exception.BaseException(
+            "Local path is not a directory: %s" % localpath)
+
+    def _get(node):
+        dest = localpath
+        if multi:
+            dest = os.path.join(localpath, node.alias)
+            if not os.path.isdir(dest):
+                os.makedirs(dest)
+        stats = FileTransfer(node.ssh, **kwargs).get(remotepaths, dest)
+        log.info("%s: %s" % (node.alias, stats))
+        return stats
+    return pool.map_jobs(_get, nodes, jobid_fn=lambda n: n.alias)
@@ -18,6 +18,7 @@
 import os
 import re
 import time
+import zlib
 import gzip
 import email
 import base64
@@ -57,30 +58,32 @@ def _get_type_from_fp(fp):
     raise exception.BaseException("invalid user data type: %s" % line)
 
 
+def _mime_part(fp, index):
+    mtype = _get_type_from_fp(fp)
+    maintype, subtype = mtype.split('/', 1)
+    if maintype == 'text':
+        # Note: we should handle calculating the charset
+        msg = text.MIMEText(fp.read(), _subtype=subtype)
+        fp.close()
+    else:
+        if hasattr(fp, 'name'):
+            fp = open(fp.name, 'rb')
+        msg = base.MIMEBase(maintype, subtype)
+        msg.set_payload(fp.read())
+        fp.close()
+        # Encode the payload using Base64
+        encoders.encode_base64(msg)
+    # Set the filename parameter
+    fname = getattr(fp, 'name', "sc_%d" % index)
+    msg.add_header('Content-Disposition', 'attachment',
+                   filename=os.path.basename(fname))
+    return msg
+
+
 def mp_userdata_from_files(files, compress=False, multipart_mime=None):
     outer = multipart_mime or multipart.MIMEMultipart()
-    mtypes = []
     for i, fp in enumerate(files):
-        mtype = _get_type_from_fp(fp)
-        mtypes.append(mtype)
-        maintype, subtype = mtype.split('/', 1)
-        if maintype == 'text':
-            # Note: we should handle calculating the charset
-            msg = text.MIMEText(fp.read(), _subtype=subtype)
-            fp.close()
-        else:
-            if hasattr(fp, 'name'):
-                fp = open(fp.name, 'rb')
-            msg = base.MIMEBase(maintype, subtype)
-            msg.set_payload(fp.read())
-            fp.close()
-            # Encode the payload using Base64
-            encoders.encode_base64(msg)
-        # Set the filename parameter
-        fname = getattr(fp, 'name', "sc_%d" % i)
-        msg.add_header('Content-Disposition', 'attachment',
-                       filename=os.path.basename(fname))
-        outer.attach(msg)
+        outer.attach(_mime_part(fp, i))
     userdata = outer.as_string()
     if compress:
         s = StringIO.StringIO()
@@ -169,28 +172,130 @@ open(akf, 'w').write(fixed)
 """
 
 
-def bundle_userdata_files(fileobjs, tar_fname=None, compress=True,
-                          use_cloudinit=True):
+def _disable_ignored_files(fileobjs):
+    """
+    Turns '#ignored' files in fileobjs into scripts that do nothing and
+    returns True if any of the files requires cloud-init
+    """
     script_type = starts_with_mappings['#!']
     ignored_type = starts_with_mappings['#ignored']
+    needs_cloudinit = False
     for i, fobj in enumerate(fileobjs):
         ftype = _get_type_from_fp(fobj)
         if ftype == ignored_type:
             fileobjs[i] = utils.string_to_file("#!/bin/false\n" + fobj.read(),
                                                fobj.name)
-            continue
         elif ftype != script_type:
-            use_cloudinit = True
+            needs_cloudinit = True
+    return needs_cloudinit
+
+
+def _add_bootstrap_file(fileobjs, use_cloudinit):
     if use_cloudinit:
         fileobjs += [utils.string_to_file('#cloud-config\ndisable_root: 0',
                                           'starcluster_cloud_config.txt')]
-        return mp_userdata_from_files(fileobjs, compress=compress)
     else:
         fileobjs += [utils.string_to_file(ENABLE_ROOT_LOGIN_SCRIPT,
                                           'starcluster_enable_root_login.sh')]
+
+
+def bundle_userdata_files(fileobjs, tar_fname=None, compress=True,
+                          use_cloudinit=True):
+    if _disable_ignored_files(fileobjs):
+        use_cloudinit = True
+    _add_bootstrap_file(fileobjs, use_cloudinit)
+    if use_cloudinit:
+        return mp_userdata_from_files(fileobjs, compress=compress)
+    else:
         return userdata_script_from_files(fileobjs, tar_fname=tar_fname)
 
 
+class UserDataBundle(object):
+    """
+    User data bundle whose shared files are encoded and compressed only once
+
+    Nodes launched together share the same plugins, volumes and user scripts
+    and only differ in small per-node files such as their aliases. build()
+    encodes the per-node files and feeds them to a copy of the compressor
+    state left after the shared files, so the cost of building user data for
+    each node does not depend on the size of the shared payload. The result
+    is identical in format to bundle_userdata_files().
+    """
+    def __init__(self, fileobjs, use_cloudinit=True, compress=True):
+        fileobjs = list(fileobjs)
+        if _disable_ignored_files(fileobjs):
+            use_cloudinit = True
+        _add_bootstrap_file(fileobjs, use_cloudinit)
+        self.use_cloudinit = use_cloudinit
+        # the script format is always gzipped
+        self.compress = compress or not use_cloudinit
+        self._num_files = len(fileobjs)
+        if use_cloudinit:
+            outer = multipart.MIMEMultipart()
+            for i, fp in enumerate(fileobjs):
+                outer.attach(_mime_part(fp, i))
+            head = outer.as_string()
+            self._boundary = outer.get_boundary()
+            # leave the multipart open so that build() can add more parts
+            head = head[:-len(self._mime_closing)]
+        else:
+            self._mtime = time.time()
+            tfd = StringIO.StringIO()
+            tf = tarfile.TarFile(mode='w', fileobj=tfd)
+            self._add_tar_members(tf, fileobjs)
+            # not closing tf leaves out the end-of-archive blocks
+            head = tfd.getvalue()
+        self._zobj = None
+        if self.compress:
+            self._zobj = zlib.compressobj(9, zlib.DEFLATED,
+                                          16 + zlib.MAX_WBITS)
+            head = self._zobj.compress(head)
+        self._head = head
+
+    @property
+    def _mime_closing(self):
+        return '\n--%s--\n' % self._boundary
+
+    def _add_tar_members(self, tf, fileobjs):
+        for f in fileobjs:
+            data = f.read()
+            ti = tarfile.TarInfo(os.path.basename(f.name))
+            ti.mtime = self._mtime
+            ti.size = len(data)
+            if data.startswith('#!'):
+                ti.mode = 0755
+            tf.addfile(ti, StringIO.StringIO(data))
+
+    def _finish(self, tail):
+        if not self._zobj:
+            return self._head + tail
+        zobj = self._zobj.copy()
+        return self._head + zobj.compress(tail) + zobj.flush()
+
+    def build(self, fileobjs=[]):
+        """
+        Returns the user data string for the shared files plus fileobjs
+        """
+        fileobjs = list(fileobjs)
+        if _disable_ignored_files(fileobjs) and not self.use_cloudinit:
+            raise exception.BaseException(
+                "per-node user data files must be scripts when cloud-init "
+                "is disabled")
+        if self.use_cloudinit:
+            parts = []
+            for i, fp in enumerate(fileobjs):
+                part = _mime_part(fp, self._num_files + i)
+                delim = '\n--%s\n' % self._boundary
+                parts.append(delim + part.as_string())
+            return self._finish(''.join(parts) + self._mime_closing)
+        tfd = StringIO.StringIO()
+        tf = tarfile.TarFile(mode='w', fileobj=tfd)
+        self._add_tar_members(tf, fileobjs)
+        tf.close()
+        gzipped = self._finish(tfd.getvalue())
+        return SCRIPT_TEMPLATE % base64.b64encode(gzipped)
+
+
 def unbundle_userdata(string, decompress=True):
     udata = {}
     if string.startswith('#!'):
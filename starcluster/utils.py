@@ -631,6 +631,11 @@ def get_fq_class_name(obj):
 
 
 def size_in_kb(obj):
+    """
+    Returns the size of a string in KB (or of any other object in memory)
+    """
+    if isinstance(obj, basestring):
+        return len(obj) / 1024.
     return sys.getsizeof(obj) / 1024.
 
 
@@ -285,16 +285,17 @@ class VolumeCreator(cluster.Cluster):
             self._validate_required_progs([self._mkfs_cmd.split()[0]])
             self._determine_device()
             vol = self._create_volume(volume_size, volume_zone)
-            if tags:
-                for tag in tags:
-                    tagval = tags.get(tag)
-                    tagmsg = "Adding volume tag: %s" % tag
-                    if tagval:
-                        tagmsg += "=%s" % tagval
-                    log.info(tagmsg)
-                    vol.add_tag(tag, tagval)
-            if name:
-                vol.add_tag("Name", name)
+            with self.ec2.tag_batch():
+                if tags:
+                    for tag in tags:
+                        tagval = tags.get(tag)
+                        tagmsg = "Adding volume tag: %s" % tag
+                        if tagval:
+                            tagmsg += "=%s" % tagval
+                        log.info(tagmsg)
+                        self.ec2.add_tags(vol, {tag: tagval})
+                if name:
+                    self.ec2.add_tags(vol, {"Name": name})
             self._attach_volume(self._volume, instance.id,
                                 self._aws_block_device)
             self._get_volume_device(self._aws_block_device)
@@ -117,6 +117,7 @@ class TemplateHandler(DocrootHandler):
     _bin_exts = ('.ico', '.gif', '.jpg', '.png')
 
     def do_GET(self):
+        import jinja2
         relpath = self.path[1:].split('?')[0]
         if relpath == "shutdown":
             self.do_shutdown()
@@ -133,7 +134,7 @@ class TemplateHandler(DocrootHandler):
             self.send_header('Content-type', content_type)
             self.end_headers()
             self.wfile.write(data)
-        except IOError, templates.TemplateNotFound:
+        except (IOError, jinja2.TemplateNotFound):
             self.send_error(404, 'File Not Found: %s' % self.path)
             return
 